@@ -0,0 +1,145 @@
+import functools
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# 每次参与哈希的字节数，避免为计算指纹而拷贝整个体数据
+HASH_CHUNK_BYTES = 64 * 1024 * 1024
+
+
+def fingerprint_array(numpy_data):
+    """数据集的内容指纹，磁盘上的内存映射数据使用文件身份以免读取整个文件"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((numpy_data.shape, numpy_data.dtype.str)).encode())
+    if isinstance(numpy_data, np.memmap) and numpy_data.mode in ('r', 'c') and numpy_data.filename:
+        stat = os.stat(numpy_data.filename)
+        digest.update(repr((numpy_data.filename, numpy_data.offset, stat.st_size, stat.st_mtime_ns)).encode())
+        return digest.hexdigest()
+    flat = numpy_data.reshape(-1, order='A') if numpy_data.flags.forc else np.ravel(numpy_data)
+    step = max(HASH_CHUNK_BYTES // max(flat.itemsize, 1), 1)
+    for start in range(0, flat.size, step):
+        digest.update(np.ascontiguousarray(flat[start:start + step]).view(np.uint8))
+    return digest.hexdigest()
+
+
+def derive_fingerprint(fingerprint, name, args, kwargs, precision=None):
+    """处理结果的指纹由输入指纹和操作名、参数(及精度策略)决定，不需要再对结果做哈希"""
+    key = repr((fingerprint, name, args, sorted(kwargs.items())) + ((precision,) if precision is not None else ()))
+    return hashlib.blake2b(key.encode(), digest_size=16).hexdigest()
+
+
+class ResultCache:
+    """按LRU淘汰的处理结果缓存
+
+    内存中缓存的数组总大小不超过max_bytes，被淘汰的结果在设置了disk_dir时
+    写入磁盘，命中时以内存映射方式读回。缓存中保存的是结果的只读视图(不拷贝)，命中时返回的
+    数组是只读的，同一个结果可以被多个窗口共享；原地修改前用holds()检查，需要时先拷贝。
+    """
+
+    def __init__(self, max_bytes=1024 * 1024 * 1024, disk_dir=None, max_disk_bytes=8 * 1024 * 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.enabled = True
+        self.memory = OrderedDict()  # key -> numpy数组
+        self.disk = OrderedDict()  # key -> (文件路径, 字节数)
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return self.memory[key]
+            if key in self.disk:
+                path, _ = self.disk[key]
+                self.disk.move_to_end(key)
+                self.hits += 1
+                return np.load(path, mmap_mode='r')
+            self.misses += 1
+            return None
+
+    def put(self, key, numpy_data):
+        if numpy_data is None:
+            return
+        # 调用者的数组保持可写，缓存只保存只读视图
+        numpy_data = numpy_data.view()
+        numpy_data.flags.writeable = False
+        with self.lock:
+            if key in self.memory:
+                return
+            if numpy_data.nbytes > self.max_bytes:
+                self._spill(key, numpy_data)
+                return
+            self.memory[key] = numpy_data
+            self.memory_bytes += numpy_data.nbytes
+            while self.memory_bytes > self.max_bytes:
+                old_key, old_data = self.memory.popitem(last=False)
+                self.memory_bytes -= old_data.nbytes
+                self._spill(old_key, old_data)
+
+    def holds(self, numpy_data):
+        """内存中缓存的某个结果是否与numpy_data共用内存(原地修改numpy_data会改变缓存的结果)"""
+        with self.lock:
+            return any(np.may_share_memory(numpy_data, cached) for cached in self.memory.values())
+
+    def clear(self):
+        with self.lock:
+            self.memory.clear()
+            self.memory_bytes = 0
+            for path, _ in self.disk.values():
+                _remove_file(path)
+            self.disk.clear()
+            self.disk_bytes = 0
+
+    def _spill(self, key, numpy_data):
+        """写入磁盘缓存层（调用时已持有锁）"""
+        if self.disk_dir is None or key in self.disk or numpy_data.nbytes > self.max_disk_bytes:
+            return
+        os.makedirs(self.disk_dir, exist_ok=True)
+        path = os.path.join(self.disk_dir, key + '.npy')
+        np.save(path, numpy_data)
+        self.disk[key] = (path, numpy_data.nbytes)
+        self.disk_bytes += numpy_data.nbytes
+        while self.disk_bytes > self.max_disk_bytes:
+            _, (old_path, old_bytes) = self.disk.popitem(last=False)
+            self.disk_bytes -= old_bytes
+            _remove_file(old_path)
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+result_cache = ResultCache(max_bytes=int(os.environ.get('MEDICALVIS_CACHE_MB', 1024)) * 1024 * 1024,
+                           disk_dir=os.environ.get('MEDICALVIS_CACHE_DIR'))
+
+
+def cached_operation(func):
+    """DataManager处理函数的装饰器：相同数据集、相同操作和参数直接返回缓存结果"""
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if not result_cache.enabled or self.numpy_data is None:
+            return func(self, *args, **kwargs)
+        key = derive_fingerprint(self.fingerprint(), func.__name__, args, kwargs, self.precision)
+        numpy_data = result_cache.get(key)
+        if numpy_data is not None:
+            result = self.derived(numpy_data)
+        else:
+            result = func(self, *args, **kwargs)
+            result_cache.put(key, result.numpy_data)
+        result._fingerprint = key
+        return result
+
+    return wrapper
@@ -0,0 +1,150 @@
+import numpy as np
+
+from Lazy import lazy_import
+from Spectral import WORKERS
+
+sp_fft = lazy_import('scipy.fft')
+ndimage = lazy_import('scipy.ndimage')
+
+# 代价模型的相对系数：空间卷积每个核元素的耗时与FFT每个元素每log2(N)的耗时
+SPATIAL_TAP_COST = 0.5
+FFT_COST = 1.1
+# 整数数据逐轴一维FFT(float64)每个元素每log2(N)的耗时
+INTEGER_FFT_COST = 5.0
+# 整数数据的FFT路径每次变换的频谱字节数上限，按块处理以限制float64工作数组的内存
+FFT_BLOCK_BYTES = 256 * 1024 * 1024
+# 与整数的差小于该值乘以数据最大绝对值时视为整数(float64 FFT的舍入误差约为1e-15倍)
+SNAP_EPS = 1e-13
+
+
+def uniform_filter(data, size):
+    """均值滤波，每个轴一次滑动窗口累加，耗时与核大小无关
+
+    浮点数据直接使用ndimage.uniform_filter。整数数据若交给ndimage，每个轴的结果
+    都会截断为整数，且滑动累加的舍入误差与位置有关，同一体数据分块计算与整体
+    计算的结果会相差1。这里先求出精确的窗口和（float64中整数和是精确的），
+    最后除以核体积并截断，结果与分块方式无关。
+    """
+    if not np.issubdtype(data.dtype, np.integer):
+        return ndimage.uniform_filter(data, size=size)
+    sizes = (size,) * data.ndim if np.isscalar(size) else tuple(size)
+    window_sum = data
+    for axis, k in enumerate(sizes):
+        if k > 1:
+            window_sum = ndimage.uniform_filter1d(window_sum, k, axis=axis, output=np.float64)
+            window_sum *= k
+            np.rint(window_sum, out=window_sum)
+    window_sum = np.asarray(window_sum, dtype=np.float64)
+    window_sum /= np.prod(sizes)
+    return np.trunc(window_sum, out=window_sum).astype(data.dtype)
+
+
+def gaussian_radius(sigma, truncate=4.0):
+    """与ndimage.gaussian_filter相同的核半径"""
+    return int(truncate * float(sigma) + 0.5)
+
+
+def gaussian_method(shape, sigma, dtype=None):
+    """根据核大小、数据形状与类型估计耗时，选择可分离空间卷积('spatial')或FFT卷积('fft')"""
+    sigmas = (sigma,) * len(shape) if np.isscalar(sigma) else tuple(sigma)
+    radii = [gaussian_radius(s) if s > 0 else 0 for s in sigmas]
+    voxels = float(np.prod(shape))
+    spatial = SPATIAL_TAP_COST * voxels * sum(2 * r + 1 for r in radii if r > 0)
+    if dtype is not None and np.issubdtype(dtype, np.integer):
+        # 整数数据逐轴变换(见_gaussian_fft_integer)，每次只在该轴上补边
+        lengths = [(n, sp_fft.next_fast_len(n + 2 * r, real=True)) for n, r in zip(shape, radii) if r > 0]
+        fft = INTEGER_FFT_COST * voxels * sum(m / n * np.log2(max(m, 2)) for n, m in lengths)
+    else:
+        padded = float(np.prod([sp_fft.next_fast_len(n + 2 * r, real=True) for n, r in zip(shape, radii)]))
+        fft = FFT_COST * padded * np.log2(max(padded, 2.0))
+    return 'fft' if fft < spatial else 'spatial'
+
+
+def gaussian_filter(data, sigma, method='auto'):
+    """高斯滤波，大sigma时在频域相乘代替空间卷积
+
+    FFT路径使用与ndimage相同的截断离散高斯核，按'reflect'补边后做循环卷积。浮点数据整体做一次
+    多维FFT，float32数据用float32计算，float64数据用float64计算，结果在浮点误差范围内与
+    ndimage.gaussian_filter一致。整数数据见_gaussian_fft_integer，结果与ndimage相同。
+    """
+    if method == 'auto':
+        method = gaussian_method(data.shape, sigma, data.dtype)
+    if method == 'spatial':
+        return ndimage.gaussian_filter(data, sigma)
+
+    sigmas = (sigma,) * data.ndim if np.isscalar(sigma) else tuple(sigma)
+    radii = [gaussian_radius(s) if s > 0 else 0 for s in sigmas]
+    if np.issubdtype(data.dtype, np.integer):
+        return _gaussian_fft_integer(data, sigmas, radii)
+    work = np.float32 if data.dtype == np.float32 else np.float64
+    padded = np.pad(data.astype(work, copy=False), [(r, r) for r in radii], mode='symmetric')
+    shape = [sp_fft.next_fast_len(n, real=True) for n in padded.shape]
+    spectrum = sp_fft.rfftn(padded, s=shape, workers=WORKERS)
+    del padded
+    for axis, (n, s, r) in enumerate(zip(shape, sigmas, radii)):
+        if r == 0:
+            continue
+        freqs = sp_fft.rfftfreq(n) if axis == data.ndim - 1 else sp_fft.fftfreq(n)
+        response = _gaussian_response(s, r, freqs, work)
+        broadcast = [1] * data.ndim
+        broadcast[axis] = response.size
+        spectrum *= response.reshape(broadcast)
+    result = sp_fft.irfftn(spectrum, s=shape, workers=WORKERS)
+    result = result[tuple(slice(r, r + n) for r, n in zip(radii, data.shape))]
+    return result.astype(data.dtype)
+
+
+def _gaussian_fft_integer(data, sigmas, radii):
+    """整数数据的FFT高斯滤波，结果与ndimage.gaussian_filter相同
+
+    ndimage对整数数据逐个轴滤波，每个轴的结果都向零截断为整数，因此这里也逐个轴在float64中
+    做一维FFT卷积并截断。本应为整数的值(如常数区域)因FFT的舍入误差可能略小于该整数，截断后会
+    差1，所以与整数的差在误差范围内的值先取为该整数。沿另一个轴分块计算，限制工作数组的内存。
+    """
+    source = data
+    info = np.iinfo(data.dtype)
+    tolerance = SNAP_EPS * max(abs(float(np.min(data))), abs(float(np.max(data))), 1.0)
+    for axis, (s, r) in enumerate(zip(sigmas, radii)):
+        if r == 0:
+            continue
+        n = sp_fft.next_fast_len(data.shape[axis] + 2 * r, real=True)
+        response = _gaussian_response(s, r, sp_fft.rfftfreq(n), np.float64)
+        response = response.reshape([-1 if a == axis else 1 for a in range(data.ndim)])
+        result = np.empty_like(data)
+        block_axis = 1 if axis == 0 and data.ndim > 1 else 0
+        # 一层(block_axis上一个下标)的频谱字节数
+        layer_bytes = 16 * (n // 2 + 1) * (data.size // max(data.shape[axis] * data.shape[block_axis], 1))
+        depth = data.shape[block_axis] if block_axis == axis else max(FFT_BLOCK_BYTES // max(layer_bytes, 1), 1)
+        for start in range(0, data.shape[block_axis], depth):
+            index = [slice(None)] * data.ndim
+            index[block_axis] = slice(start, start + depth)
+            index = tuple(index)
+            padding = [(0, 0)] * data.ndim
+            padding[axis] = (r, r)
+            padded = np.pad(data[index].astype(np.float64), padding, mode='symmetric')
+            spectrum = sp_fft.rfft(padded, n=n, axis=axis, workers=WORKERS)
+            del padded
+            spectrum *= response
+            filtered = sp_fft.irfft(spectrum, n=n, axis=axis, workers=WORKERS)
+            del spectrum
+            filtered = filtered[tuple(slice(r, r + data.shape[axis]) if a == axis else slice(None)
+                                      for a in range(data.ndim))]
+            nearest = np.rint(filtered)
+            snap = np.abs(filtered - nearest) <= tolerance
+            filtered[snap] = nearest[snap]
+            np.clip(filtered, info.min, info.max, out=filtered)
+            # 与ndimage一样向零截断
+            np.copyto(result[index], filtered, casting='unsafe')
+        data = result
+    return data.copy() if data is source else data
+
+
+def _gaussian_response(sigma, radius, freqs, dtype=np.float32):
+    """截断离散高斯核(对称)的DFT：phi0 + 2 * sum(phi_i * cos(2 pi f i))"""
+    x = np.arange(radius + 1)
+    phi = np.exp(-0.5 / float(sigma) ** 2 * x ** 2)
+    phi /= phi[0] + 2 * phi[1:].sum()
+    response = np.full(freqs.shape, phi[0])
+    for i in range(1, radius + 1):
+        response += 2 * phi[i] * np.cos(2 * np.pi * freqs * i)
+    return response.astype(dtype)
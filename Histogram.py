@@ -0,0 +1,157 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# 每次转换为下标数组的元素个数，临时数组约32MB
+CHUNK_SIZE = 1 << 22
+# 整数数据取值范围不超过该值时按取值逐个计数，否则与浮点数据一样按区间分箱
+MAX_VALUE_COUNTS = 1 << 24
+# 浮点数据的细分区间数，显示时合并为较少的区间
+FLOAT_BINS = 1 << 16
+# 按数据集指纹缓存的直方图个数
+CACHE_SIZE = 32
+# 预览直方图最多抽取的体素个数，512^3的数据每个方向隔8个取一个，统计约几毫秒
+PREVIEW_SIZE = 1 << 18
+
+
+class Histogram:
+    """数据集的直方图
+
+    取值范围较小的整数数据(uint8、int16的CT值等)保存每个取值的计数，改变分箱数时
+    只需在计数数组上用查找表重新分箱，与体数据大小无关。浮点数据保存固定区间上
+    的分箱计数。区域数据改变时减去旧值、加上新值，不需要重新统计整个数据集。
+    """
+
+    def __init__(self, counts, low, high, exact) -> None:
+        self.counts = counts  # exact时counts[i]为取值low + i的个数，否则为[low, high]上等分区间的计数
+        self.low = low
+        self.high = high
+        self.exact = exact
+
+    @classmethod
+    def compute(cls, data):
+        data = np.asarray(data)
+        if np.issubdtype(data.dtype, np.integer) or data.dtype == np.bool_:
+            if data.dtype.itemsize <= 2:
+                # 8/16位整数直接按类型的全部取值计数，只需遍历一次数据
+                offset = int(np.iinfo(data.dtype).min) if data.dtype != np.bool_ else 0
+                counts = value_counts(data, offset, (1 << 8 * data.dtype.itemsize))
+                nonzero = np.flatnonzero(counts)
+                if nonzero.size == 0:
+                    return cls(np.zeros(1, dtype=np.int64), 0, 0, True)
+                first, last = int(nonzero[0]), int(nonzero[-1])
+                return cls(counts[first:last + 1].copy(), offset + first, offset + last, True)
+            low, high = int(np.min(data)), int(np.max(data))
+            if high - low < MAX_VALUE_COUNTS:
+                return cls(value_counts(data, low, high - low + 1), low, high, True)
+        else:
+            low, high = float(np.nanmin(data)), float(np.nanmax(data))
+        counts = binned_counts(data, low, high, FLOAT_BINS)
+        return cls(counts, low, high, False)
+
+    def copy(self):
+        return Histogram(self.counts.copy(), self.low, self.high, self.exact)
+
+    def binned(self, bins=256):
+        """(counts, edges)，取值个数少于bins的整数数据每个取值一个区间"""
+        span = self.counts.size
+        if self.exact:
+            bins = min(bins, span)
+            extent = span  # 整数取值v对应区间[v, v + 1)
+        else:
+            extent = self.high - self.low
+        # 查找表：计数下标 -> 区间下标
+        lut = np.arange(span, dtype=np.int64) * bins // span
+        counts = np.bincount(lut, weights=self.counts, minlength=bins).astype(np.int64)
+        edges = self.low + np.arange(bins + 1) * (extent / bins)
+        return counts, edges
+
+    def update(self, old_values, new_values):
+        """区域数据由old_values变为new_values后增量更新，新值超出浮点直方图的范围时返回False"""
+        if self.exact:
+            new_values = np.asarray(new_values)
+            low, high = int(np.min(new_values)), int(np.max(new_values))
+            if low < self.low or high > self.high:
+                self._extend(min(low, self.low), max(high, self.high))
+            self.counts -= value_counts(old_values, self.low, self.counts.size)
+            self.counts += value_counts(new_values, self.low, self.counts.size)
+            return True
+        if np.nanmin(new_values) < self.low or np.nanmax(new_values) > self.high:
+            return False
+        self.counts -= binned_counts(old_values, self.low, self.high, self.counts.size)
+        self.counts += binned_counts(new_values, self.low, self.high, self.counts.size)
+        return True
+
+    def _extend(self, low, high):
+        counts = np.zeros(high - low + 1, dtype=np.int64)
+        counts[self.low - low:self.high - low + 1] = self.counts
+        self.counts, self.low, self.high = counts, low, high
+
+
+def preview(data):
+    """等间隔抽样的近似直方图，计数按抽样比例放大，用于完整统计结束前的显示"""
+    data = np.asarray(data)
+    if data.size <= PREVIEW_SIZE:
+        return Histogram.compute(data)
+    step = int(np.ceil((data.size / PREVIEW_SIZE) ** (1 / data.ndim)))
+    sample = data[(slice(None, None, step),) * data.ndim]
+    histogram = Histogram.compute(sample)
+    histogram.counts = np.rint(histogram.counts * (data.size / sample.size)).astype(np.int64)
+    return histogram
+
+
+def value_counts(data, offset, length):
+    """整数数据每个取值的个数(np.bincount)，counts[i]为取值offset + i的个数"""
+    counts = np.zeros(length, dtype=np.int64)
+    for chunk in _chunks(data):
+        index = chunk.astype(np.int64)
+        if offset != 0:
+            index -= offset
+        counts += np.bincount(index, minlength=length)
+    return counts
+
+
+def binned_counts(data, low, high, bins):
+    """[low, high]等分为bins个区间的计数，等于high的值计入最后一个区间，NaN不计数"""
+    counts = np.zeros(bins, dtype=np.int64)
+    scale = bins / (high - low) if high > low else 0.0
+    for chunk in _chunks(data):
+        if chunk.dtype.kind == 'f':
+            finite = np.isfinite(chunk)
+            if not finite.all():
+                chunk = chunk[finite]
+        position = chunk.astype(np.float64)
+        position -= low
+        position *= scale
+        index = position.astype(np.int64)
+        np.clip(index, 0, bins - 1, out=index)
+        counts += np.bincount(index, minlength=bins)
+    return counts
+
+
+def _chunks(data):
+    # 按内存顺序展开，Fortran顺序的体数据不产生拷贝
+    flat = np.ravel(np.asarray(data), order='K')
+    for start in range(0, flat.size, CHUNK_SIZE):
+        yield flat[start:start + CHUNK_SIZE]
+
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def get_histogram(data, key=None):
+    """数据集的直方图，给出key(数据集指纹)时按key缓存"""
+    if key is not None:
+        with _lock:
+            if key in _cache:
+                _cache.move_to_end(key)
+                return _cache[key]
+    histogram = Histogram.compute(data)
+    if key is not None:
+        with _lock:
+            _cache[key] = histogram
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+    return histogram
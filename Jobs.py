@@ -0,0 +1,60 @@
+import threading
+
+
+class JobCancelled(Exception):
+    """任务在执行过程中被取消"""
+    pass
+
+
+class JobContext:
+    """后台任务的取消标志与进度，不依赖Qt，DataManager等计算代码也可使用"""
+
+    def __init__(self, progress_callback=None) -> None:
+        self._cancelled = threading.Event()
+        self.progress = 0.0
+        self.progress_callback = progress_callback
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def report(self, fraction):
+        """报告进度(0~1)，同时检查是否已被取消"""
+        if self.is_cancelled():
+            raise JobCancelled()
+        self.progress = min(max(float(fraction), 0.0), 1.0)
+        if self.progress_callback is not None:
+            self.progress_callback(self.progress)
+
+
+_local = threading.local()
+
+
+def current_job():
+    """当前线程正在执行的任务，不在后台任务中时为None"""
+    return getattr(_local, 'job', None)
+
+
+def report_progress(fraction):
+    """长时间运行的计算在循环中调用，报告进度并响应取消"""
+    job = current_job()
+    if job is not None:
+        job.report(fraction)
+
+
+def check_cancelled():
+    job = current_job()
+    if job is not None and job.is_cancelled():
+        raise JobCancelled()
+
+
+def run_in_context(job, func, *args, **kwargs):
+    """在任务上下文中执行func，func内部可调用report_progress/check_cancelled"""
+    previous = current_job()
+    _local.job = job
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _local.job = previous
@@ -0,0 +1,27 @@
+import importlib
+import sys
+
+
+class LazyModule:
+    """第一次访问属性时才导入的模块，用于推迟SimpleITK、pyvista、vtk等耗时的导入
+
+    导入由importlib.import_module完成，多个线程同时第一次访问时由Python的导入锁保证只导入一次。
+    """
+
+    def __init__(self, name) -> None:
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return getattr(self._module, attr)
+
+    def __repr__(self):
+        return '<lazy module %r%s>' % (self._name, '' if self._module is None else ' (loaded)')
+
+
+def lazy_import(name):
+    """模块已导入时直接返回，否则返回第一次使用时才导入的代理对象"""
+    module = sys.modules.get(name)
+    return module if module is not None else LazyModule(name)
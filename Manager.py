@@ -1,35 +1,103 @@
-import random
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
 
-import SimpleITK as sitk
-import pydicom
-import imageio
 import numpy as np
-from PIL import Image, ImageFilter
-import pyvista
-from matplotlib import pyplot as plt
-from pyvista.utilities import wrap
-from scipy import ndimage
-from skimage import exposure, img_as_float
-
-from skimage import filters
+
+import Filters
+from Lazy import lazy_import
+import Noise
+from Spectral import Spectrum, to_display, transfer_function
+from Cache import cached_operation, derive_fingerprint, fingerprint_array, result_cache
+from Histogram import get_histogram, preview
+from Pipeline import Pipeline
+from Store import open_store, save_store
+from Trace import traced
+from Volume import apply_slabwise, as_volume_layout, build_pyramid, check_shared, grid_to_numpy, numpy_to_grid, \
+    open_metaimage, open_nifti, use_tiling
+
+# 各格式的读取库与处理库在第一次使用时导入(read_func_dict分发到的读取函数、菜单中的处理功能)
+sitk = lazy_import('SimpleITK')
+pydicom = lazy_import('pydicom')
+imageio = lazy_import('imageio')
+Image = lazy_import('PIL.Image')
+ImageFilter = lazy_import('PIL.ImageFilter')
+pyvista = lazy_import('pyvista')
+ndimage = lazy_import('scipy.ndimage')
+skimage = lazy_import('skimage')
+exposure = lazy_import('skimage.exposure')
+filters = lazy_import('skimage.filters')
+
+# 处理结果的精度策略：
+#   native  保持原数据类型，gray、sharpenSobel/Prewitt等[0, 1]范围的浮点结果还原为原数据的无符号整数类型，
+#           其他浮点结果(频谱、Laplace等含负值的结果)为float32
+#   float32 浮点结果为float32，内存为float64的一半
+#   float64 浮点结果为float64(整数数据经img_as_float)
+# 最大/最小值、中值、均值、高斯滤波与噪声在各策略下都保持原数据类型；频谱计算始终为float32
+PRECISIONS = ['native', 'float32', 'float64']
+DEFAULT_PRECISION = os.environ.get('MEDICALVIS_PRECISION', 'float32')
+
+
+def history_entry(name, args, kwargs, precision=None):
+    """处理历史中的一步，保存在原生格式的文件头中"""
+    entry = {'name': name, 'args': list(args), 'kwargs': dict(kwargs)}
+    if precision is not None:
+        entry['precision'] = precision
+    return entry
+
+
+def recorded(func):
+    """DataManager处理函数的装饰器：结果的处理历史为输入的历史加上本次操作"""
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        result = func(self, *args, **kwargs)
+        result.history = self.history + [history_entry(func.__name__, args, kwargs, self.precision)]
+        return result
+
+    return wrapper
+
+
 class DataManager:
-    def __init__(self, numpy_data=None) -> None:
+    def __init__(self, numpy_data=None, precision=None) -> None:
         self.numpy_data = numpy_data
+        # 处理结果的精度策略，见PRECISIONS，处理结果继承
+        self.precision = precision or DEFAULT_PRECISION
         self.read_func_dict = {'DCM': self.read_dcm, 'dcm': self.read_dcm, 'nii': self.read_nii, 'gz': self.read_nii,
-                               'slc': self.read_slc, 'vtk':self.read_3d_normal_type,'pvtk':self.read_3d_normal_type,
+                               'slc': self.read_slc, 'mhd': self.read_mhd, 'vtk':self.read_3d_normal_type,'pvtk':self.read_3d_normal_type,
                                'vti': self.read_3d_normal_type,'pvti':self.read_3d_normal_type,'vtr':self.read_3d_normal_type,
                                'pvtr': self.read_3d_normal_type,'vtu':self.read_3d_normal_type,'pvtu':self.read_3d_normal_type,
                                'obj': self.read_3d_normal_type,'vtp':self.read_3d_normal_type,'ply':self.read_3d_normal_type,
                                'jpg': self.read_normal_type, 'png': self.read_normal_type,'tif':self.read_normal_type,
-                               'jpeg':self.read_normal_type,'bmp':self.read_normal_type}
+                               'jpeg':self.read_normal_type,'bmp':self.read_normal_type,
+                               'mvol': self.read_store, 'mvolz': self.read_store}
         self.ugrid_data = None
         self.dcm_data=None
+        self.history = []  # 处理历史，见history_entry
+        self._fingerprint = None
+        self._spectrum = None
+        self._histogram = None
+        self._pyramid = None
+        self.source_spectrum = None  # 频谱显示结果对应的频谱，用于逆变换
         if type(numpy_data)!=type(None) and not (numpy_data.shape[-1] == 1 or numpy_data.shape[-1] == 3):
-            self.ugrid_data = wrap(numpy_data)  # UniformGrid类，使用该类做三维数据处理
+            # numpy_data与ugrid_data的点数据共享同一块内存
+            self.numpy_data = as_volume_layout(numpy_data)
+            self.ugrid_data = self.convert_numpy_to_grid(self.numpy_data)  # UniformGrid类，使用该类做三维数据处理
 
+    @traced
     def read_data(self, file_path):
-        file_type = file_path[file_path.rfind('.') + 1:]
-        read_func = self.read_func_dict[file_type]
+        if os.path.isdir(file_path):
+            # 文件夹视为DICOM切片序列
+            file_type = 'DCM'
+            read_func = self.read_dcm_series
+        else:
+            file_type = file_path[file_path.rfind('.') + 1:]
+            read_func = self.read_func_dict[file_type]
+        if not (file_type=='DCM' or file_type=='dcm'):
+            self.dcm_data = None
+        # 原生格式的读取函数会换成文件中保存的历史、DICOM元数据与指纹
+        self.history = [history_entry('read_data', (file_path,), {})]
+        self._fingerprint = None
         data = read_func(file_path)
         if (data.__class__.__name__=='tuple'):
             # 3D体数据
@@ -37,22 +105,104 @@ class DataManager:
         else:
             self.numpy_data, self.ugrid_data = data, None
 
-        if not (file_type=='DCM' or file_type=='dcm'):
-            self.dcm_data = None
-
-
+        check_shared(self.numpy_data, self.ugrid_data)
+        self._spectrum = None
+        self._histogram = None
+        self._pyramid = None
+        self.source_spectrum = None
+
+    def pyramid(self):
+        """交互渲染用的降采样体数据列表(2x、4x、8x)，每个数据集只生成一次"""
+        if self._pyramid is None and self.ugrid_data is not None:
+            self._pyramid = build_pyramid(self.ugrid_data)
+        return self._pyramid
+
+    def derived(self, numpy_data):
+        """处理结果，继承精度策略、DICOM元数据与体数据的spacing/origin"""
+        result = DataManager(numpy_data, precision=self.precision)
+        result.dcm_data = self.dcm_data
+        if result.ugrid_data is not None and self.ugrid_data is not None:
+            result.ugrid_data.spacing = self.ugrid_data.spacing
+            result.ugrid_data.origin = self.ugrid_data.origin
+        return result
+
+    def float_dtype(self):
+        """浮点结果的类型：float64策略为float64，其他为float32"""
+        return np.float64 if self.precision == 'float64' else np.float32
+
+    def as_float(self, data):
+        """按精度策略转换为浮点数，整数按类型的取值范围缩放(与img_as_float相同)
+
+        float64策略与img_as_float相同(整数为float64，float32数据不变)，其他策略为float32。
+        """
+        if self.precision == 'float64':
+            return skimage.img_as_float(data)
+        return skimage.img_as_float32(data)
+
+    def to_native(self, data, dtype):
+        """native策略下把[0, 1]范围的浮点结果(as_float的无符号整数数据经过的处理)还原为无符号整数类型dtype
+
+        其他策略或其他类型的数据(有符号整数的取值范围含负值，还原没有意义)不变。
+        """
+        if self.precision != 'native' or not np.issubdtype(dtype, np.unsignedinteger):
+            return data
+        info = np.iinfo(dtype)
+        data = np.multiply(data, info.max, dtype=np.float32)
+        np.rint(data, out=data)
+        np.clip(data, 0, info.max, out=data)
+        return data.astype(dtype)
+
+    def lazy(self):
+        """惰性流水线：之后的处理函数只记录操作，compute()时融合计算，见Pipeline"""
+        return Pipeline(self)
+
+    def memory_usage(self):
+        """本对象持有的数组占用的内存(字节)：数据、频谱、降采样层级与直方图；ugrid_data与numpy_data共享内存，不重复计算"""
+        usage = {'data': 0 if self.numpy_data is None else self.numpy_data.nbytes}
+        if self.ugrid_data is not None and self.numpy_data is None:
+            usage['data'] = self.ugrid_data.actual_memory_size * 1024
+        spectra = [self._spectrum] if self.source_spectrum is self._spectrum else [self._spectrum, self.source_spectrum]
+        usage['spectrum'] = sum(spectrum.coefficients.nbytes for spectrum in spectra if spectrum is not None)
+        usage['pyramid'] = sum(level.actual_memory_size * 1024 for level in self._pyramid or [])
+        usage['histogram'] = 0 if self._histogram is None else self._histogram.counts.nbytes
+        return usage
+
+    def fingerprint(self):
+        """数据集指纹，用作处理结果缓存的键"""
+        if self._fingerprint is None:
+            self._fingerprint = fingerprint_array(self.numpy_data)
+        return self._fingerprint
+
+
+    @traced
     def save_data(self,file_path):
         file_type = file_path[file_path.rfind('.') + 1:]
 
-        if(file_type=='nii'):
-            image = sitk.GetImageFromArray(self.numpy_data)
+        if file_type in ('mvol', 'mvolz'):
+            self.save_store(file_path, compression='zlib' if file_type == 'mvolz' else None)
+            return
+
+        if(file_type=='nii' or file_path.endswith('.nii.gz')):
+            if self.ugrid_data is not None:
+                # 体数据为(x, y, z)顺序，SimpleITK的数组为(z, y, x)；几何信息与读取时一致(LPS)
+                image = sitk.GetImageFromArray(np.ascontiguousarray(self.numpy_data.T))
+                image.SetSpacing([float(d) for d in self.ugrid_data.spacing])
+                image.SetOrigin([float(o) for o in self.ugrid_data.origin])
+            else:
+                image = sitk.GetImageFromArray(self.numpy_data)
             sitk.WriteImage(image, file_path)
             return
 
         if(self.ugrid_data!=None):
             self.ugrid_data.save(file_path)
         else:
-            imageio.imsave(file_path,self.numpy_data)
+            numpy_data = self.numpy_data
+            if numpy_data.ndim == 3 and numpy_data.shape[-1] == 1:
+                numpy_data = numpy_data[..., 0]
+            if numpy_data.dtype.kind == 'f':
+                # 普通图像格式只能保存整数，浮点的处理结果线性缩放到0~255
+                numpy_data = to_display(numpy_data)
+            imageio.imsave(file_path,numpy_data)
 
 
     def read_dcm(self, file_path):
@@ -62,13 +212,109 @@ class DataManager:
         return numpy_data
 
 
+    def read_dcm_series(self, dir_path, max_workers=None):
+        """读取文件夹中的DICOM切片序列，组成三维体数据
+
+        先只读文件头并按空间位置排序，再用线程池并行解码像素，
+        直接写入预先分配好的三维数组。
+        """
+        file_paths = [os.path.join(dir_path, name) for name in sorted(os.listdir(dir_path))]
+        file_paths = [path for path in file_paths if os.path.isfile(path)]
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            headers = list(executor.map(self._read_dcm_header, file_paths))
+            slices = [(path, header) for path, header in zip(file_paths, headers) if header is not None]
+            if len(slices) == 0:
+                raise ValueError('No DICOM slices found in ' + dir_path)
+            slices = self._sort_dcm_slices(slices)
+
+            first = slices[0][1]
+            rows, cols = int(first.Rows), int(first.Columns)
+            volume = np.empty((len(slices), rows, cols), dtype=self._dcm_dtype(first))  # (Depth, Height, Width)
+
+            def decode(index):
+                volume[index] = pydicom.dcmread(slices[index][0], force=True).pixel_array
+            list(executor.map(decode, range(len(slices))))
+
+        self.dcm_data = first
+        spacing, origin = self._dcm_geometry([header for _, header in slices])
+        # (Depth, Height, Width)的C顺序数组转置后即为Fortran顺序的(x, y, z)视图，不产生拷贝
+        numpy_data = volume.transpose(2, 1, 0)
+        grid_data = numpy_to_grid(numpy_data, spacing=spacing, origin=origin)
+        return numpy_data, grid_data
+
+    @staticmethod
+    def _read_dcm_header(file_path):
+        try:
+            header = pydicom.dcmread(file_path, stop_before_pixels=True, force=True)
+        except Exception:
+            return None
+        if 'Rows' not in header or 'Columns' not in header:
+            return None
+        return header
+
+    @staticmethod
+    def _sort_dcm_slices(slices):
+        """按ImagePositionPatient在切片法向上的投影排序，缺失时按InstanceNumber"""
+        first = slices[0][1]
+        if all('ImagePositionPatient' in header for _, header in slices):
+            if 'ImageOrientationPatient' in first:
+                orientation = np.array(first.ImageOrientationPatient, dtype=float)
+                normal = np.cross(orientation[:3], orientation[3:])
+            else:
+                normal = np.array([0.0, 0.0, 1.0])
+            return sorted(slices, key=lambda item: float(np.dot(normal, np.array(item[1].ImagePositionPatient, dtype=float))))
+        return sorted(slices, key=lambda item: int(getattr(item[1], 'InstanceNumber', 0) or 0))
+
+    @staticmethod
+    def _dcm_dtype(header):
+        bits = int(getattr(header, 'BitsAllocated', 16))
+        signed = int(getattr(header, 'PixelRepresentation', 0)) == 1
+        if bits == 8:
+            return np.int8 if signed else np.uint8
+        if bits == 32:
+            return np.int32 if signed else np.uint32
+        return np.int16 if signed else np.uint16
+
+    @staticmethod
+    def _dcm_geometry(headers):
+        """由排序后的切片文件头计算(spacing, origin)"""
+        first = headers[0]
+        dy, dx = 1.0, 1.0
+        if 'PixelSpacing' in first:
+            dy, dx = (float(value) for value in first.PixelSpacing)
+        dz = float(getattr(first, 'SliceThickness', 1.0) or 1.0)
+        origin = (0.0, 0.0, 0.0)
+        if 'ImagePositionPatient' in first:
+            origin = tuple(float(value) for value in first.ImagePositionPatient)
+            if len(headers) > 1:
+                positions = np.array([header.ImagePositionPatient for header in headers], dtype=float)
+                distances = np.linalg.norm(np.diff(positions, axis=0), axis=1)
+                if np.median(distances) > 0:
+                    dz = float(np.median(distances))
+        return (dx, dy, dz), origin
+
     def read_nii(self, file_path):
         '''nii 文件为3d数据'''
+        if file_path.endswith('.nii'):
+            # 未压缩的nii以内存映射方式打开，不把整个体数据读入内存
+            volume = open_nifti(file_path)
+            if volume is not None:
+                numpy_data = volume.array
+                return numpy_data, volume.to_grid(numpy_data)
         simpleITK_data = sitk.ReadImage(file_path)
         numpy_data = sitk.GetArrayFromImage(simpleITK_data)  # (Depth, Height, Width)
-        grid_data = self.convert_numpy_to_grid(numpy_data)
+        numpy_data = numpy_data.transpose(2, 1, 0)
+        grid_data = numpy_to_grid(numpy_data, spacing=simpleITK_data.GetSpacing(), origin=simpleITK_data.GetOrigin())
         return numpy_data, grid_data
 
+    def read_mhd(self, file_path):
+        '''MetaImage头文件 + 未压缩raw体数据'''
+        volume = open_metaimage(file_path)
+        if volume is None:
+            return self.read_nii(file_path)
+        numpy_data = volume.array
+        return numpy_data, volume.to_grid(numpy_data)
+
     def read_normal_type(self, file_path):
         simpleITK_data = sitk.ReadImage(file_path)
         numpy_data = sitk.GetArrayFromImage(simpleITK_data)
@@ -88,66 +334,199 @@ class DataManager:
         numpy_data = self.convert_grid_to_numpy(grid_data)
         return numpy_data, grid_data
 
+    def read_store(self, file_path):
+        '''原生格式：未压缩时内存映射，不读取像素；压缩时多线程解压'''
+        store = open_store(file_path)
+        numpy_data = store.array()
+        header = store.header
+        if header.get('history'):
+            self.history = header['history']
+        if header.get('dicom'):
+            self.dcm_data = pydicom.Dataset.from_json(header['dicom'])
+        # 保存时的精度策略，继续处理时与保存前的结果一致
+        if header.get('precision') in PRECISIONS:
+            self.precision = header['precision']
+        # 保存时的指纹：结果缓存只在本进程内有效，本次运行中重新打开保存的文件时仍可命中之前的处理结果
+        self._fingerprint = header.get('fingerprint')
+        if store.is_volume:
+            return numpy_data, store.to_grid(numpy_data)
+        return numpy_data
+
+    def save_store(self, file_path, compression=None):
+        """保存为原生格式(分块、可压缩)，包括spacing/origin、DICOM元数据(不含像素)与处理历史"""
+        metadata = {'history': self.history, 'precision': self.precision, 'fingerprint': self._fingerprint}
+        if self.dcm_data is not None:
+            # 像素等大的元素不保存
+            dicom = self.dcm_data.to_json_dict(bulk_data_threshold=1024, bulk_data_element_handler=lambda element: '')
+            metadata['dicom'] = {tag: value for tag, value in dicom.items() if 'BulkDataURI' not in value}
+        spacing = origin = None
+        if self.ugrid_data is not None:
+            spacing, origin = self.ugrid_data.spacing, self.ugrid_data.origin
+        save_store(file_path, self.numpy_data, compression=compression, spacing=spacing, origin=origin,
+                   is_volume=self.ugrid_data is not None, metadata=metadata)
+
     def convert_numpy_to_grid(self, numpy_data):
-        """numpy_data要为3D体数据"""
-        return wrap(numpy_data)
+        """numpy_data要为3D体数据，Fortran顺序的数组直接作为点数据，不产生拷贝"""
+        return numpy_to_grid(as_volume_layout(numpy_data))
+
+    def apply_filter(self, func, halo, sizes=None, tiled=True):
+        """对numpy_data执行滤波，内存映射的体数据按块处理并写入内存映射输出
+
+        :param func: 接收numpy数组并返回同形状结果的滤波函数，未给出sizes时需对各轴对称
+        :param halo: 最后一个轴上的滤波核半径，分块时相邻块需要重叠的层数
+        :param sizes: 按numpy_data轴顺序给出的各轴核大小，给出时以func(data, sizes)调用，
+                      传给func的sizes与其收到的数组轴顺序一致
+        :param tiled: 为False时内存中的数据不分块，用于自身已多线程的func
+        """
+        transpose = self.ugrid_data is not None and self.numpy_data.flags.f_contiguous
+        if sizes is not None:
+            kernel_func = func
+            sizes = tuple(sizes)[::-1] if transpose else tuple(sizes)
+            func = lambda data: kernel_func(data, sizes)
+        if transpose:
+            # 在C顺序的转置视图上计算，结果转置回来即为Fortran顺序，包装成网格时无需拷贝
+            func = self._transposed(func)
+            if isinstance(self.numpy_data, np.memmap) or (tiled and use_tiling(self.numpy_data)):
+                # 分块并行计算，结果与整体调用完全一致
+                return apply_slabwise(func, self.numpy_data, halo)
+        return func(self.numpy_data)
+
+    @staticmethod
+    def _transposed(func):
+        return lambda data: func(data.T).T
+
+    def filter_sizes(self, size, fill=1, cast=int):
+        """各轴的滤波核大小：二维图像只在行、列方向滤波，不跨颜色通道(该轴取fill)"""
+        ndim = self.numpy_data.ndim
+        if np.isscalar(size):
+            size = (cast(size),) * (ndim if self.ugrid_data is not None else 2)
+        size = tuple(cast(k) for k in size)
+        if self.ugrid_data is None and len(size) < ndim:
+            size = size + (fill,) * (ndim - len(size))
+        if len(size) != ndim:
+            raise ValueError('size must be a scalar or have one entry per axis')
+        return size
 
     def convert_grid_to_numpy(self, grid_data):
-        numpy_data = grid_data[grid_data.array_names[0]]
-        numpy_data = numpy_data.reshape(grid_data.dimensions)
-        return numpy_data
-
+        """点数据的(x, y, z)视图，与grid_data共享内存"""
+        return grid_to_numpy(grid_data)
+
+    def spectrum(self):
+        """当前数据的频谱(float32 rfftn)，只计算一次，FFT显示与频域滤波共用"""
+        if self._spectrum is None:
+            axes = None if self.ugrid_data is not None else (0, 1)
+            self._spectrum = Spectrum.forward(self.numpy_data, axes=axes)
+        return self._spectrum
+
+    def _spectrum_result(self, numpy_data, spectrum):
+        result = self.derived(numpy_data)
+        result.source_spectrum = spectrum
+        return result
+
+    @traced
+    @recorded
     def fft(self):
-        if self.ugrid_data != None:
-            result = np.fft.fftn(self.numpy_data)
-            result = np.abs(result)
-            result = result.astype(np.uint8)
-            return DataManager(result)
-        else:
-            result = np.fft.fft2(self.numpy_data)
-            result = np.abs(result)
-            result = result.astype(np.uint8)
-            return DataManager(result)
+        """对数幅度谱，零频在角上"""
+        spectrum = self.spectrum()
+        return self._spectrum_result(spectrum.log_magnitude(), spectrum)
 
+    @traced
+    @recorded
     def shift_fft(self):
-        if self.ugrid_data != None:
-            result = np.fft.fftshift(self.numpy_data)
-            return DataManager(result)
-        else:
-            result = np.fft.fftshift(self.numpy_data)
-            return DataManager(result)
-
-    def maximum_filter(self):
-        result = ndimage.maximum_filter(self.numpy_data, size=20)
-        return DataManager(result)
-
-    def minimum_filter(self):
-        result = ndimage.minimum_filter(self.numpy_data, size=20)
-        return DataManager(result)
-
-    def uniform_filter(self):
-        """"""
-        if self.ugrid_data == None:
-            blurred_img = ndimage.uniform_filter(self.numpy_data, size=20)
-            return DataManager(blurred_img)
-        else:
-            blurred_img = ndimage.uniform_filter(self.numpy_data, size=20)
-            return DataManager(blurred_img)
-
+        """零频移到中心的对数幅度谱"""
+        spectrum = self.spectrum()
+        return self._spectrum_result(spectrum.log_magnitude(centered=True), spectrum)
+
+    @traced
+    @recorded
+    def fft_phase(self):
+        """零频移到中心的相位谱"""
+        spectrum = self.spectrum()
+        return self._spectrum_result(spectrum.phase(centered=True), spectrum)
+
+    @traced
+    @recorded
+    def inverse_fft(self):
+        """逆变换：频谱显示结果还原为对应的原数据，其他数据做一次正反变换"""
+        spectrum = self.source_spectrum if self.source_spectrum is not None else self.spectrum()
+        return self.derived(spectrum.inverse())
+
+    @traced
+    @recorded
+    @cached_operation
+    def maximum_filter(self, size=20):
+        """size为标量或每个轴一个值；ndimage按轴分解为一维滤波，耗时与核大小无关"""
+        sizes = self.filter_sizes(size)
+        result = self.apply_filter(lambda data, sizes: ndimage.maximum_filter(data, size=sizes), halo=sizes[-1] // 2,
+                                   sizes=sizes)
+        return self.derived(result)
+
+    @traced
+    @recorded
+    @cached_operation
+    def minimum_filter(self, size=20):
+        """size为标量或每个轴一个值；ndimage按轴分解为一维滤波，耗时与核大小无关"""
+        sizes = self.filter_sizes(size)
+        result = self.apply_filter(lambda data, sizes: ndimage.minimum_filter(data, size=sizes), halo=sizes[-1] // 2,
+                                   sizes=sizes)
+        return self.derived(result)
+
+    @traced
+    @recorded
+    @cached_operation
+    def uniform_filter(self, size=20):
+        """均值滤波，按轴累加和实现，耗时与核大小无关"""
+        sizes = self.filter_sizes(size)
+        blurred_img = self.apply_filter(lambda data, sizes: Filters.uniform_filter(data, size=sizes),
+                                        halo=sizes[-1] // 2, sizes=sizes)
+        return self.derived(blurred_img)
+
+    @traced
+    @recorded
+    @cached_operation
     def median_blur(self):
         """中值过滤"""
-        result = ndimage.median_filter(self.numpy_data, size=3)
-        return DataManager(result)
-
-    def gaussian_blur(self):
-        '''高斯过滤'''
-        result = ndimage.gaussian_filter(self.numpy_data, sigma=5)
-        return DataManager(result)
-
+        result = self.apply_filter(lambda data: ndimage.median_filter(data, size=3), halo=1)
+        return self.derived(result)
+
+    @traced
+    @recorded
+    @cached_operation
+    def gaussian_blur(self, sigma=5):
+        '''高斯过滤，根据sigma和数据大小自动选择空间卷积或FFT卷积'''
+        sigmas = self.filter_sizes(sigma, fill=0, cast=float)
+        halo = Filters.gaussian_radius(sigmas[-1])
+        if not isinstance(self.numpy_data, np.memmap) and Filters.gaussian_method(self.numpy_data.shape, sigmas, self.numpy_data.dtype) == 'fft':
+            # FFT本身是多线程的，整体计算，不再分块
+            result = self.apply_filter(lambda data, sigmas: Filters.gaussian_filter(data, sigmas, method='fft'),
+                                       halo=halo, sizes=sigmas, tiled=False)
+        else:
+            result = self.apply_filter(lambda data, sigmas: ndimage.gaussian_filter(data, sigmas),
+                                       halo=halo, sizes=sigmas)
+        return self.derived(result)
+
+    @traced
+    @recorded
+    @cached_operation
+    def frequency_filter(self, kind='ideal', band='lowpass', cutoff=0.1, high_cutoff=None, order=2):
+        '''频域滤波，复用当前数据缓存的频谱，多次滤波只需一次正变换
+
+        :param kind: 'ideal' | 'butterworth' | 'gaussian'
+        :param band: 'lowpass' | 'highpass' | 'bandpass'，高通与带通结果含负值，输出浮点数(float_dtype)
+        '''
+        spectrum = self.spectrum()
+        response = transfer_function(spectrum, kind=kind, band=band, cutoff=cutoff, high_cutoff=high_cutoff,
+                                     order=order)
+        dtype = None if band == 'lowpass' else self.float_dtype()
+        return self.derived(spectrum.filtered(response, dtype=dtype))
+
+    @traced
+    @recorded
+    @cached_operation
     def gray(self, n):
         try:
             # 把图像的像素值转换为浮点数
-            img = img_as_float(self.numpy_data)
+            img = self.as_float(self.numpy_data)
             # 使用伽马调整
             # 第二个参数控制亮度，大于1增强亮度，小于1降低。
             if n:
@@ -156,7 +535,7 @@ class DataManager:
                 data = exposure.adjust_gamma(img, 0.8)
                 # data = exposure.adjust_log(img, 0.8)
         except Exception as e:
-            img = img_as_float(self.numpy_data)
+            img = self.as_float(self.numpy_data)
             minImg = np.min(img)
             maxImg = np.max(img)
             img = (img-minImg)/(maxImg-minImg)
@@ -164,112 +543,94 @@ class DataManager:
                 data = exposure.adjust_gamma(img, 5)
             else:
                 data = exposure.adjust_gamma(img, 0.5)
-        return DataManager(data)
-
-
-
-    def Salt_noice(self):
-        if len(self.numpy_data.shape) == 3:
-            rows, cols, dims = self.numpy_data.shape
-            if dims == 3:
-                Grey_sp = self.numpy_data
-                snr = 0.9
-                noise_num = int((1 - snr) * rows * cols)
-
-                for i in range(noise_num):
-                    rand_x = random.randint(0, rows - 1)
-                    rand_y = random.randint(0, cols - 1)
-                    if random.randint(0, 1) == 0:
-                        Grey_sp[rand_x, rand_y, 0] = 0
-                        Grey_sp[rand_x, rand_y, 1] = 0
-                        Grey_sp[rand_x, rand_y, 2] = 0
-                    else:
-                        Grey_sp[rand_x, rand_y, :] = 255
-                        Grey_sp[rand_x, rand_y, 1] = 255
-                        Grey_sp[rand_x, rand_y, 2] = 255
-
-            elif dims == 1:
-                Grey_sp = self.numpy_data
-                snr = 0.9
-                noise_num = int((1 - snr) * rows * cols)
-
-                for i in range(noise_num):
-                    rand_x = random.randint(0, rows - 1)
-                    rand_y = random.randint(0, cols - 1)
-                    if random.randint(0, 1) == 0:
-                        Grey_sp[rand_x, rand_y, 0] = 0
-                    else:
-                        Grey_sp[rand_x, rand_y, 0] = 255
-
-            elif dims > 3:
-                Grey_sp = self.numpy_data
-                snr = 0.9
-                noise_num = int((1 - snr) * rows * cols)
-
-                for i in range(noise_num):
-                    rand_x = random.randint(0, rows - 1)
-                    rand_y = random.randint(0, cols - 1)
-                    rand_z = random.randint(0, dims - 1)
-                    if random.randint(0, 1) == 0:
-                        Grey_sp[rand_x, rand_y, rand_z] = 0
-                    else:
-                        Grey_sp[rand_x, rand_y, rand_z] = 255
-        else:
-            rows, cols = self.numpy_data.shape
-            R = np.mat(self.numpy_data[:, :])
-            G = np.mat(self.numpy_data[:, :])
-            B = np.mat(self.numpy_data[:, :])
-            Grey_sp = R * 0.299 + G * 0.587 + B * 0.114
-            snr = 0.9
-            noise_num = int((1 - snr) * rows * cols)
-
-            for i in range(noise_num):
-                rand_x = random.randint(0, rows - 1)
-                rand_y = random.randint(0, cols - 1)
-                if random.randint(0, 1) == 0:
-                    Grey_sp[rand_x, rand_y] = 0
-                else:
-                    Grey_sp[rand_x, rand_y] = 255
-
-        return DataManager(Grey_sp)
-
-    def Gaussian_noice(self):
-        if len(self.numpy_data.shape) == 3:
-            rows, cols, dims = self.numpy_data.shape
-            if dims == 3:
-                Grey_gs = self.numpy_data
-            elif dims == 1:
-                Grey_gs = self.numpy_data
-            elif dims > 3:
-                pass
-        else:
-            Grey_gs = self.numpy_date
-
-        # 给图像加入高斯噪声
-        Grey_gs = Grey_gs + np.random.normal(0, 48, Grey_gs.shape)
-        Grey_gs = Grey_gs - np.full(Grey_gs.shape, np.min(Grey_gs))
-        Grey_gs = Grey_gs * 255 / np.max(Grey_gs)
-        Grey_gs = Grey_gs.astype(np.uint8)
-
-        return DataManager(Grey_gs)
-
-    def drawHistorgram(self, npdata, bins=15):
-        bin = []
-        max = np.max(npdata)
-        min = np.min(npdata)
-        temp = (max - min) / bins
-        for level in range(0, bins + 1):
-            bin.append(min + level * temp)
-        c = np.reshape(npdata, (-1))
-        print(bin)
-        plt.hist(c, bins=bin)
-        plt.title('Historgram')
-        plt.show()
-        return
-
-    def Historn(self):
-        self.drawHistorgram(npdata=self.numpy_data, bins=256)
-
+        return self.derived(self.to_native(data, self.numpy_data.dtype))
+
+
+
+    @traced
+    @recorded
+    def Salt_noice(self, amount=0.1, seed=None):
+        """椒盐噪声，amount为噪声比例(1 - SNR)，RGB图像同一像素的三个通道一起置值"""
+        channel_axis = -1 if self.ugrid_data is None and self.numpy_data.shape[-1] == 3 else None
+        result = Noise.salt_pepper(self.numpy_data, amount=amount, seed=seed, channel_axis=channel_axis)
+        return self.derived(result)
+
+    @traced
+    @recorded
+    def Gaussian_noice(self, sigma=48.0, snr=None, seed=None, dtype=None):
+        """高斯噪声，给出snr时由信噪比计算sigma，结果截断到dtype(默认与原数据相同)的取值范围"""
+        if snr is not None:
+            sigma = None
+        return self.derived(Noise.gaussian(self.numpy_data, sigma=sigma, snr=snr, seed=seed, dtype=dtype))
+
+    @traced
+    @recorded
+    def Poisson_noice(self, scale=1.0, seed=None, dtype=None):
+        """泊松噪声"""
+        return self.derived(Noise.poisson(self.numpy_data, scale=scale, seed=seed, dtype=dtype))
+
+    @traced
+    @recorded
+    def Speckle_noice(self, sigma=0.1, seed=None, dtype=None):
+        """斑点噪声"""
+        return self.derived(Noise.speckle(self.numpy_data, sigma=sigma, seed=seed, dtype=dtype))
+
+    @traced
+    def histogram(self, bins=256):
+        """直方图的(counts, edges)，统计结果按数据集缓存，改变bins不需要重新统计"""
+        if self._histogram is None:
+            # 已有指纹(读取或缓存的处理结果)时按指纹缓存，否则只保存在本对象中，避免为此对整个数据做哈希
+            self._histogram = get_histogram(self.numpy_data, self._fingerprint)
+        return self._histogram.binned(bins)
+
+    def preview_histogram(self, bins=256):
+        """完整直方图已统计时直接返回，否则返回抽样统计的近似直方图，可在GUI线程中调用"""
+        if self._histogram is not None:
+            return self._histogram.binned(bins)
+        return preview(self.numpy_data).binned(bins)
+
+    def has_histogram(self):
+        return self._histogram is not None
+
+    def own_data(self):
+        """原地修改前调用：numpy_data只读(缓存命中的结果)或被结果缓存引用时先拷贝一份，ugrid_data改用拷贝"""
+        if self.numpy_data.flags.writeable and not result_cache.holds(self.numpy_data):
+            return
+        self.numpy_data = np.array(self.numpy_data, order='K')
+        if self.ugrid_data is not None:
+            self.ugrid_data.point_data[self.ugrid_data.array_names[0]] = self.numpy_data.ravel(order='F')
+            check_shared(self.numpy_data, self.ugrid_data)
+
+    def update_region(self, index, values):
+        """修改numpy_data的一个区域，直方图增量更新
+
+        :param index: numpy_data的下标，如 np.s_[10:20, :, 5]
+        """
+        fingerprint = self._fingerprint
+        if fingerprint is None and isinstance(self.numpy_data, np.memmap):
+            # 内存映射数据的指纹是文件身份，写时复制的修改不改变文件，因此要在修改前取得
+            fingerprint = self.fingerprint()
+        self.own_data()
+        old_values = np.array(self.numpy_data[index])
+        self.numpy_data[index] = values
+        if self._histogram is not None:
+            # 缓存中的直方图属于修改前的数据，不能原地修改
+            histogram = self._histogram.copy()
+            self._histogram = histogram if histogram.update(old_values, self.numpy_data[index]) else None
+        if self.ugrid_data is not None:
+            self.ugrid_data.Modified()
+        if fingerprint is not None:
+            # 新指纹由修改前的指纹、修改的区域和值决定，不需要对整个数据重新哈希
+            parts = index if isinstance(index, tuple) else (index,)
+            parts = tuple(fingerprint_array(np.asarray(part)) if isinstance(part, np.ndarray) else part for part in parts)
+            fingerprint = derive_fingerprint(fingerprint, 'update_region', parts, {'values': fingerprint_array(np.asarray(values))})
+        self._fingerprint = fingerprint
+        self._spectrum = None
+        self._pyramid = None
+
+    @traced
+    @recorded
+    @cached_operation
     def counterDetail(self):
         """轮廓"""
         im = self.numpy_data
@@ -280,8 +641,11 @@ class DataManager:
         imq2 = np.array(imq2)
         if len(imq2.shape) == 2:
             imq2 = np.expand_dims(imq2, axis=2)
-        return DataManager(imq2)
+        return self.derived(imq2)
 
+    @traced
+    @recorded
+    @cached_operation
     def embossFilter(self):
         """浮雕"""
         im = self.numpy_data
@@ -292,23 +656,34 @@ class DataManager:
         imq1 = np.array(imq1)
         if len(imq1.shape) == 2:
             imq1 = np.expand_dims(imq1, axis=2)
-        return DataManager(imq1)
+        return self.derived(imq1)
 
+    @traced
+    @recorded
+    @cached_operation
     def sharpenSobel(self):
-        img = self.numpy_data
-        edges = filters.sobel(img)
-        return DataManager(edges)
+        dtype = self.numpy_data.dtype
+        edges = self.apply_filter(lambda data: self.to_native(filters.sobel(self.as_float(data)), dtype), halo=1)
+        return self.derived(edges)
 
+    @traced
+    @recorded
+    @cached_operation
     def sharpenPrewitt(self):
-        img = self.numpy_data
-        edges = filters.prewitt(img)
-        return DataManager(edges)
+        dtype = self.numpy_data.dtype
+        edges = self.apply_filter(lambda data: self.to_native(filters.prewitt(self.as_float(data)), dtype), halo=1)
+        return self.derived(edges)
 
+    @traced
+    @recorded
+    @cached_operation
     def sharpenLaplace(self):
-        img = self.numpy_data
-        edges = filters.laplace(img)
-        return DataManager(edges)
+        edges = self.apply_filter(lambda data: filters.laplace(self.as_float(data)), halo=1)
+        return self.derived(edges)
 
+    @traced
+    @recorded
+    @cached_operation
     def sharpen2D(self):
         """锐化操作 对2d图像"""
         s = self.numpy_data
@@ -321,7 +696,7 @@ class DataManager:
         s = np.array(s)
         if len(s.shape) == 2:
             s = np.expand_dims(s, axis=2)
-        return DataManager(s)
+        return self.derived(s)
 
     def modify_demension(self, numpy_data):
         '''修改numpy数据维度，灰度二维图像数据读入或修改时没有通道维度'''
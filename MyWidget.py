@@ -3,25 +3,59 @@ import traceback
 
 from PyQt5.QtCore import Qt
 import time
+from Lazy import lazy_import
 from Manager import DataManager
+from Scheduler import getScheduler
+from Slicing import AxisSlicer, SliceCache, aligned_axis, oblique_slice
+from Surface import SurfaceCache, extract_isosurface
+from TransferFunction import OPACITY_PRESETS, TransferFunction, create_volume
+from Trace import format_event, trace_render_window, traced, tracer
 from PyQt5 import QtWidgets, QtCore, QtGui
 from PyQt5.QtGui import QPalette, QColor
 from PyQt5.QtWidgets import QWidget, QLabel, QComboBox, QLineEdit, QHBoxLayout, QGridLayout, QFileDialog, QPushButton, \
-    QMessageBox, QTextEdit
-from matplotlib.figure import Figure
-from pyvistaqt import QtInteractor, MainWindow
-import matplotlib
-import matplotlib.pyplot as plt
+    QMessageBox, QTextEdit, QProgressBar
 import numpy as np
 
-matplotlib.use('Qt5Agg')
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
+# 渲染库在第一次创建画布或渲染窗口时导入，启动时只导入PyQt5与numpy
+matplotlib = lazy_import('matplotlib')
+pyvista = lazy_import('pyvista')
+pyvistaqt = lazy_import('pyvistaqt')
+vtk = lazy_import('vtk')
+saveFileType3DStr = "(*.mvol);;(*.mvolz);;(*.vtk);;(*.pvtk);;(*.vti);;(*.pvti);;(*.vtr);;(*.pvtr);;(*.vtu);;(*.pvtu);;(*.obj);;(*.vtp);;(*.slc);;"
+saveFileType2DStr = "(*.jpeg);;(*.jpg);;(*.png);;(*.bmp);;(*.mvol);;(*.mvolz)"
 
-colormaps3d = plt.colormaps()
-colormaps2d = plt.colormaps()
-colormaps2d[0], colormaps2d[57] = colormaps2d[57], colormaps2d[0]
-saveFileType3DStr = "(*.vtk);;(*.pvtk);;(*.vti);;(*.pvti);;(*.vtr);;(*.pvtr);;(*.vtu);;(*.pvtu);;(*.obj);;(*.vtp);;(*.slc);;"
-saveFileType2DStr = "(*.jpeg);;(*.jpg);;(*.png);;(*.bmp)"
+
+def colormaps3d():
+    return sorted(matplotlib.colormaps)
+
+
+def colormaps2d():
+    colormaps = colormaps3d()
+    colormaps[0], colormaps[57] = colormaps[57], colormaps[0]
+    return colormaps
+
+
+def createCanvas(figsize=None):
+    """matplotlib画布(Qt5Agg)"""
+    from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
+    from matplotlib.figure import Figure
+    canvas = FigureCanvasQTAgg(Figure(figsize=figsize))
+    # draw_idle最终调用draw，记录每次完整重绘
+    canvas.draw = traced(canvas.draw, name='canvas.draw', cat='render')
+    return canvas
+
+
+def showJobError(parent, name, message):
+    """后台任务失败时显示错误信息(异常的最后一行)，完整的traceback已输出到终端"""
+    lines = message.strip().splitlines()
+    QMessageBox.critical(parent, '错误', '%s 失败：%s' % (name, lines[-1] if lines else ''),
+                         QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+
+
+def parseSize(text):
+    """'20' -> 20, '20,20,5' -> (20, 20, 5)"""
+    sizes = tuple(int(value) for value in text.replace(' ', '').split(','))
+    return sizes[0] if len(sizes) == 1 else sizes
 
 
 class MenuBar(QtWidgets.QMenuBar):
@@ -30,22 +64,25 @@ class MenuBar(QtWidgets.QMenuBar):
         self.window = window
         self.dataManager = dataManager
 
-        self.menuNameDict = {'File': ['Open', {'Save': ['Save File', 'Save screenshots']}],
-                             'View': ['Iso-surface', 'Slice', '3D-config', '2D-config', 'DCM-info'],
+        self.menuNameDict = {'File': ['Open', 'Open DICOM folder', {'Save': ['Save File', 'Save screenshots']}],
+                             'View': ['Iso-surface', 'Slice', 'MPR', '3D-config', '2D-config', 'DCM-info'],
                              'Process': [
                                  {'Filter': ['Uniform', 'Median', 'Gaussian', 'Maximum', 'Minimum']},
-                                 {'FFT': ['FFT', 'FFT shift']},
+                                 {'FFT': ['FFT', 'FFT shift', 'Phase', 'Inverse FFT']},
+                                 {'Frequency': ['Low-pass', 'High-pass', 'Band-pass']},
                                  {'Gray': ['High', 'Low']},
-                                 {'Noise': ['Salt', 'Gaussian']},
+                                 {'Noise': ['Salt', 'Gaussian', 'Poisson', 'Speckle']},
                                  {'Sharpen': ['Sobel', 'Prewitt', 'Laplace']},
                                  'Counter',
                                  'Emboss',
-                                 'Historgram'
-                             ]
+                                 'Historgram',
+                                 {'Precision': ['Native', 'Float32', 'Float64']}
+                             ],
+                             'Trace': ['Start/Stop', 'Export trace', 'Clear']
                              }
 
-        self.actionTriggerDict = {'File': [self.open, {'Save': [self.save_file, self.save_screenshots]}],
-                                  'View': [self.iso_surface, self.slice, self.display3DConfig, self.display2DConfig,self.dcm_info],
+        self.actionTriggerDict = {'File': [self.open, self.open_dcm_folder, {'Save': [self.save_file, self.save_screenshots]}],
+                                  'View': [self.iso_surface, self.slice, self.mpr, self.display3DConfig, self.display2DConfig,self.dcm_info],
                                   'Process': [
                                       {'Filter': [
                                           self.uniform_filter,
@@ -55,9 +92,12 @@ class MenuBar(QtWidgets.QMenuBar):
                                           self.minimum_filter
                                       ]},
 
-                                      {'FFT': [self.fft, self.shift_fft]},
+                                      {'FFT': [self.fft, self.shift_fft, self.fft_phase, self.inverse_fft]},
+                                      {'Frequency': [self.lowpass_filter, self.highpass_filter,
+                                                     self.bandpass_filter]},
                                       {'Gray': [self.highGray, self.lowGray]},
-                                      {'Noise': [self.Salt_noice, self.Gaussian_noice]},
+                                      {'Noise': [self.Salt_noice, self.Gaussian_noice, self.Poisson_noice,
+                                                 self.Speckle_noice]},
                                       {
                                           'Sharpen': [
                                               self.sobel,
@@ -67,8 +107,11 @@ class MenuBar(QtWidgets.QMenuBar):
                                       },
                                       self.counter,
                                       self.emboss,
-                                      self.his
-                                  ]
+                                      self.his,
+                                      {'Precision': [self.native_precision, self.float32_precision,
+                                                     self.float64_precision]}
+                                  ],
+                                  'Trace': [self.toggle_trace, self.export_trace, self.clear_trace]
                                   }
 
         for key in self.menuNameDict:
@@ -105,12 +148,30 @@ class MenuBar(QtWidgets.QMenuBar):
         if len(file_path) == 0:
             return
         try:
-            self.dataManager.read_data(file_path)
-            self.window.display()
+            # 读入新的DataManager，仍在运行的后台任务使用的是原来的数据
+            dataManager = DataManager(precision=self.dataManager.precision)
+            dataManager.read_data(file_path)
+            self.showOpened(dataManager)
         except Exception as e:
             print(e)
             traceback.print_exc()
 
+    def open_dcm_folder(self):
+        if self.window == None:
+            return
+
+        dir_path = QFileDialog.getExistingDirectory(caption="open DICOM folder dialog")
+        if len(dir_path) == 0:
+            return
+        # 在工作线程中读入新的DataManager，读取期间窗口与其他任务继续使用原来的数据，完成后在GUI线程中替换
+        dataManager = DataManager(precision=self.dataManager.precision)
+        job = self.window.jobStatusWidget.submit('Open DICOM folder', dataManager.read_data, dir_path)
+        job.signals.finished.connect(lambda _, dataManager=dataManager: self.showOpened(dataManager))
+
+    def showOpened(self, dataManager):
+        self.window.setDataManager(dataManager)
+        self.window.display()
+
     def save_file(self):
         try:
             file_path = None
@@ -124,6 +185,31 @@ class MenuBar(QtWidgets.QMenuBar):
         except Exception as e:
             traceback.print_exc()
 
+    def toggle_trace(self):
+        """开始/停止记录读取、处理、显示与渲染的耗时，记录显示在状态栏"""
+        if tracer.enabled:
+            tracer.disable()
+        else:
+            tracer.enable()
+        self.window.updateResourceUsage()
+
+    def export_trace(self):
+        """保存为Chrome追踪格式，可在chrome://tracing或ui.perfetto.dev中打开"""
+        if not tracer.events:
+            QMessageBox.critical(self, '错误', '没有记录，请先在Trace菜单中开始记录', QMessageBox.Yes | QMessageBox.No,
+                                 QMessageBox.Yes)
+            return
+        try:
+            file_path = QFileDialog.getSaveFileName(caption='Export trace', filter='(*.json)')[0]
+            if (file_path != ''):
+                tracer.export_chrome(file_path)
+        except Exception as e:
+            traceback.print_exc()
+
+    def clear_trace(self):
+        tracer.clear()
+        self.window.updateResourceUsage()
+
     def save_screenshots(self):
         if (self.dataManager.ugrid_data == None):
             QMessageBox.critical(self, '错误', '只有导入三维体数据才能截图', QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
@@ -137,42 +223,83 @@ class MenuBar(QtWidgets.QMenuBar):
         except:
             traceback.print_exc()
 
+    def runInBackground(self, name, func, *args, **kwargs):
+        """在后台线程执行DataManager的处理函数，完成后在新窗口显示结果"""
+        job = self.window.jobStatusWidget.submit(name, func, *args, **kwargs)
+        job.signals.finished.connect(lambda dataManager: self.displayInOtherWindow(dataManager=dataManager))
+        return job
+
+    def askFilterSize(self, title):
+        """滤波核大小，输入一个值或以逗号分隔的每个轴的值，如 20 或 20,20,5"""
+        parameters = ParameterDialog.getParameters(self, title, [('size', 20, parseSize)])
+        if parameters is None:
+            return None
+        return parameters['size']
+
     def maximum_filter(self):
-        newDataManager = self.dataManager.maximum_filter()
-        self.displayInOtherWindow(dataManager=newDataManager)
+        size = self.askFilterSize('Maximum')
+        if size is not None:
+            self.runInBackground('Maximum', self.dataManager.maximum_filter, size)
 
     def minimum_filter(self):
-        newDataManager = self.dataManager.minimum_filter()
-        self.displayInOtherWindow(dataManager=newDataManager)
+        size = self.askFilterSize('Minimum')
+        if size is not None:
+            self.runInBackground('Minimum', self.dataManager.minimum_filter, size)
 
     def uniform_filter(self):
         """"""
-        newDataManager = self.dataManager.uniform_filter()
-        self.displayInOtherWindow(dataManager=newDataManager)
+        size = self.askFilterSize('Uniform')
+        if size is not None:
+            self.runInBackground('Uniform', self.dataManager.uniform_filter, size)
 
     def median_blur(self):
         """中值过滤"""
-        newDataManager = self.dataManager.median_blur()
-        self.displayInOtherWindow(dataManager=newDataManager)
+        self.runInBackground('Median', self.dataManager.median_blur)
 
     def gaussian_blur(self):
-        newDataManager = self.dataManager.gaussian_blur()
-        self.displayInOtherWindow(dataManager=newDataManager)
+        parameters = ParameterDialog.getParameters(self, 'Gaussian', [('sigma', 5.0, float)])
+        if parameters is not None:
+            self.runInBackground('Gaussian', self.dataManager.gaussian_blur, **parameters)
 
     def sharpen(self):
         pass
 
     def fft(self):
-        newDataManager = self.dataManager.fft()
-        self.displayInOtherWindow(dataManager=newDataManager)
+        self.runInBackground('FFT', self.dataManager.fft)
 
     def shift_fft(self):
-        newDataManager = self.dataManager.shift_fft()
-        self.displayInOtherWindow(dataManager=newDataManager)
+        self.runInBackground('FFT shift', self.dataManager.shift_fft)
 
+    def fft_phase(self):
+        self.runInBackground('Phase', self.dataManager.fft_phase)
+
+    def inverse_fft(self):
+        self.runInBackground('Inverse FFT', self.dataManager.inverse_fft)
+
+    def frequency_filter(self, title, band, cutoff, high_cutoff=None):
+        """频域滤波，kind为ideal、butterworth或gaussian，截止频率单位为周期/像素(0~0.5)"""
+        parameters = [('kind', 'butterworth', str), ('cutoff', cutoff, float)]
+        if band == 'bandpass':
+            parameters.append(('high_cutoff', high_cutoff, float))
+        parameters.append(('order', 2, int))
+        parameters = ParameterDialog.getParameters(self, title, parameters)
+        if parameters is not None:
+            self.runInBackground(title, self.dataManager.frequency_filter, band=band, **parameters)
+
+    def lowpass_filter(self):
+        self.frequency_filter('Low-pass', 'lowpass', 0.1)
+
+    def highpass_filter(self):
+        self.frequency_filter('High-pass', 'highpass', 0.05)
+
+    def bandpass_filter(self):
+        self.frequency_filter('Band-pass', 'bandpass', 0.05, 0.2)
+
+    @traced
     def displayInOtherWindow(self, dataManager):
         try:
-            subWindow = self.window.createSubWindow(title=self.window.windowTitle() + 'sub', dataManager=dataManager)
+            subWindow = self.window.createSubWindow(title=self.window.windowTitle() + 'sub',
+                                                    isVolumeData=dataManager.ugrid_data is not None, dataManager=dataManager)
             subWindow.show()
             subWindow.display()
         except Exception as e:
@@ -189,6 +316,16 @@ class MenuBar(QtWidgets.QMenuBar):
             self.window.sliceWidget = SliceWidget(self.dataManager.ugrid_data)
             self.window.sliceWidget.show()
 
+    def mpr(self):
+        """在窗口的显示区域切换体绘制与三平面(轴位、冠状位、矢状位)显示"""
+        if (self.dataManager.ugrid_data == None):
+            QMessageBox.critical(self, '错误', '请先导入体数据', QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+            return
+        try:
+            self.window.displayMPR()
+        except:
+            traceback.print_exc()
+
     def dcm_info(self):
         if (self.dataManager.dcm_data != None):
             try:
@@ -197,72 +334,81 @@ class MenuBar(QtWidgets.QMenuBar):
             except :
                 traceback.print_exc()
     def highGray(self):
-        try:
-            newDataManager = self.dataManager.gray(1)
-            self.displayInOtherWindow(newDataManager)
-        except Exception as e:
-            print(e)
-            traceback.print_exc()
+        self.runInBackground('Gray high', self.dataManager.gray, 1)
 
     def lowGray(self):
-        try:
-            newDataManager = self.dataManager.gray(0)
-            self.displayInOtherWindow(newDataManager)
-        except Exception as e:
-            print(e)
-            traceback.print_exc()
+        self.runInBackground('Gray low', self.dataManager.gray, 0)
 
     def Salt_noice(self):
-        try:
-            newDataManager = self.dataManager.Salt_noice()
-            self.displayInOtherWindow(newDataManager)
-        except Exception as e:
-            print(e)
-            traceback.print_exc()
+        parameters = ParameterDialog.getParameters(self, 'Salt noise', [('amount', 0.1, float), ('seed', None, int)])
+        if parameters is not None:
+            self.runInBackground('Salt noise', self.dataManager.Salt_noice, **parameters)
 
     def Gaussian_noice(self):
-        try:
-            newDataManager = self.dataManager.Gaussian_noice()
-            self.displayInOtherWindow(newDataManager)
-        except Exception as e:
-            print(e)
-            traceback.print_exc()
+        parameters = ParameterDialog.getParameters(self, 'Gaussian noise', [('sigma', 48.0, float), ('snr', None, float),
+                                                                            ('seed', None, int)])
+        if parameters is not None:
+            self.runInBackground('Gaussian noise', self.dataManager.Gaussian_noice, **parameters)
+
+    def Poisson_noice(self):
+        parameters = ParameterDialog.getParameters(self, 'Poisson noise', [('scale', 1.0, float), ('seed', None, int)])
+        if parameters is not None:
+            self.runInBackground('Poisson noise', self.dataManager.Poisson_noice, **parameters)
+
+    def Speckle_noice(self):
+        parameters = ParameterDialog.getParameters(self, 'Speckle noise', [('sigma', 0.1, float), ('seed', None, int)])
+        if parameters is not None:
+            self.runInBackground('Speckle noise', self.dataManager.Speckle_noice, **parameters)
 
     def counter(self):
         """轮廓"""
-        newDataManager = self.dataManager.counterDetail()
-        self.displayInOtherWindow(dataManager=newDataManager)
+        self.runInBackground('Counter', self.dataManager.counterDetail)
+
+    def set_precision(self, precision):
+        """之后的处理结果使用的精度策略(见Manager.PRECISIONS)，结果窗口继承，在状态栏显示"""
+        self.dataManager.precision = precision
+        self.window.updateResourceUsage()
+
+    def native_precision(self):
+        self.set_precision('native')
+
+    def float32_precision(self):
+        self.set_precision('float32')
+
+    def float64_precision(self):
+        self.set_precision('float64')
 
     def his(self):
-        self.dataManager.Historn()
+        """在窗口内显示或隐藏直方图，先显示抽样统计的结果，完整统计在后台执行"""
+        if type(self.dataManager.numpy_data) == type(None):
+            QMessageBox.critical(self, '错误', '请先导入数据', QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+            return
+        histogramWidget = self.window.histogramWidget
+        if histogramWidget.isVisible():
+            histogramWidget.setVisible(False)
+            return
+        histogramWidget.setVisible(True)
+        histogramWidget.update()
 
     def emboss(self):
         """浮雕"""
-        newDataManager = self.dataManager.embossFilter()
-        self.displayInOtherWindow(dataManager=newDataManager)
+        self.runInBackground('Emboss', self.dataManager.embossFilter)
 
     def sobel(self):
         """sobel算子"""
-        newDataManager = self.dataManager.sharpenSobel()
-        self.displayInOtherWindow(dataManager=newDataManager)
+        self.runInBackground('Sobel', self.dataManager.sharpenSobel)
 
     def prewitt(self):
         """prewitt算子"""
-        newDataManager = self.dataManager.sharpenPrewitt()
-        self.displayInOtherWindow(dataManager=newDataManager)
+        self.runInBackground('Prewitt', self.dataManager.sharpenPrewitt)
 
     def laplace(self):
         """拉普拉斯算子"""
-        newDataManager = self.dataManager.sharpenLaplace()
-        self.displayInOtherWindow(dataManager=newDataManager)
+        self.runInBackground('Laplace', self.dataManager.sharpenLaplace)
 
     def sharpen(self):
         """锐化 2d"""
-        try:
-            newDataManager = self.dataManager.sharpen2D()
-            self.displayInOtherWindow(dataManager=newDataManager)
-        except:
-            traceback.print_exc()
+        self.runInBackground('Sharpen', self.dataManager.sharpen2D)
 
     def display3DConfig(self):
         if (self.dataManager.ugrid_data == None):
@@ -280,6 +426,48 @@ class MenuBar(QtWidgets.QMenuBar):
             traceback.print_exc()
 
 
+class ParameterDialog(QtWidgets.QDialog):
+    """处理函数的参数输入对话框
+
+    parameters为[(参数名, 默认值, 类型)]，默认值为None的参数可以留空。
+    """
+
+    def __init__(self, parent, title, parameters) -> None:
+        super().__init__(parent)
+        self.parameters = parameters
+        self.lineEdits = []
+        layout = QtWidgets.QFormLayout()
+        for name, default, _ in parameters:
+            lineEdit = QLineEdit('' if default is None else str(default))
+            self.lineEdits.append(lineEdit)
+            layout.addRow(QLabel(name), lineEdit)
+        buttons = QtWidgets.QDialogButtonBox(QtWidgets.QDialogButtonBox.Ok | QtWidgets.QDialogButtonBox.Cancel)
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addRow(buttons)
+        self.setLayout(layout)
+        self.setWindowTitle(title)
+
+    def values(self):
+        values = {}
+        for (name, default, parse), lineEdit in zip(self.parameters, self.lineEdits):
+            text = lineEdit.text().strip()
+            values[name] = parse(text) if text != '' else default
+        return values
+
+    @staticmethod
+    def getParameters(parent, title, parameters):
+        """显示对话框，取消或输入有误时返回None"""
+        dialog = ParameterDialog(parent, title, parameters)
+        if dialog.exec_() != QtWidgets.QDialog.Accepted:
+            return None
+        try:
+            return dialog.values()
+        except ValueError:
+            QMessageBox.critical(parent, '错误', '参数格式错误', QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+            return None
+
+
 class DCMInfoWidget(QWidget):
     def __init__(self, dcm):
         super().__init__()
@@ -311,6 +499,14 @@ class IsoSurfaceWidget(QtWidgets.QWidget):
     def __init__(self, volumeData):
         super().__init__()
         self.volumeData = volumeData
+        # 等值面按(等值, 三角形上限)缓存，场景中每个等值对应一个actor
+        self.surfaceCache = SurfaceCache()
+        self.actors = {}  # 等值 -> actor
+        self.jobs = {}  # 等值 -> 正在提取的任务
+        self.levels = []
+        self.maxTriangles = None
+        self.opacity = 1.0
+        self.colorRange = (0.0, 1.0)
         rangeLabel = QLabel(self)
         rangeLabel.setText('Range: ')
         noteLabel = QLabel(self)
@@ -319,19 +515,24 @@ class IsoSurfaceWidget(QtWidgets.QWidget):
         numLabel.setText("Number:")
         opacityLabel = QLabel(self)
         opacityLabel.setText("Opacity(0~1):")
+        trianglesLabel = QLabel(self)
+        trianglesLabel.setText("Max triangles:")
 
         self.leftRangeLineEdit = QLineEdit()
         self.rightRangeLineEdit = QLineEdit()
         self.numLineEdit = QLineEdit()
         self.opacityLineEdit = QLineEdit()
+        # 所有等值面的三角形总数上限，留空则不简化
+        self.trianglesLineEdit = QLineEdit()
 
         # 添加按钮
         self.drawBtn = QPushButton('Draw', self)
         self.screenshotBtn = QPushButton('Screenshot', self)
         # 添加显示组件
         self.frame = QtWidgets.QFrame()
-        self.plotter = QtInteractor(self.frame)
+        self.plotter = pyvistaqt.QtInteractor(self.frame)
         self.display3DWidget = self.plotter.interactor
+        trace_render_window(self.plotter.ren_win, 'IsoSurfaceWidget.render')
 
         gridLayout = QGridLayout()
         gridLayout.addWidget(self.display3DWidget, 0, 0, 85, 1)
@@ -347,8 +548,11 @@ class IsoSurfaceWidget(QtWidgets.QWidget):
         gridLayout.addWidget(opacityLabel, 2, 1)
         gridLayout.addWidget(self.opacityLineEdit, 2, 2)
 
-        gridLayout.addWidget(self.drawBtn, 3, 1)
-        gridLayout.addWidget(self.screenshotBtn, 3, 2)
+        gridLayout.addWidget(trianglesLabel, 3, 1)
+        gridLayout.addWidget(self.trianglesLineEdit, 3, 2)
+
+        gridLayout.addWidget(self.drawBtn, 4, 1)
+        gridLayout.addWidget(self.screenshotBtn, 4, 2)
 
         gridLayout.setColumnStretch(0, 7)
         gridLayout.setColumnStretch(2, 1)
@@ -373,12 +577,82 @@ class IsoSurfaceWidget(QtWidgets.QWidget):
             if (opacity < 0 or opacity > 1):
                 QMessageBox.critical(self, '错误', '透明度范围为0-1', QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
                 return
-            contours = self.volumeData.contour(np.linspace(start, stop, num))
-            self.plotter.clear()
-            self.plotter.add_mesh(contours, opacity=opacity)
+            text = self.trianglesLineEdit.text().strip()
+            totalTriangles = int(text) if text != '' else None
         except Exception as e:
             print(e)
             traceback.print_exc()
+            return
+        levels = [float(level) for level in np.linspace(start, stop, num)]
+        maxTriangles = None if totalTriangles is None else max(totalTriangles // max(num, 1), 1)
+        self.updateLevels(levels, opacity, maxTriangles, (float(start), float(stop)))
+
+    def updateLevels(self, levels, opacity, maxTriangles, colorRange):
+        """只提取新增的等值面，移除不再需要的，已有的等值面只修改颜色与透明度"""
+        if maxTriangles != self.maxTriangles or colorRange != self.colorRange:
+            # 三角形上限或颜色范围改变时场景中的等值面与正在提取的等值面都需要替换
+            for level in list(self.actors) + list(self.jobs):
+                self.removeLevel(level)
+        self.levels = levels
+        self.opacity = opacity
+        self.maxTriangles = maxTriangles
+        self.colorRange = colorRange
+        for level in list(self.actors) + list(self.jobs):
+            if level not in levels:
+                self.removeLevel(level)
+        for level in levels:
+            if level in self.actors:
+                self.actors[level].GetProperty().SetOpacity(opacity)
+                continue
+            if level in self.jobs:
+                continue
+            surface = self.surfaceCache.get(level, maxTriangles)
+            if surface is not None:
+                self.addLevel(level, maxTriangles, surface)
+            else:
+                job = getScheduler().submit('Iso-surface %g' % level, extract_isosurface, self.volumeData, level,
+                                            maxTriangles)
+                job.signals.finished.connect(
+                    lambda surface, level=level, maxTriangles=maxTriangles, job=job: self.onExtracted(
+                        level, maxTriangles, surface, job))
+                job.signals.failed.connect(lambda message, level=level, job=job: self.onFailed(level, job, message))
+                self.jobs[level] = job
+        self.plotter.render()
+
+    def onExtracted(self, level, maxTriangles, surface, job):
+        self.surfaceCache.put(level, maxTriangles, surface)
+        # 已被取消或替换的任务(同一等值面可能已经重新提交)的结果只放入缓存
+        if not self.dropJob(level, job) or maxTriangles != self.maxTriangles or level not in self.levels:
+            return
+        self.addLevel(level, maxTriangles, surface)
+        self.plotter.render()
+
+    def onFailed(self, level, job, message):
+        if self.dropJob(level, job):
+            showJobError(self, job.name, message)
+
+    def dropJob(self, level, job):
+        """job仍是level当前的提取任务时移除并返回True"""
+        if self.jobs.get(level) is not job:
+            return False
+        del self.jobs[level]
+        return True
+
+    def addLevel(self, level, maxTriangles, surface):
+        start, stop = self.colorRange
+        t = (level - start) / (stop - start) if stop > start else 0.5
+        color = matplotlib.colormaps['viridis'](t)[:3]
+        self.actors[level] = self.plotter.add_mesh(surface, color=color, opacity=self.opacity,
+                                                   name='iso-%r' % level, reset_camera=len(self.actors) == 0,
+                                                   render=False)
+
+    def removeLevel(self, level):
+        job = self.jobs.pop(level, None)
+        if job is not None:
+            job.cancel()
+        actor = self.actors.pop(level, None)
+        if actor is not None:
+            self.plotter.remove_actor(actor, render=False)
 
     def screenshot(self):
         filePath = QFileDialog.getExistingDirectory(caption='Save file dialog')
@@ -388,13 +662,32 @@ class IsoSurfaceWidget(QtWidgets.QWidget):
 
     def closeEvent(self, a0: QtGui.QCloseEvent) -> None:
         super().closeEvent(a0)
+        for job in self.jobs.values():
+            job.cancel()
         self.display3DWidget.close()
 
 
 class SliceWidget(QtWidgets.QWidget):
+    """拖动平面控件连续切片
+
+    拖动过程中的更新按sliceInterval毫秒节流。与坐标轴垂直的切片直接从numpy数组中取出，
+    任意方向的切片在后台线程计算，计算期间的新位置只保留最后一个。
+    """
+
+    sliceInterval = 30
+
     def __init__(self, volumeData):
         super().__init__()
         self.volumeData = volumeData
+        self.slicer = AxisSlicer(volumeData)
+        self.clim = volumeData.get_data_range(volumeData.array_names[0], preference='point')
+        self.sliceActor = None
+        self.pendingPlane = None
+        self.obliqueJob = None
+        self.sliceSequence = 0  # 每次切片请求加1，晚于新请求完成的斜切结果不再显示
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.updateSlice)
         # 标签
         normalVectorLabel = QLabel("Normal Vector: ")
         originPointLabel = QLabel("Origin Point: ")
@@ -419,8 +712,9 @@ class SliceWidget(QtWidgets.QWidget):
         # 显示组件
         self.frame = QtWidgets.QFrame()
 
-        self.plotter = QtInteractor(self.frame)
+        self.plotter = pyvistaqt.QtInteractor(self.frame)
         self.display3DWidget = self.plotter.interactor
+        trace_render_window(self.plotter.ren_win, 'SliceWidget.render')
         # self.display3DWidget.setBaseSize(500,900)
         # 布局
         gridLayout = QGridLayout()
@@ -454,18 +748,76 @@ class SliceWidget(QtWidgets.QWidget):
         self.setLayout(gridLayout)
         self.setWindowTitle('Slice')
 
+        self.plotter.add_mesh(self.volumeData.outline())
+        # 平面控件：松开时由pyvista回调，拖动过程中由InteractionEvent回调
+        self.planeWidget = self.plotter.add_plane_widget(self.requestSlice, normal='z', origin=self.volumeData.center,
+                                                         bounds=self.volumeData.bounds, test_callback=False)
+        self.planeWidget.AddObserver('InteractionEvent', self.onPlaneMoved)
+        self.requestSlice((0.0, 0.0, 1.0), self.volumeData.center)
+
     def slice(self):
-        normal = (
-            float(self.normalXLineEdit.text()), float(self.normalYLineEdit.text()), float(self.normalZLineEdit.text()))
-        origin = (
-            float(self.originXLineEdit.text()), float(self.originYLineEdit.text()), float(self.originZLineEdit.text()))
-        # normal = np.array(normal)
-        # normal = normal/np.linalg.norm(normal) #向量正交
-        slices = self.volumeData.slice(normal=normal, origin=origin)
-
-        self.display3DWidget.clear()
-        self.display3DWidget.add_mesh(self.volumeData.outline())
-        self.display3DWidget.add_mesh(slices)
+        try:
+            normal = (
+                float(self.normalXLineEdit.text()), float(self.normalYLineEdit.text()), float(self.normalZLineEdit.text()))
+            origin = (
+                float(self.originXLineEdit.text()), float(self.originYLineEdit.text()), float(self.originZLineEdit.text()))
+        except ValueError:
+            QMessageBox.critical(self, '错误', '请输入法向量与原点坐标', QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+            return
+        self.planeWidget.SetNormal(*normal)
+        self.planeWidget.SetOrigin(*origin)
+        self.requestSlice(normal, origin)
+
+    def onPlaneMoved(self, widget, event):
+        plane = vtk.vtkPlane()
+        widget.GetPlane(plane)
+        self.requestSlice(plane.GetNormal(), plane.GetOrigin())
+
+    def requestSlice(self, normal, origin):
+        self.pendingPlane = (tuple(normal), tuple(origin))
+        if not self.timer.isActive():
+            self.timer.start(self.sliceInterval)
+
+    def updateSlice(self):
+        if self.pendingPlane is None:
+            return
+        normal, origin = self.pendingPlane
+        axis = aligned_axis(normal)
+        if axis is not None:
+            self.pendingPlane = None
+            self.sliceSequence += 1
+            self.showSlice(self.slicer.slice(axis, origin[axis]))
+        elif self.obliqueJob is None:
+            self.pendingPlane = None
+            self.sliceSequence += 1
+            sequence = self.sliceSequence
+            self.obliqueJob = getScheduler().submit('Slice', oblique_slice, self.volumeData, normal, origin)
+            for signal in (self.obliqueJob.signals.finished, self.obliqueJob.signals.failed,
+                           self.obliqueJob.signals.cancelled):
+                signal.connect(lambda result=None, sequence=sequence: self.onObliqueSliced(result, sequence))
+
+    def onObliqueSliced(self, result=None, sequence=None):
+        self.obliqueJob = None
+        # 计算期间已显示了更新的(轴向)切片时丢弃结果
+        if isinstance(result, pyvista.DataSet) and sequence == self.sliceSequence:
+            self.showSlice(result)
+        elif isinstance(result, str):
+            showJobError(self, 'Slice', result)
+        # 计算期间平面又被移动过
+        if self.pendingPlane is not None:
+            self.updateSlice()
+
+    def showSlice(self, mesh):
+        if self.sliceActor is None:
+            self.sliceActor = self.plotter.add_mesh(mesh, scalars=self.slicer.name, clim=self.clim, name='slice',
+                                                    reset_camera=False)
+            mapper = self.sliceActor.GetMapper()
+            mapper.SetScalarModeToUsePointFieldData()
+            mapper.SelectColorArray(self.slicer.name)
+            mapper.SetScalarRange(*self.clim)
+        # 轴向切片网格是复用的，只替换mapper的输入，不重新创建actor
+        self.sliceActor.GetMapper().SetInputData(mesh)
+        self.plotter.render()
 
     def screenshot(self):
         filePath = QFileDialog.getExistingDirectory(caption='Save file dialog')
@@ -475,6 +827,9 @@ class SliceWidget(QtWidgets.QWidget):
 
     def closeEvent(self, a0: QtGui.QCloseEvent) -> None:
         super().closeEvent(a0)
+        self.timer.stop()
+        if self.obliqueJob is not None:
+            self.obliqueJob.cancel()
         self.display3DWidget.close()
 
 
@@ -484,7 +839,7 @@ class Config2DWidget(QtWidgets.QWidget):
         self.window = window
         colorMapLabel = QLabel(self)
         colorMapLabel.setText('color map')
-        colorMapItem = colormaps2d
+        colorMapItem = colormaps2d()
         self.colorMapComboBox = QComboBox(self)
         for item in colorMapItem:
             self.colorMapComboBox.addItem(item)
@@ -513,37 +868,654 @@ class Config3DWidget(QtWidgets.QWidget):
         opacityLabel = QLabel(self)
         opacityLabel.setText('opacity')
 
-        colorMapItem = colormaps3d
+        colorMapItem = colormaps3d()
         self.colorMapComboBox = QComboBox(self)
         for item in colorMapItem:
             self.colorMapComboBox.addItem(item)
-        opacityItem = ['linear', 'linear_r', 'geom', 'geom_r', 'sigmoid', 'sigmoid_r']
+        opacityItem = OPACITY_PRESETS
         self.opacityComboBox = QComboBox(self)
         for item in opacityItem:
             self.opacityComboBox.addItem(item)
 
-        self.colorMapComboBox.currentIndexChanged.connect(self.update)
-        self.opacityComboBox.currentIndexChanged.connect(self.update)
+        # 颜色表与不透明度分别更新，切换颜色表时保留编辑过的不透明度控制点
+        self.colorMapComboBox.currentIndexChanged.connect(self.updateColorMap)
+        self.opacityComboBox.currentIndexChanged.connect(self.updateOpacity)
+
+        # 交互时的降采样显示
+        self.lodCheckBox = QtWidgets.QCheckBox('LOD', self)
+        self.lodCheckBox.setChecked(True)
+        fpsLabel = QLabel(self)
+        fpsLabel.setText('fps')
+        self.fpsSpinBox = QtWidgets.QSpinBox(self)
+        self.fpsSpinBox.setRange(1, 60)
+        self.fpsSpinBox.setValue(15)
+        idleLabel = QLabel(self)
+        idleLabel.setText('refine (ms)')
+        self.idleSpinBox = QtWidgets.QSpinBox(self)
+        self.idleSpinBox.setRange(0, 5000)
+        self.idleSpinBox.setSingleStep(100)
+        self.idleSpinBox.setValue(300)
+        self.lodCheckBox.stateChanged.connect(self.updateLOD)
+        self.fpsSpinBox.valueChanged.connect(self.updateLOD)
+        self.idleSpinBox.valueChanged.connect(self.updateLOD)
+
+        # 不透明度控制点编辑
+        self.opacityEditor = OpacityEditorWidget(window)
 
         # 创建水平布局
 
+        configLayout = QHBoxLayout()
+        configLayout.addWidget(colorMapLabel)
+        configLayout.addWidget(self.colorMapComboBox)
+        configLayout.addWidget(opacityLabel)
+        configLayout.addWidget(self.opacityComboBox)
+        configLayout.addWidget(self.lodCheckBox)
+        configLayout.addWidget(fpsLabel)
+        configLayout.addWidget(self.fpsSpinBox)
+        configLayout.addWidget(idleLabel)
+        configLayout.addWidget(self.idleSpinBox)
+        layout = QtWidgets.QVBoxLayout()
+        layout.addLayout(configLayout)
+        layout.addWidget(self.opacityEditor)
+        self.setLayout(layout)
+
+    def updateLOD(self):
+        volumeLOD = self.window.volumeLOD
+        volumeLOD.enabled = self.lodCheckBox.isChecked()
+        volumeLOD.interactiveFps = float(self.fpsSpinBox.value())
+        volumeLOD.idleDelay = self.idleSpinBox.value()
+
+    def updateColorMap(self):
+        try:
+            self.window.updateVolumeRender(cmap=self.colorMapComboBox.currentText())
+        except:
+            traceback.print_exc()
+
+    def updateOpacity(self):
+        try:
+            self.window.updateVolumeRender(opacity=self.opacityComboBox.currentText())
+        except:
+            traceback.print_exc()
+
+
+class OpacityEditorWidget(QtWidgets.QWidget):
+    """不透明度传递函数编辑器：拖动控制点，双击添加，右键删除
+
+    只修改传递函数后重新渲染，不涉及体数据。拖动过程中按交互处理，使用降采样的层级。
+    """
+
+    pickRadius = 8  # 选中控制点的像素距离
+
+    def __init__(self, window) -> None:
+        super().__init__(window)
+        self.window = window
+        self.transferFunction = None
+        self.dragIndex = None
+
+        self.canvas = createCanvas((5, 1.5))
+        self.ax = self.canvas.figure.add_subplot(111)
+        self.ax.set_ylim(-0.05, 1.05)
+        self.line, = self.ax.plot([], [], '-o', color='tab:blue', markersize=5)
+        self.canvas.setMinimumHeight(120)
+        self.canvas.mpl_connect('button_press_event', self.onPress)
+        self.canvas.mpl_connect('motion_notify_event', self.onMotion)
+        self.canvas.mpl_connect('button_release_event', self.onRelease)
+
         layout = QHBoxLayout()
-        layout.addWidget(colorMapLabel)
-        layout.addWidget(self.colorMapComboBox)
-        layout.addWidget(opacityLabel)
-        layout.addWidget(self.opacityComboBox)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.canvas)
+        self.setLayout(layout)
+
+    def setTransferFunction(self, transferFunction):
+        self.transferFunction = transferFunction
+        low, high = transferFunction.clim
+        self.ax.set_xlim(low, high if high > low else low + 1)
+        self.refresh()
+
+    def refresh(self):
+        points = self.transferFunction.points
+        self.line.set_data([self.transferFunction.value(t) for t, _ in points], [a for _, a in points])
+        self.canvas.draw_idle()
+
+    def pick(self, event):
+        """离鼠标最近且在pickRadius像素内的控制点下标"""
+        points = [(self.transferFunction.value(t), a) for t, a in self.transferFunction.points]
+        distances = np.hypot(*(self.ax.transData.transform(points) - (event.x, event.y)).T)
+        index = int(np.argmin(distances))
+        return index if distances[index] <= self.pickRadius else None
+
+    def relative(self, x):
+        low, high = self.transferFunction.clim
+        return (x - low) / (high - low) if high > low else 0.0
+
+    def onPress(self, event):
+        if self.transferFunction is None or event.inaxes != self.ax:
+            return
+        points = list(self.transferFunction.points)
+        index = self.pick(event)
+        if event.button == 3:
+            # 两端的控制点不能删除
+            if index is not None and 0 < index < len(points) - 1:
+                del points[index]
+                self.apply(points)
+        elif event.dblclick:
+            points.append((float(np.clip(self.relative(event.xdata), 0, 1)), event.ydata))
+            self.apply(points)
+        elif index is not None:
+            self.dragIndex = index
+            self.window.volumeLOD.onStartInteraction()
+
+    def onMotion(self, event):
+        if self.dragIndex is None or event.inaxes != self.ax:
+            return
+        points = list(self.transferFunction.points)
+        index = self.dragIndex
+        if index == 0 or index == len(points) - 1:
+            # 两端的控制点只能上下移动
+            t = points[index][0]
+        else:
+            t = float(np.clip(self.relative(event.xdata), points[index - 1][0], points[index + 1][0]))
+        points[index] = (t, event.ydata)
+        self.apply(points)
+
+    def onRelease(self, event):
+        if self.dragIndex is not None:
+            self.dragIndex = None
+            self.window.volumeLOD.onEndInteraction()
+
+    def apply(self, points):
+        self.transferFunction.set_opacity_points(points)
+        self.refresh()
+        self.window.plotter.render()
+
+
+class ImageView:
+    """二维图像显示：坐标轴上只保留一个AxesImage，显示新数据或修改颜色表时原地更新
+
+    数据按画布的像素尺寸取步长降采样(视图，不拷贝)后再交给matplotlib，
+    重绘耗时与屏幕分辨率有关而与图像大小无关。叠加显示的对象(十字线等)用blit绘制，
+    只重绘坐标轴区域，不重新绘制图像。
+    """
+
+    def __init__(self, ax, canvas) -> None:
+        self.ax = ax
+        self.canvas = canvas
+        self.image = None
+        self.data = None
+        self.source = None  # 传入setData/setImage的数组(data可能是它去掉通道轴后的视图)
+        self.step = 1
+        self.overlays = []
+        self.background = None
+        canvas.mpl_connect('draw_event', self.onDraw)
+        canvas.mpl_connect('resize_event', lambda event: self.resample())
+
+    def setData(self, data, cmap=None, clim=None):
+        self.source = data
+        if data.ndim == 3 and data.shape[-1] == 1:
+            data = data[..., 0]
+        self.data = data
+        if clim is None and data.ndim == 2:
+            clim = (float(np.min(data)), float(np.max(data)))
+        self.resample(draw=False)
+        if cmap is not None:
+            self.image.set_cmap(cmap)
+        if clim is not None:
+            self.image.set_clim(*clim)
+        # 图像大小改变时重新设置显示范围
+        self.ax.set_xlim(-0.5, data.shape[1] - 0.5)
+        self.ax.set_ylim(data.shape[0] - 0.5, -0.5)
+        self.canvas.draw_idle()
+
+    def setImage(self, data):
+        """替换同样大小的图像，只重绘本坐标轴区域(blit)，用于连续滚动切片"""
+        if self.image is None or self.background is None or self.data is None or data.shape != self.data.shape:
+            self.setData(data)
+            return
+        self.source = data
+        self.data = data
+        self.image.set_data(data[::self.step, ::self.step])
+        self.canvas.restore_region(self.background)
+        self.ax.draw_artist(self.image)
+        # 新图像成为叠加对象的背景
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        for artist in self.overlays:
+            self.ax.draw_artist(artist)
+        self.canvas.blit(self.ax.bbox)
+
+    def setCmap(self, cmap):
+        if self.image is not None:
+            self.image.set_cmap(cmap)
+            self.canvas.draw_idle()
+
+    def setClim(self, low, high):
+        if self.image is not None:
+            self.image.set_clim(low, high)
+            self.canvas.draw_idle()
+
+    def screenStep(self):
+        """降采样后仍不低于坐标轴像素数的最大步长"""
+        extent = self.ax.get_window_extent()
+        rows, cols = self.data.shape[:2]
+        return max(1, min(int(rows // max(extent.height, 1)), int(cols // max(extent.width, 1))))
+
+    def resample(self, draw=True):
+        if self.data is None:
+            return
+        step = self.screenStep()
+        if self.image is not None and step == self.step and draw:
+            return
+        self.step = step
+        rows, cols = self.data.shape[:2]
+        shown = self.data[::step, ::step]
+        # 每个降采样像素覆盖原图step x step的区域，坐标与原图一致
+        extent = (-0.5, cols - 0.5 + (-cols) % step, rows - 0.5 + (-rows) % step, -0.5)
+        if self.image is None:
+            self.image = self.ax.imshow(shown, extent=extent)
+        else:
+            self.image.set_data(shown)
+            self.image.set_extent(extent)
+        if draw:
+            self.canvas.draw_idle()
+
+    def addOverlay(self, artist):
+        """叠加显示的对象，修改后调用updateOverlays只重绘叠加部分"""
+        artist.set_animated(True)
+        self.overlays.append(artist)
+        return artist
+
+    def removeOverlay(self, artist):
+        if artist in self.overlays:
+            self.overlays.remove(artist)
+            artist.remove()
+            self.canvas.draw_idle()
+
+    def onDraw(self, event):
+        # 完整重绘后保存不含叠加对象的背景，再画上叠加对象
+        self.background = self.canvas.copy_from_bbox(self.ax.bbox)
+        for artist in self.overlays:
+            self.ax.draw_artist(artist)
+
+    def updateOverlays(self):
+        if self.background is None:
+            self.canvas.draw_idle()
+            return
+        self.canvas.restore_region(self.background)
+        for artist in self.overlays:
+            self.ax.draw_artist(artist)
+        self.canvas.blit(self.ax.bbox)
+
+
+class MPRWidget(QtWidgets.QWidget):
+    """体数据的三平面显示(轴位、冠状位、矢状位)，滑块或鼠标滚轮切换层
+
+    每个方向的切片由SliceCache完成窗宽窗位和颜色映射并预取相邻层，滚动时只替换图像
+    并重绘对应的坐标轴，十字线表示另外两个方向当前所在的层。
+    """
+
+    views = [('Axial', 2), ('Coronal', 1), ('Sagittal', 0)]
+
+    def __init__(self, window, dataManager) -> None:
+        super().__init__(window)
+        self.window = window
+        self.dataManager = dataManager
+        self.numpy_data = numpy_data = dataManager.numpy_data
+        self.shape = numpy_data.shape
+        spacing = dataManager.ugrid_data.spacing
+        self.indices = [n // 2 for n in self.shape]  # 按体数据的轴(x, y, z)
+        # 先用降采样数据的取值范围显示，直方图在后台计算完成后改为分位数窗口(用户已修改窗口时不再改变)
+        low, high = self.initialWindow()
+        self.windowEdited = False
+        self.caches = [SliceCache(numpy_data, axis, (low, high)) for _, axis in self.views]
+
+        self.canvas = createCanvas()
+        axes = self.canvas.figure.subplots(1, 3)
+        self.imageViews = []
+        self.crosshairs = []
+        # 各方向图像的(行, 列)间距，用于保持真实比例
+        aspects = [spacing[1] / spacing[0], spacing[2] / spacing[0], spacing[2] / spacing[1]]
+        for (title, axis), ax, aspect in zip(self.views, axes, aspects):
+            ax.set_title(title)
+            ax.set_xticks([])
+            ax.set_yticks([])
+            imageView = ImageView(ax, self.canvas)
+            imageView.setData(self.caches[len(self.imageViews)].get(self.indices[axis]))
+            ax.set_aspect(aspect)
+            vertical = imageView.addOverlay(ax.axvline(0, color='yellow', linewidth=0.8))
+            horizontal = imageView.addOverlay(ax.axhline(0, color='yellow', linewidth=0.8))
+            self.imageViews.append(imageView)
+            self.crosshairs.append((vertical, horizontal))
+        self.canvas.mpl_connect('scroll_event', self.onScroll)
+
+        self.sliders = []
+        sliderLayout = QHBoxLayout()
+        for view, (title, axis) in enumerate(self.views):
+            slider = QtWidgets.QSlider(Qt.Horizontal, self)
+            slider.setRange(0, self.shape[axis] - 1)
+            slider.setValue(self.indices[axis])
+            slider.valueChanged.connect(lambda value, view=view: self.setIndex(view, value))
+            self.sliders.append(slider)
+            sliderLayout.addWidget(QLabel(title, self))
+            sliderLayout.addWidget(slider)
+
+        windowLabel = QLabel(self)
+        windowLabel.setText('window')
+        self.lowLineEdit = QLineEdit('%g' % low)
+        self.highLineEdit = QLineEdit('%g' % high)
+        self.lowLineEdit.editingFinished.connect(self.updateWindow)
+        self.highLineEdit.editingFinished.connect(self.updateWindow)
+        sliderLayout.addWidget(windowLabel)
+        sliderLayout.addWidget(self.lowLineEdit)
+        sliderLayout.addWidget(self.highLineEdit)
+
+        layout = QtWidgets.QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.canvas)
+        layout.addLayout(sliderLayout)
+        self.setLayout(layout)
+        self.updateCrosshairs()
+
+        self.histogramJob = getScheduler().submit('Histogram', self.dataManager.histogram, 1024)
+        self.histogramJob.signals.finished.connect(self.onHistogram)
+        self.histogramJob.signals.failed.connect(lambda message: showJobError(self, 'Histogram', message))
+
+    def initialWindow(self):
+        """每个轴取1/4的降采样数据的取值范围，不在GUI线程中遍历整个体数据"""
+        sample = self.numpy_data[::4, ::4, ::4]
+        low, high = float(np.min(sample)), float(np.max(sample))
+        return (low, high) if high > low else (low, low + 1.0)
+
+    def onHistogram(self, histogram):
+        """直方图1%~99%分位数作为默认窗宽窗位"""
+        self.histogramJob = None
+        if self.windowEdited:
+            return
+        counts, edges = histogram
+        cumulative = np.cumsum(counts) / max(counts.sum(), 1)
+        low = edges[int(np.searchsorted(cumulative, 0.01))]
+        high = edges[int(np.searchsorted(cumulative, 0.99)) + 1]
+        self.lowLineEdit.setText('%g' % low)
+        self.highLineEdit.setText('%g' % high)
+        self.setWindow(float(low), float(high))
+
+    def setIndex(self, view, value):
+        axis = self.views[view][1]
+        self.indices[axis] = int(value)
+        self.imageViews[view].setImage(self.caches[view].get(value))
+        self.updateCrosshairs()
+
+    def onScroll(self, event):
+        for view, imageView in enumerate(self.imageViews):
+            if event.inaxes is imageView.ax:
+                slider = self.sliders[view]
+                slider.setValue(slider.value() + (1 if event.step > 0 else -1))
+
+    def updateCrosshairs(self):
+        x, y, z = self.indices
+        row = self.shape[2] - 1 - z  # 冠状位和矢状位的上方为z的最大值
+        positions = [(x, y), (x, row), (y, row)]
+        for (vertical, horizontal), (column, line), imageView in zip(self.crosshairs, positions, self.imageViews):
+            vertical.set_xdata([column, column])
+            horizontal.set_ydata([line, line])
+            imageView.updateOverlays()
+
+    def updateWindow(self):
+        try:
+            low, high = float(self.lowLineEdit.text()), float(self.highLineEdit.text())
+        except ValueError:
+            QMessageBox.critical(self, '错误', '窗宽窗位格式错误', QMessageBox.Yes | QMessageBox.No, QMessageBox.Yes)
+            return
+        self.windowEdited = True
+        self.setWindow(low, high)
+
+    def setWindow(self, low, high):
+        for view, (cache, imageView) in enumerate(zip(self.caches, self.imageViews)):
+            cache.set_window((low, high))
+            imageView.setData(cache.get(self.indices[self.views[view][1]]))
+
+    def closeEvent(self, a0: QtGui.QCloseEvent) -> None:
+        super().closeEvent(a0)
+        if self.histogramJob is not None:
+            self.histogramJob.cancel()
+        for cache in self.caches:
+            cache.close()
+
+
+class VolumeLOD(QtCore.QObject):
+    """体绘制的多分辨率显示：旋转、缩放时使用降采样的体数据，停止交互idleDelay毫秒后恢复全分辨率
+
+    各层级共用同一个vtkVolume及其属性(颜色、不透明度传递函数)，切换层级只替换mapper，
+    不重新创建actor。根据各层级实际的渲染耗时选择能达到交互帧率的最精细层级。
+    """
+
+    def __init__(self, window) -> None:
+        super().__init__(window)
+        self.window = window
+        self.enabled = True
+        self.interactiveFps = 15.0
+        self.idleDelay = 300
+        self.actor = None
+        self.mappers = []  # mappers[0]为全分辨率
+        self.renderTimes = {}  # 层级 -> 最近一次渲染耗时(秒)
+        self.level = 0
+        self.observedStyle = None
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.refine)
+        window.plotter.renderer.AddObserver('EndEvent', lambda *_: self.onRendered())
+
+    def setVolume(self, actor, dataManager):
+        """新的体数据actor，降采样层级在后台生成"""
+        self.timer.stop()
+        self.actor = actor
+        self.mappers = [actor.GetMapper()]
+        self.renderTimes = {}
+        self.level = 0
+        self.observe()
+        if dataManager.ugrid_data is None:
+            return
+        job = self.window.jobStatusWidget.submit('LOD', dataManager.pyramid)
+        job.signals.finished.connect(lambda pyramid, actor=actor: self.setLevels(actor, pyramid))
+
+    def setLevels(self, actor, pyramid):
+        if actor is not self.actor or not pyramid:
+            return
+        full = self.mappers[0]
+        for grid in pyramid:
+            mapper = full.NewInstance()
+            mapper.SetInputData(grid)
+            mapper.SetScalarModeToUsePointFieldData()
+            mapper.SelectScalarArray(grid.array_names[0])
+            mapper.SetBlendMode(full.GetBlendMode())
+            self.mappers.append(mapper)
+
+    def observe(self):
+        # 交互开始、结束事件由交互样式发出，样式被替换后需要重新注册
+        style = self.window.plotter.iren.interactor.GetInteractorStyle()
+        if style is self.observedStyle:
+            return
+        self.observedStyle = style
+        style.AddObserver('StartInteractionEvent', lambda *_: self.onStartInteraction())
+        style.AddObserver('EndInteractionEvent', lambda *_: self.onEndInteraction())
+
+    def chooseLevel(self):
+        """耗时不超过1/interactiveFps的最精细层级，未测量过的层级按每层耗时减半估计"""
+        budget = 1.0 / max(self.interactiveFps, 1e-3)
+        fullTime = self.renderTimes.get(0)
+        if fullTime is None:
+            return 0
+        for level in range(len(self.mappers)):
+            estimate = self.renderTimes.get(level, fullTime / 2 ** level)
+            if estimate <= budget:
+                return level
+        return len(self.mappers) - 1
+
+    def setLevel(self, level):
+        if self.actor is None or level == self.level:
+            return
+        self.level = level
+        self.actor.SetMapper(self.mappers[level])
+
+    def onStartInteraction(self):
+        self.timer.stop()
+        if self.enabled and len(self.mappers) > 1:
+            self.setLevel(self.chooseLevel())
+
+    def onEndInteraction(self):
+        if self.level != 0:
+            self.timer.start(self.idleDelay)
+
+    def onRendered(self):
+        if self.actor is not None:
+            self.renderTimes[self.level] = self.window.plotter.renderer.GetLastRenderTimeInSeconds()
+
+    def refine(self):
+        self.setLevel(0)
+        self.window.plotter.render()
+
+
+class HistogramWidget(QtWidgets.QWidget):
+    """嵌入窗口的直方图，数据改变时只更新同一个stairs对象，不重新创建坐标轴"""
+
+    def __init__(self, window) -> None:
+        super().__init__(window)
+        self.window = window
+        binsLabel = QLabel(self)
+        binsLabel.setText('bins')
+        self.binsComboBox = QComboBox(self)
+        for item in ['32', '64', '128', '256', '512', '1024']:
+            self.binsComboBox.addItem(item)
+        self.binsComboBox.setCurrentText('256')
+        self.binsComboBox.currentIndexChanged.connect(self.update)
+        self.logCheckBox = QtWidgets.QCheckBox('log', self)
+        self.logCheckBox.stateChanged.connect(self.updateScale)
+
+        self.canvas = createCanvas((5, 2))
+        self.ax = self.canvas.figure.add_subplot(111)
+        self.stairs = self.ax.stairs([0], [0, 1], fill=True)
+        self.canvas.setMinimumHeight(160)
+        self.job = None
+
+        configLayout = QHBoxLayout()
+        configLayout.addWidget(binsLabel)
+        configLayout.addWidget(self.binsComboBox)
+        configLayout.addWidget(self.logCheckBox)
+        configLayout.addStretch()
+        layout = QtWidgets.QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addLayout(configLayout)
+        layout.addWidget(self.canvas)
         self.setLayout(layout)
 
+    def bins(self):
+        return int(self.binsComboBox.currentText())
+
     def update(self):
-        opacity = self.opacityComboBox.currentText()
-        colorMap = self.colorMapComboBox.currentText()
+        # 完整统计结束前先显示抽样统计的近似直方图，统计结果已缓存时重新分箱只在计数数组上进行
+        dataManager = self.window.dataManager
         try:
-            self.window.updateVolumeRender(self.window.dataManager.ugrid_data, colorMap, opacity)
+            self.setHistogram(*dataManager.preview_histogram(self.bins()))
         except:
             traceback.print_exc()
+            return
+        if dataManager.has_histogram() or self.job is not None:
+            return
+        self.job = self.window.jobStatusWidget.submit('Histogram', dataManager.histogram, self.bins())
+        self.job.signals.finished.connect(self.onComputed)
+        self.job.signals.failed.connect(self.dropJob)
+        self.job.signals.cancelled.connect(self.dropJob)
+
+    def onComputed(self, result=None):
+        # 统计期间数据可能已改变，重新按当前数据显示，必要时再次提交
+        self.job = None
+        self.update()
+
+    def dropJob(self, *args):
+        self.job = None
+
+    def setHistogram(self, counts, edges):
+        self.stairs.set_data(counts, edges)
+        self.ax.set_xlim(edges[0], edges[-1])
+        self.updateScale()
+
+    def updateScale(self):
+        counts = self.stairs.get_data().values
+        self.ax.set_yscale('log' if self.logCheckBox.isChecked() else 'linear')
+        top = max(float(np.max(counts)), 1.0)
+        self.ax.set_ylim(0.5 if self.logCheckBox.isChecked() else 0, top * 1.05)
+        self.canvas.draw_idle()
+
+
+class JobStatusWidget(QtWidgets.QWidget):
+    """状态栏中的后台任务进度与取消按钮，只跟踪本窗口提交的任务"""
+
+    def __init__(self, window) -> None:
+        super().__init__(window)
+        self.window = window
+        self.jobs = []
+        self.label = QLabel(self)
+        self.progressBar = QProgressBar(self)
+        self.progressBar.setMaximumWidth(200)
+        self.cancelBtn = QPushButton('Cancel', self)
+        self.cancelBtn.clicked.connect(self.cancel)
+
+        layout = QHBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.label)
+        layout.addWidget(self.progressBar)
+        layout.addWidget(self.cancelBtn)
+        self.setLayout(layout)
+        self.setVisible(False)
+
+    def submit(self, name, func, *args, **kwargs):
+        job = getScheduler().submit(name, func, *args, **kwargs)
+        job.signals.progress.connect(lambda fraction, job=job: self.onProgress(job, fraction))
+        for signal in (job.signals.finished, job.signals.failed, job.signals.cancelled):
+            signal.connect(lambda *_, job=job: self.onEnded(job))
+        job.signals.failed.connect(lambda message, job=job: showJobError(self.window, job.name, message))
+        self.jobs.append(job)
+        self.refresh()
+        return job
+
+    def cancel(self):
+        for job in self.jobs:
+            job.cancel()
+        self.label.setText('Cancelling...')
+
+    def onProgress(self, job, fraction):
+        if self.jobs and job is self.jobs[-1]:
+            self.progressBar.setRange(0, 100)
+            self.progressBar.setValue(int(fraction * 100))
+
+    def onEnded(self, job):
+        if job in self.jobs:
+            self.jobs.remove(job)
+        self.refresh()
+
+    def refresh(self):
+        if len(self.jobs) == 0:
+            self.setVisible(False)
+            return
+        job = self.jobs[-1]
+        text = job.name
+        if len(self.jobs) > 1:
+            text += ' (+%d)' % (len(self.jobs) - 1)
+        self.label.setText(text)
+        # 没有报告进度的任务显示为忙碌状态
+        if job.context.progress > 0:
+            self.progressBar.setRange(0, 100)
+            self.progressBar.setValue(int(job.context.progress * 100))
+        else:
+            self.progressBar.setRange(0, 0)
+        self.setVisible(True)
 
 
-class MyWindow(MainWindow):
+class MyWindow(QtWidgets.QMainWindow):
+    # 与pyvistaqt.MainWindow相同的关闭信号，启动时不需要导入pyvistaqt
+    signal_close = QtCore.pyqtSignal()
+    # 所有窗口创建的VTK渲染窗口(OpenGL上下文)个数
+    glContexts = 0
+    # 参数调整组件与直方图在显示区域上方的顺序
+    toolClasses = [('config3D', Config3DWidget), ('config2D', Config2DWidget), ('histogram', HistogramWidget)]
 
     def __init__(self, parent=None, title='', isVolumeData=False, dataManager=None):
         QtWidgets.QMainWindow.__init__(self, parent)
@@ -558,10 +1530,9 @@ class MyWindow(MainWindow):
         self.vlayout = QtWidgets.QVBoxLayout()
 
         self.isVolumeData = isVolumeData
-        menubar = None
         # 添加菜单
-        menubar = MenuBar(self, self.dataManager)
-        self.vlayout.addWidget(menubar)
+        self.menubar = MenuBar(self, self.dataManager)
+        self.vlayout.addWidget(self.menubar)
 
         # 设置Iso-surface组件为空
         self.isoSurfaceWidget = None
@@ -569,37 +1540,52 @@ class MyWindow(MainWindow):
         self.sliceWidget = None
         # 设置DCM信息组件为kong
         self.dcmInfoWidget = None
+        # 三平面显示组件
+        self.mprWidget = None
 
-        # 添加Config组件
-        self.config3DWidget = Config3DWidget(self)
-        self.vlayout.addWidget(self.config3DWidget)
+        # Config组件与直方图在第一次显示时创建
+        self.toolLayout = QtWidgets.QVBoxLayout()
+        self.vlayout.addLayout(self.toolLayout)
+        self.tools = {}
         self.conin3d = False
-        self.config3DWidget.setVisible(self.conin3d)
-        self.config2DWidget = Config2DWidget(self)
-        self.vlayout.addWidget(self.config2DWidget)
         self.conin2d = False
-        self.config2DWidget.setVisible(self.conin2d)
         self.frame.setLayout(self.vlayout)
         self.setCentralWidget(self.frame)
 
-        # 添加显示组件
+        # 后台任务状态
+        self.jobStatusWidget = JobStatusWidget(self)
+        self.statusBar().addPermanentWidget(self.jobStatusWidget)
+        # 本窗口的内存与OpenGL上下文占用
+        self.resourceLabel = QLabel(self)
+        self.statusBar().addPermanentWidget(self.resourceLabel)
+        # 开始记录后显示最近的耗时记录
+        self.traceLabel = QLabel(self)
+        self.traceLabel.setVisible(False)
+        self.statusBar().addWidget(self.traceLabel)
+        self.resourceTimer = QtCore.QTimer(self)
+        self.resourceTimer.timeout.connect(self.updateResourceUsage)
+        self.resourceTimer.start(1000)
+
+        # 添加显示组件：VTK渲染窗口与matplotlib画布在第一次使用时创建
         self.displayWidget = None
-        # plotter 显示3D数据
-        self.plotter = QtInteractor(self.frame)
-        self.display3DWidget = self.plotter.interactor
-        # matplotlib 显示2D数据
-        figure = Figure()
-        self.ax = figure.add_subplot(111)
-        self.display2DWidget = FigureCanvas(figure)
+        self._plotter = None  # plotter 显示3D数据
+        self._volumeLOD = None
+        self.volumeActor = None
+        self.transferFunction = None
+        self._display2DWidget = None  # matplotlib 显示2D数据
+        self.ax = None
+        self._imageView = None
 
         if (self.isVolumeData):
             self.displayWidget = self.display3DWidget
-            self.display2DWidget.setVisible(False)
-        else:
+        elif self.dataManager.numpy_data is not None:
             self.displayWidget = self.display2DWidget
-            self.display3DWidget.setVisible(False)
+        else:
+            # 还没有导入数据时不创建画布
+            self.displayWidget = QWidget(self.frame)
 
         self.vlayout.addWidget(self.displayWidget)  # 默认展示界面为matplotlib
+        self.displayWidget.setVisible(True)
 
         # 设置背景颜色
         palette = QPalette()
@@ -607,67 +1593,176 @@ class MyWindow(MainWindow):
 
         self.setPalette(palette)
         self.setWindowTitle('MedicalVis')
+    @property
+    def plotter(self):
+        """VTK渲染窗口，只显示二维图像的窗口不创建"""
+        if self._plotter is None:
+            self._plotter = pyvistaqt.QtInteractor(self.frame)
+            self._plotter.interactor.setVisible(False)
+            trace_render_window(self._plotter.ren_win, 'MyWindow.render')
+            MyWindow.glContexts += 1
+            self._volumeLOD = VolumeLOD(self)
+        return self._plotter
+
+    @property
+    def display3DWidget(self):
+        return self.plotter.interactor
+
+    @property
+    def volumeLOD(self):
+        self.plotter  # 与渲染窗口一起创建
+        return self._volumeLOD
+
+    @property
+    def display2DWidget(self):
+        """matplotlib画布，只显示体数据的窗口不创建"""
+        if self._display2DWidget is None:
+            self._display2DWidget = createCanvas()
+            self.ax = self._display2DWidget.figure.add_subplot(111)
+            self._display2DWidget.setVisible(False)
+            self._imageView = ImageView(self.ax, self._display2DWidget)
+        return self._display2DWidget
+
+    @property
+    def imageView(self):
+        self.display2DWidget  # 与画布一起创建
+        return self._imageView
+
+    def tool(self, name):
+        """参数调整组件或直方图，第一次使用时创建，按toolClasses的顺序插入"""
+        widget = self.tools.get(name)
+        if widget is None:
+            names = [toolName for toolName, _ in self.toolClasses]
+            widget = dict(self.toolClasses)[name](self)
+            widget.setVisible(False)
+            index = sum(1 for toolName in names[:names.index(name)] if toolName in self.tools)
+            self.toolLayout.insertWidget(index, widget)
+            self.tools[name] = widget
+        return widget
+
+    @property
+    def config3DWidget(self):
+        created = 'config3D' in self.tools
+        widget = self.tool('config3D')
+        if not created and self.transferFunction is not None:
+            widget.opacityEditor.setTransferFunction(self.transferFunction)
+        return widget
+
+    @property
+    def config2DWidget(self):
+        return self.tool('config2D')
+
+    @property
+    def histogramWidget(self):
+        return self.tool('histogram')
+
     def createSubWindow(self, title='', isVolumeData=False, dataManager=None):
         subWindow = MyWindow(title=title, isVolumeData=isVolumeData, dataManager=dataManager)
+        # 关闭时释放窗口及其数据
+        subWindow.setAttribute(Qt.WA_DeleteOnClose)
+        subWindow.signal_close.connect(lambda: self.releaseSubWindow(subWindow))
         self.subWindows.append(subWindow)
 
         return self.subWindows[-1]
 
+    def releaseSubWindow(self, subWindow):
+        if subWindow in self.subWindows:
+            self.subWindows.remove(subWindow)
+
+    def resourceUsage(self):
+        """本窗口的内存占用(字节，数据及其缓存与显存中的体数据纹理估计)与OpenGL上下文数"""
+        usage = self.dataManager.memory_usage()
+        if self.mprWidget is not None:
+            usage['mpr'] = sum(cache.slots.nbytes for cache in self.mprWidget.caches)
+        # GPU体绘制按原数据类型上传纹理，降采样层级各自一份
+        usage['gpu'] = 0
+        if self.volumeActor is not None:
+            usage['gpu'] = usage['data'] + (usage['pyramid'] if len(self._volumeLOD.mappers) > 1 else 0)
+        usage['glContexts'] = 0 if self._plotter is None else 1
+        return usage
+
+    def updateResourceUsage(self):
+        usage = self.resourceUsage()
+        memory = sum(value for key, value in usage.items() if key not in ('gpu', 'glContexts'))
+        self.resourceLabel.setText('精度 %s | 内存 %.1f MB | 显存 %.1f MB | GL %d/%d' % (
+            self.dataManager.precision, memory / 2 ** 20, usage['gpu'] / 2 ** 20, usage['glContexts'],
+            MyWindow.glContexts))
+        self.traceLabel.setVisible(tracer.enabled)
+        if tracer.enabled:
+            events = tracer.recent(4)
+            self.traceLabel.setText(' | '.join(format_event(event) for event in events) if events else '记录中')
+            if events:
+                self.traceLabel.setToolTip('\n'.join('%s %s' % (event['name'], event['args']) for event in events))
+
+    def setDataManager(self, dataManager):
+        """替换本窗口的数据(在GUI线程中调用)，已提交的任务仍使用原来的DataManager"""
+        self.dataManager = dataManager
+        self.menubar.dataManager = dataManager
+
     def display(self, cmap=None, opacity='linear'):
         data = self.dataManager.ugrid_data
         if (data == None):
             # 2维灰度图像或RGB图像
             if (cmap == None):
-                self.display2d(cmap=colormaps2d[0])
+                self.display2d(cmap=colormaps2d()[0])
         else:
             if (cmap == None):
-                self.display3d(cmap=colormaps3d[0], opacity=opacity)
+                self.display3d(cmap=colormaps3d()[0], opacity=opacity)
+
+    def setDisplayWidget(self, widget):
+        """替换显示区域的组件"""
+        if self.displayWidget is widget:
+            return
+        self.displayWidget.setVisible(False)
+        self.vlayout.removeWidget(self.displayWidget)
+        self.displayWidget = widget
+        self.vlayout.addWidget(self.displayWidget)
+        self.displayWidget.setVisible(True)
 
+    @traced
     def display3d(self, cmap=None, opacity=None):
         data = self.dataManager.ugrid_data
-        if (self.isVolumeData):
-            # 正在显示的是体数据，组件不改变
-            self.plotter.clear()
-            self.plotter.update()
-            self.plotter.add_volume(data, cmap=cmap, opacity=opacity)
-        else:
-            # 正在显示的是灰度图像数据或RGB图像数据，改变组件
-            self.displayWidget.setVisible(False)
-            self.vlayout.removeWidget(self.displayWidget)
-            self.displayWidget = self.display3DWidget
-            self.vlayout.addWidget(self.displayWidget)
-            self.displayWidget.setVisible(True)
-            self.plotter.clear()
-            self.plotter.update()
-            self.plotter.add_volume(data, cmap=cmap, opacity=opacity)
-            self.isVolumeData = True
+        # 正在显示的是灰度图像数据、RGB图像数据或三平面时改变组件
+        self.setDisplayWidget(self.display3DWidget)
+        self.addVolume(data, cmap=cmap, opacity=opacity)
+        self.isVolumeData = True
+        self.closeMPR()
 
+    @traced
     def display2d(self, cmap='gray'):
         data = self.dataManager.numpy_data
-        if (not self.isVolumeData):
-            # 正在显示的是灰度图像数据或RGB图像数据，组件不变
-            # self.ax.redraw_in_frame()
-            self.ax.imshow(data, cmap=cmap)
-            self.displayWidget.draw()
-        else:
-            # 正在显示的是体数据，组件改变
-            self.displayWidget.setVisible(False)
-            self.vlayout.removeWidget(self.displayWidget)
-            self.displayWidget = self.display2DWidget
-            self.vlayout.addWidget(self.displayWidget)
-            self.displayWidget.setVisible(True)
-
-            self.ax.imshow(data, cmap=cmap)
-            self.displayWidget.draw()
-            self.isVolumeData = False
+        # 正在显示的是体数据时改变组件
+        self.setDisplayWidget(self.display2DWidget)
+        self.imageView.setData(data, cmap=cmap)
+        self.isVolumeData = False
+        self.closeMPR()
+
+    def displayMPR(self):
+        """在体绘制与三平面显示之间切换"""
+        if self.displayWidget is self.mprWidget:
+            self.setDisplayWidget(self.display3DWidget)
+            return
+        if self.mprWidget is not None and self.mprWidget.numpy_data is not self.dataManager.numpy_data:
+            # 数据已改变
+            self.closeMPR()
+        if self.mprWidget is None:
+            self.mprWidget = MPRWidget(self.frame, self.dataManager)
+        self.setDisplayWidget(self.mprWidget)
+
+    def closeMPR(self):
+        if self.mprWidget is None or self.displayWidget is self.mprWidget:
+            return
+        self.mprWidget.close()
+        self.mprWidget.deleteLater()
+        self.mprWidget = None
 
     def display3DC(self):
-        if self.conin == False:
-            self.conin = True
+        if self.conin3d == False:
+            self.conin3d = True
             self.config3DWidget.setVisible(True)
 
-        elif self.conin == True:
-            self.conin = False
+        elif self.conin3d == True:
+            self.conin3d = False
             self.config3DWidget.hide()
 
     def display2DC(self):
@@ -677,16 +1772,55 @@ class MyWindow(MainWindow):
         except:
             traceback.print_exc()
 
-    def updateVolumeRender(self, data, cmap, opacity):
+    def updateVolumeRender(self, cmap=None, opacity=None):
+        """只修改传递函数，体数据、mapper与actor保持不变"""
+        if self.transferFunction is None:
+            return
+        if cmap is not None:
+            self.transferFunction.set_colormap(cmap)
+        if opacity is not None:
+            self.transferFunction.set_opacity(opacity)
+            if 'config3D' in self.tools:
+                self.config3DWidget.opacityEditor.refresh()
+        self.plotter.render()
+
+    def addVolume(self, data, cmap=None, opacity=None):
         self.plotter.clear()
-        self.plotter.add_volume(data, cmap=cmap, opacity=opacity)
+        self.plotter.update()
+        clim = data.get_data_range(data.array_names[0], preference='point')
+        self.transferFunction = TransferFunction(clim, cmap=cmap or colormaps3d()[0], opacity=opacity or 'linear')
+        self.volumeActor = create_volume(data, self.transferFunction)
+        self.plotter.add_actor(self.volumeActor, reset_camera=True)
+        # 颜色条直接使用颜色传递函数，修改颜色表时自动更新
+        scalarBar = vtk.vtkScalarBarActor()
+        scalarBar.SetLookupTable(self.transferFunction.color)
+        self.plotter.add_actor(scalarBar, reset_camera=False)
+        self.volumeLOD.setVolume(self.volumeActor, self.dataManager)
+        if 'config3D' in self.tools:
+            self.config3DWidget.opacityEditor.setTransferFunction(self.transferFunction)
 
     def updateImageRender(self, data, cmap):
-        self.ax.imshow(data, cmap=cmap)
-        self.displayWidget.draw()
+        if self.imageView.source is not data:
+            self.imageView.setData(data, cmap=cmap)
+        else:
+            self.imageView.setCmap(cmap)
 
     def closeEvent(self, event: QtCore.QEvent) -> None:
+        self.signal_close.emit()
         super().closeEvent(event)
-
-        self.display2DWidget.close()
-        self.display3DWidget.close()
+        self.jobStatusWidget.cancel()
+
+        self.resourceTimer.stop()
+        if self._display2DWidget is not None:
+            self._display2DWidget.close()
+        if self._plotter is not None:
+            self._volumeLOD.timer.stop()
+            self._plotter.close()
+            MyWindow.glContexts -= 1
+        for widget in self.tools.values():
+            widget.close()
+        if self.mprWidget is not None:
+            self.mprWidget.close()
+        for widget in (self.isoSurfaceWidget, self.sliceWidget, self.dcmInfoWidget):
+            if widget is not None:
+                widget.close()
@@ -0,0 +1,155 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# 每块的体素数。分块方式与CPU核数无关，同一个种子在任何机器上得到相同结果
+BLOCK_SIZE = 1 << 22
+# 泊松分布参数大于该值时使用正态近似，误差可以忽略且快得多
+POISSON_NORMAL_LAMBDA = 64.0
+# 分块生成噪声的线程数，numpy的随机数生成会释放GIL
+WORKERS = os.cpu_count() or 1
+
+
+def salt_pepper(data, amount=0.1, salt=None, pepper=None, seed=None, dtype=None, channel_axis=None):
+    """椒盐噪声：随机选取amount比例的像素(体素)，一半置为salt，一半置为pepper
+
+    :param amount: 噪声比例，等于1 - SNR
+    :param salt: 白点的值，默认uint8数据为255，其他为数据最大值
+    :param pepper: 黑点的值，默认uint8数据为0，其他为数据最小值
+    :param channel_axis: RGB图像的通道轴(最后一轴)，同一像素的所有通道一起置值
+    """
+    out = _output(data, dtype)
+    if salt is None:
+        salt = 255 if out.dtype == np.uint8 else np.max(data)
+    if pepper is None:
+        pepper = 0 if out.dtype == np.uint8 else np.min(data)
+    if channel_axis is not None:
+        pixels = out.reshape(-1, out.shape[-1])
+    else:
+        pixels = np.ravel(out, order='K')
+    rng = np.random.default_rng(seed)
+    count = int(amount * pixels.shape[0])
+    index = rng.integers(0, pixels.shape[0], count)
+    pixels[index[:count // 2]] = salt
+    pixels[index[count // 2:]] = pepper
+    return out
+
+
+def gaussian(data, sigma=None, snr=None, mean=0.0, seed=None, dtype=None):
+    """加性高斯噪声
+
+    :param sigma: 噪声标准差
+    :param snr: 信噪比(信号标准差/噪声标准差)，未给出sigma时由snr计算sigma
+    """
+    if sigma is None:
+        sigma = float(np.std(data)) / snr if snr else 1.0
+
+    def noise(rng, block):
+        n = standard_normal(rng, block.size, block.dtype)
+        n *= sigma
+        n += mean
+        n += block
+        return n
+
+    return _apply_blockwise(data, dtype, seed, noise)
+
+
+def poisson(data, scale=1.0, seed=None, dtype=None):
+    """泊松(散粒)噪声，scale越大相对噪声越小；负值数据(如CT值)先平移到非负"""
+    low = min(float(np.min(data)), 0.0)
+
+    def noise(rng, block):
+        lam = (block - low) * scale
+        small = lam < POISSON_NORMAL_LAMBDA
+        counts = lam + np.sqrt(lam) * standard_normal(rng, lam.size)
+        counts[small] = rng.poisson(lam[small])
+        return np.maximum(counts, 0, out=counts) / scale + low
+
+    return _apply_blockwise(data, dtype, seed, noise)
+
+
+def standard_normal(rng, size, dtype=np.float32):
+    """标准正态随机数，Box-Muller变换，比Generator.standard_normal快一倍
+
+    随机数本身按float32生成，dtype为float64时转换后返回，以便在float64上累加。
+    """
+    half = (size + 1) // 2
+    u = rng.random(2 * half, dtype=np.float32)
+    radius, theta = u[:half], u[half:]
+    np.negative(radius, out=radius)
+    np.log1p(radius, out=radius)
+    radius *= -2
+    np.sqrt(radius, out=radius)
+    theta *= np.float32(2 * np.pi)
+    out = np.empty(2 * half, dtype=np.float32)
+    np.cos(theta, out=out[:half])
+    np.sin(theta, out=out[half:])
+    out[:half] *= radius
+    out[half:] *= radius
+    return out[:size].astype(dtype, copy=False)
+
+
+def speckle(data, sigma=0.1, seed=None, dtype=None):
+    """乘性斑点噪声 data + data * n，n服从N(0, sigma)"""
+
+    def noise(rng, block):
+        n = standard_normal(rng, block.size, block.dtype)
+        n *= sigma
+        n += 1
+        n *= block
+        return n
+
+    return _apply_blockwise(data, dtype, seed, noise)
+
+
+def _output(data, dtype):
+    """与输入内存布局相同的新数组，噪声不会修改输入"""
+    return np.array(data, dtype=dtype or data.dtype, order='K', copy=True)
+
+
+def _apply_blockwise(data, dtype, seed, func):
+    """按固定大小分块并行生成噪声，每块使用由seed派生的独立随机数生成器
+
+    计算使用working_dtype，写回输出时按输出类型的取值范围截断。
+    """
+    out = np.empty_like(data, dtype=dtype or data.dtype, order='K')
+    # 'K'按内存顺序展开，输出与输入布局相同，target是out的视图
+    source = np.ravel(data, order='K')
+    target = np.ravel(out, order='K')
+    starts = range(0, source.size, BLOCK_SIZE)
+    generators = [np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(len(starts))]
+    work = working_dtype(data.dtype, out.dtype)
+    limits = clip_limits(out.dtype, work) if np.issubdtype(out.dtype, np.integer) else None
+
+    def run(i):
+        start = starts[i]
+        block = func(generators[i], source[start:start + BLOCK_SIZE].astype(work))
+        if limits is not None:
+            np.clip(block, limits[0], limits[1], out=block)
+            np.rint(block, out=block)
+        target[start:start + BLOCK_SIZE] = block
+
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        list(executor.map(run, range(len(starts))))
+    return out
+
+
+def working_dtype(*dtypes):
+    """噪声的计算类型：float64数据与16位以上的整数(float32只有24位尾数)使用float64，其他使用float32"""
+    for dtype in map(np.dtype, dtypes):
+        if dtype == np.float64 or (np.issubdtype(dtype, np.integer) and dtype.itemsize > 2):
+            return np.dtype(np.float64)
+    return np.dtype(np.float32)
+
+
+def clip_limits(dtype, work):
+    """整数类型dtype的取值范围中能用work精确表示的上下限，截断后转换为dtype不会溢出"""
+    info = np.iinfo(dtype)
+    low, high = work.type(info.min), work.type(info.max)
+    # 如int64的最大值在float64中舍入为2**63，已超出范围
+    if int(high) > info.max:
+        high = np.nextafter(high, work.type(0))
+    if int(low) < info.min:
+        low = np.nextafter(low, work.type(0))
+    return low, high
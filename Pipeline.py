@@ -0,0 +1,421 @@
+import functools
+import inspect
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import Volume
+from Cache import derive_fingerprint, result_cache
+from Lazy import lazy_import
+from Trace import span, traced
+
+ndimage = lazy_import('scipy.ndimage')
+
+# 可以加入流水线的DataManager处理函数，均返回新的DataManager
+OPERATIONS = ['maximum_filter', 'minimum_filter', 'uniform_filter', 'median_blur', 'gaussian_blur', 'frequency_filter',
+              'fft', 'shift_fft', 'fft_phase', 'inverse_fft', 'gray', 'Salt_noice', 'Gaussian_noice', 'Poisson_noice',
+              'Speckle_noice', 'counterDetail', 'embossFilter', 'sharpenSobel', 'sharpenPrewitt', 'sharpenLaplace',
+              'sharpen2D']
+# 随机噪声操作，没有给出seed时每次结果不同，不能缓存
+NOISE_OPERATIONS = ['Salt_noice', 'Gaussian_noice', 'Poisson_noice', 'Speckle_noice']
+# 结果是频谱显示(对应DataManager.source_spectrum)的操作，与逐个调用相同不缓存，否则命中时丢失频谱
+SPECTRUM_OPERATIONS = ['fft', 'shift_fft', 'fft_phase']
+# 融合计算与逐个调用的结果可能相差几个灰度级，缓存键加上这个标记，两者不会互相命中
+CACHE_TAG = 'lazy'
+# 逐元素运算每次处理的元素个数，融合的多个运算在这一块数据上依次进行，数据留在缓存中
+POINTWISE_CHUNK = 1 << 16
+
+
+class Stage:
+    """流水线中的一个操作
+
+    kind为'pointwise'(逐元素运算，make(dtype)返回原地处理一块数据的函数，不能处理该类型时返回None)、
+    'separable'(按轴的一维滤波，passes为[(func(input, output, axis), axis)]，可以原地计算)或
+    'general'(其他操作，apply(data, dtype, pool, spectrum)返回(结果, 结果对应的类型, 结果对应的频谱)，
+    spectrum为当前数据是频谱显示结果时对应的频谱(DataManager.source_spectrum)，否则为None)。
+    相邻的pointwise或separable操作融合为一次计算。
+    """
+
+    def __init__(self, kind, make=None, passes=None, apply=None, dtype=None, symmetric=False) -> None:
+        self.kind = kind
+        self.make = make
+        self.passes = passes
+        self.apply = apply
+        self.dtype = dtype  # pointwise与separable的输出类型，None表示与输入相同
+        self.symmetric = symmetric  # general操作对各轴相同，可以在转置后的数据上计算
+        self.name = None
+        self.args = ()
+        self.kwargs = {}
+
+
+def operation(func):
+    """Pipeline方法的装饰器：方法返回Stage，记录操作名和调用参数(用于缓存键与处理历史)"""
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        stage = func(self, *args, **kwargs)
+        stage.name, stage.args, stage.kwargs = func.__name__, args, kwargs
+        return Pipeline(self.source, self, stage)
+
+    return wrapper
+
+
+class Pipeline:
+    """DataManager处理函数的惰性流水线
+
+    调用与DataManager同名的处理函数只记录操作并返回新的节点，compute()(显示或保存前)时才计算。
+    同一节点可以引出多个分支，已计算的节点保存结果，分支从最近的已计算节点继续。
+
+    计算时相邻的逐元素运算、按轴分解的滤波(均值、高斯、最大/最小值)融合为一次计算，在一个
+    float32(原数据为float64或精度策略为float64时为float64)工作缓冲区上原地进行，中间结果不转换回原类型，也不创建
+    DataManager和网格。其他操作需要新的缓冲区，不再使用的缓冲区被复用。整数数据在中间步骤保持
+    浮点精度，只在结尾或需要整数取值的操作前四舍五入并截断到取值范围；逐个调用DataManager时每一步
+    (ndimage的每个轴)都截断取整，因此两者结果可能相差几个灰度级。
+
+        result = dataManager.lazy().median_blur().gaussian_blur(3).maximum_filter(5).compute()
+
+    目前由batch.py(--ops的处理链)和脚本使用；GUI菜单中的处理仍是每一步在后台立即计算并显示在新窗口。
+    """
+
+    def __init__(self, dataManager, parent=None, stage=None) -> None:
+        self.source = dataManager
+        self.parent = parent
+        self.stage = stage
+        self.result = dataManager if parent is None else None
+        self.timings = []  # 最近一次计算中各融合分组的(名称, 秒)
+        self.allocated = 0  # 最近一次计算新分配的字节数
+
+    def stages(self):
+        """从最近的已计算节点到本节点的操作，及该已计算节点"""
+        stages = []
+        node = self
+        while node.result is None:
+            stages.append(node.stage)
+            node = node.parent
+        return stages[::-1], node
+
+    @traced
+    def compute(self):
+        """计算并返回结果DataManager"""
+        from Manager import history_entry
+        if self.result is not None:
+            return self.result
+        stages, base = self.stages()
+        history = base.result.history + [history_entry(stage.name, stage.args, stage.kwargs, self.source.precision)
+                                         for stage in stages]
+        key = None
+        if result_cache.enabled and base.result.numpy_data is not None and cacheable(stages):
+            key = derive_fingerprint(base.result.fingerprint(), CACHE_TAG, (), {})
+            for stage in stages:
+                key = derive_fingerprint(key, stage.name, stage.args, stage.kwargs, self.source.precision)
+            numpy_data = result_cache.get(key)
+            if numpy_data is not None:
+                self.result = self.source.derived(numpy_data)
+                self.result._fingerprint = key
+                self.result.history = history
+                return self.result
+        numpy_data, spectrum, self.timings, self.allocated = execute(base.result.numpy_data, stages,
+                                                                     precision=self.source.precision,
+                                                                     spectrum=base.result.source_spectrum)
+        self.result = self.source.derived(numpy_data)
+        self.result.source_spectrum = spectrum
+        self.result.history = history
+        if key is not None:
+            result_cache.put(key, numpy_data)
+            self.result._fingerprint = key
+        return self.result
+
+    def save(self, file_path):
+        self.compute().save_data(file_path)
+
+    def __repr__(self):
+        stages, _ = self.stages()
+        return 'Pipeline(%s)' % ' -> '.join(stage.name for stage in stages)
+
+    def separable(self, sizes, func1d):
+        passes = [(lambda data, out, axis, k=k: func1d(data, k, axis=axis, output=out), axis)
+                  for axis, k in enumerate(sizes) if k > 1]
+        return Stage('separable', passes=passes)
+
+    @operation
+    def maximum_filter(self, size=20):
+        return self.separable(self.source.filter_sizes(size), ndimage.maximum_filter1d)
+
+    @operation
+    def minimum_filter(self, size=20):
+        return self.separable(self.source.filter_sizes(size), ndimage.minimum_filter1d)
+
+    @operation
+    def uniform_filter(self, size=20):
+        return self.separable(self.source.filter_sizes(size), ndimage.uniform_filter1d)
+
+    @operation
+    def gaussian_blur(self, sigma=5):
+        sigmas = self.source.filter_sizes(sigma, fill=0, cast=float)
+        passes = [(lambda data, out, axis, s=s: ndimage.gaussian_filter1d(data, s, axis=axis, output=out), axis)
+                  for axis, s in enumerate(sigmas) if s > 0]
+        return Stage('separable', passes=passes)
+
+    @operation
+    def gray(self, n):
+        gamma = 1.5 if n else 0.8
+        precision = self.source.precision
+
+        def make(dtype):
+            # 有符号整数与浮点数据的伽马调整与取值范围有关，按一般操作计算
+            if not np.issubdtype(dtype, np.unsignedinteger):
+                return None
+            # 与img_as_float后adjust_gamma相同：(x / 类型最大值) ** gamma
+            scale = 1.0 / np.iinfo(dtype).max
+
+            def func(chunk):
+                chunk *= scale
+                np.power(chunk, gamma, out=chunk)
+                if precision == 'native':
+                    # 与DataManager.to_native相同，还原到原类型的取值范围，结尾取整
+                    chunk *= np.iinfo(dtype).max
+
+            return func
+
+        # native时结果为原类型(None)
+        dtype = None if precision == 'native' else (np.float64 if precision == 'float64' else np.float32)
+        return Stage('pointwise', make=make, apply=fallback('gray', (n,), {}, precision), dtype=dtype)
+
+    @operation
+    def median_blur(self):
+        def apply(data, dtype, pool, spectrum):
+            # 中值滤波只选取已有的值，整数数据取整后在原类型上计算，与逐个调用的结果一致，也比在浮点数据上快
+            if data.dtype != dtype:
+                data = restore(data, dtype)
+            out = pool.take(data, data.dtype)
+            ndimage.median_filter(data, size=3, output=out)
+            return out, dtype, None
+
+        return Stage('general', apply=apply, symmetric=True)
+
+    def __getattr__(self, name):
+        # 其他处理函数作为一般操作，在当前数据上调用DataManager的实现
+        if name not in OPERATIONS:
+            raise AttributeError(name)
+
+        def method(*args, **kwargs):
+            stage = Stage('general', apply=fallback(name, args, kwargs, self.source.precision))
+            stage.name, stage.args, stage.kwargs = name, args, kwargs
+            return Pipeline(self.source, self, stage)
+
+        return method
+
+
+def cacheable(stages):
+    """结果是否可以缓存：每个操作的结果都是确定的，且最后的结果不是频谱显示"""
+    return all(map(deterministic, stages)) and stages[-1].name not in SPECTRUM_OPERATIONS
+
+
+def deterministic(stage):
+    """相同输入与参数时结果是否相同(没有给出seed的噪声操作不是)"""
+    if stage.name not in NOISE_OPERATIONS:
+        return True
+    from Manager import DataManager
+    signature = inspect.signature(inspect.unwrap(getattr(DataManager, stage.name)))
+    return signature.bind(None, *stage.args, **stage.kwargs).arguments.get('seed') is not None
+
+
+def fallback(name, args, kwargs, precision=None):
+    """在当前数据(转换回对应类型)上按precision策略调用DataManager的处理函数，不经过结果缓存
+
+    当前数据对应的频谱作为source_spectrum传入，inverse_fft等与逐个调用的结果相同。
+    """
+
+    def apply(data, dtype, pool, spectrum):
+        from Manager import DataManager
+        # 去掉缓存与追踪的装饰器
+        func = inspect.unwrap(getattr(DataManager, name))
+        dataManager = DataManager(restore(data, dtype), precision=precision)
+        dataManager.source_spectrum = spectrum
+        result = func(dataManager, *args, **kwargs)
+        return result.numpy_data, result.numpy_data.dtype, result.source_spectrum
+
+    return apply
+
+
+class BufferPool:
+    """计算过程中的工作缓冲区，不再使用的缓冲区按(形状, 类型, 内存顺序)复用"""
+
+    def __init__(self) -> None:
+        self.free = []
+        self.allocated = 0  # 新分配的字节数
+
+    def take(self, like, dtype):
+        order = 'F' if like.flags.f_contiguous and not like.flags.c_contiguous else 'C'
+        for i, buffer in enumerate(self.free):
+            if buffer.shape == like.shape and buffer.dtype == dtype and buffer.flags[order + '_CONTIGUOUS']:
+                return self.free.pop(i)
+        buffer = np.empty(like.shape, dtype=dtype, order=order)
+        self.allocated += buffer.nbytes
+        return buffer
+
+    def give(self, buffer):
+        self.free.append(buffer)
+
+
+def restore(data, dtype, inplace=False):
+    """浮点工作数据转换为dtype，整数类型四舍五入并截断到取值范围；inplace时只在data上取整"""
+    if data.dtype == dtype:
+        return data
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        if inplace:
+            np.rint(data, out=data)
+            np.clip(data, info.min, info.max, out=data)
+            return data
+        data = np.clip(np.rint(data), info.min, info.max)
+    return data if inplace else data.astype(dtype, order='K')
+
+
+def fuse(stages):
+    """相邻的pointwise或separable操作合并为一组，返回[(kind, [stage, ...])]"""
+    groups = []
+    for stage in stages:
+        if groups and stage.kind != 'general' and groups[-1][0] == stage.kind:
+            groups[-1][1].append(stage)
+        else:
+            groups.append((stage.kind, [stage]))
+    return groups
+
+
+class Execution:
+    """一次计算的状态：当前数据、其对应的类型(逐个调用时的类型)与缓冲区
+
+    与DataManager.apply_filter相同，Fortran顺序的体数据在C顺序的转置视图上计算，结果转置回来。
+    工作缓冲区的类型由精度策略与数据类型决定：float64策略或float64数据为float64，其他为float32。
+    """
+
+    def __init__(self, numpy_data, workers, precision=None, spectrum=None) -> None:
+        self.transposed = numpy_data.ndim > 1 and numpy_data.flags.f_contiguous and not numpy_data.flags.c_contiguous
+        self.data = numpy_data.T if self.transposed else numpy_data
+        self.dtype = numpy_data.dtype
+        self.owned = False  # data是否为可以原地修改的工作缓冲区
+        self.pool = BufferPool()
+        self.work_dtype = np.float64 if numpy_data.dtype == np.float64 or precision == 'float64' else np.float32
+        self.spectrum = spectrum  # 当前数据是频谱显示结果时对应的频谱
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def target(self):
+        """融合计算的输出：当前数据已是浮点工作缓冲区时原地计算"""
+        if self.owned and self.data.dtype.kind == 'f':
+            return self.data
+        return self.pool.take(self.data, self.work_dtype)
+
+    def replace(self, data):
+        if self.owned and data is not self.data:
+            self.pool.give(self.data)
+        self.data = data
+        self.owned = True
+
+    def pointwise(self, group):
+        funcs = []
+        dtype = self.dtype
+        for stage in group:
+            funcs.append(stage.make(dtype))
+            dtype = np.dtype(stage.dtype) if stage.dtype is not None else dtype
+        if any(func is None for func in funcs):
+            # 有不能逐元素计算的操作时逐个按一般操作计算
+            for stage in group:
+                self.general(stage)
+            return
+        out = self.target()
+        source = np.ravel(self.data, order='K')
+        target = np.ravel(out, order='K')
+
+        def run(bounds):
+            # 按内存顺序分块复制到输出，在每一块上依次执行所有逐元素运算
+            for begin in range(bounds[0], bounds[1], POINTWISE_CHUNK):
+                end = min(begin + POINTWISE_CHUNK, bounds[1])
+                chunk = target[begin:end]
+                if source is not target:
+                    chunk[...] = source[begin:end]
+                for func in funcs:
+                    func(chunk)
+
+        list(self.executor.map(run, chunks(source.size, self.workers)))
+        self.replace(out)
+        self.dtype = dtype
+        self.spectrum = None
+
+    def separable(self, group):
+        passes = [item for stage in group for item in stage.passes]
+        out = self.target()
+        if not passes:
+            np.copyto(out, self.data, casting='unsafe')
+        for i, (func, axis) in enumerate(passes):
+            if self.transposed:
+                axis = out.ndim - 1 - axis
+            # 第一次从当前数据读入输出缓冲区，之后原地计算
+            self.run_pass(func, self.data if i == 0 else out, out, axis)
+        self.replace(out)
+        self.spectrum = None
+
+    def general(self, stage):
+        if stage.symmetric or not self.transposed:
+            result, self.dtype, self.spectrum = stage.apply(self.data, self.dtype, self.pool, self.spectrum)
+        else:
+            result, self.dtype, self.spectrum = stage.apply(self.data.T, self.dtype, self.pool, self.spectrum)
+            result = result.T
+        self.replace(result)
+
+    def run_pass(self, func, data, out, axis):
+        """沿axis的一维滤波，数组沿另一个轴分块由多个线程计算，各块互不重叠，可以原地计算"""
+        others = [i for i in range(data.ndim) if i != axis]
+        if not others:
+            func(data, out, axis)
+            return
+        split = max(others, key=lambda i: data.shape[i])
+
+        def run(bounds):
+            index = [slice(None)] * data.ndim
+            index[split] = slice(*bounds)
+            func(data[tuple(index)], out[tuple(index)], axis)
+
+        list(self.executor.map(run, chunks(data.shape[split], self.workers)))
+
+    def result(self):
+        """转换为逐个调用时的类型"""
+        data = self.data
+        if data.dtype != self.dtype:
+            if self.owned:
+                restore(data, self.dtype, inplace=True)
+            data = data.astype(self.dtype, order='K')
+            self.pool.allocated += data.nbytes
+        return data.T if self.transposed else data
+
+
+def chunks(total, count):
+    bounds = np.linspace(0, total, max(min(count, total), 1) + 1).astype(int)
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+
+
+def execute(numpy_data, stages, workers=None, precision=None, spectrum=None):
+    """依次计算融合后的各组操作，返回(结果数组, 结果对应的频谱, [(分组名, 秒)], 新分配的字节数)
+
+    :param spectrum: numpy_data是频谱显示结果时对应的频谱(DataManager.source_spectrum)
+    """
+    execution = Execution(numpy_data, workers or Volume.WORKERS, precision, spectrum)
+    timings = []
+    try:
+        for kind, group in fuse(stages):
+            name = '+'.join(stage.name for stage in group)
+            start = time.perf_counter()
+            with span(name, 'pipeline', kind=kind):
+                if kind == 'pointwise':
+                    execution.pointwise(group)
+                elif kind == 'separable':
+                    execution.separable(group)
+                else:
+                    execution.general(group[0])
+            timings.append((name, time.perf_counter() - start))
+        result = execution.result()
+    finally:
+        execution.executor.shutdown()
+    return result, execution.spectrum, timings, execution.pool.allocated
@@ -0,0 +1,98 @@
+import traceback
+
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+from Jobs import JobCancelled, JobContext, run_in_context
+
+
+class JobSignals(QObject):
+    """工作线程通过信号把结果交回GUI线程（跨线程自动排队）"""
+    progress = pyqtSignal(float)
+    finished = pyqtSignal(object)
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+
+class Job(QRunnable):
+    def __init__(self, name, func, *args, **kwargs):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = JobSignals()
+        self.context = JobContext(progress_callback=self.signals.progress.emit)
+        self.done = False
+
+    def cancel(self):
+        self.context.cancel()
+
+    def isCancelled(self):
+        return self.context.is_cancelled()
+
+    def run(self):
+        if self.isCancelled():
+            self.signals.cancelled.emit()
+            return
+        try:
+            result = run_in_context(self.context, self.func, *self.args, **self.kwargs)
+        except JobCancelled:
+            self.signals.cancelled.emit()
+        except Exception:
+            # 完整的traceback输出到终端，failed信号的接收者(如JobStatusWidget)显示错误信息
+            traceback.print_exc()
+            self.signals.failed.emit(traceback.format_exc())
+        else:
+            if self.isCancelled():
+                # 计算已完成但用户已取消，丢弃结果
+                self.signals.cancelled.emit()
+            else:
+                self.signals.finished.emit(result)
+
+
+class JobScheduler(QObject):
+    """把DataManager的计算提交到线程池，多个窗口的任务可同时运行
+
+    numpy/scipy的计算会释放GIL，因此使用线程池即可利用多核，
+    同时避免在进程间复制体数据和VTK对象。
+    """
+    jobStarted = pyqtSignal(object)
+    jobEnded = pyqtSignal(object)
+
+    def __init__(self, maxThreadCount=None) -> None:
+        super().__init__()
+        self.pool = QThreadPool()
+        if maxThreadCount is not None:
+            self.pool.setMaxThreadCount(maxThreadCount)
+        self.jobs = []
+
+    def submit(self, name, func, *args, **kwargs):
+        job = Job(name, func, *args, **kwargs)
+        for signal in (job.signals.finished, job.signals.failed, job.signals.cancelled):
+            signal.connect(lambda *_, job=job: self.__onJobEnded(job))
+        self.jobs.append(job)
+        self.jobStarted.emit(job)
+        self.pool.start(job)
+        return job
+
+    def cancelAll(self):
+        for job in self.jobs:
+            job.cancel()
+
+    def __onJobEnded(self, job):
+        job.done = True
+        if job in self.jobs:
+            self.jobs.remove(job)
+        self.jobEnded.emit(job)
+
+
+_scheduler = None
+
+
+def getScheduler():
+    """全局共享的任务调度器"""
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = JobScheduler()
+    return _scheduler
@@ -0,0 +1,211 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from Lazy import lazy_import
+from Volume import grid_to_numpy
+
+matplotlib = lazy_import('matplotlib')
+pyvista = lazy_import('pyvista')
+vtk = lazy_import('vtk')
+
+# 法向量与坐标轴的夹角余弦超过该值时视为与坐标轴垂直的切片
+AXIS_TOLERANCE = 1 - 1e-6
+
+
+def aligned_axis(normal):
+    """与坐标轴平行的法向量返回该轴(0, 1, 2)，否则返回None"""
+    normal = np.asarray(normal, dtype=float)
+    length = np.linalg.norm(normal)
+    if length == 0:
+        return None
+    axis = int(np.argmax(np.abs(normal)))
+    return axis if abs(normal[axis]) / length >= AXIS_TOLERANCE else None
+
+
+class AxisSlicer:
+    """与坐标轴垂直的切片：直接用numpy下标从体数据中取出一层(视图)，不经过VTK的切片过滤器
+
+    每个轴的切片网格只创建一次，拖动时只替换其点数据，z方向的切片与体数据共享内存。
+    """
+
+    def __init__(self, grid_data) -> None:
+        self.grid_data = grid_data
+        # 转为普通ndarray视图：pyvista_ndarray的切片仍引用整个VTK数组，赋给切片网格时会被当作整个体数据
+        self.numpy_data = np.asarray(grid_to_numpy(grid_data))
+        self.name = grid_data.array_names[0]
+        self.planes = {}  # 轴 -> 切片网格
+
+    def index(self, axis, position):
+        """离position最近的一层的下标"""
+        k = int(round((position - self.grid_data.origin[axis]) / self.grid_data.spacing[axis]))
+        return min(max(k, 0), self.numpy_data.shape[axis] - 1)
+
+    def slice(self, axis, position):
+        k = self.index(axis, position)
+        plane = self.planes.get(axis)
+        if plane is None:
+            plane = pyvista.UniformGrid()
+            dimensions = list(self.numpy_data.shape)
+            dimensions[axis] = 1
+            plane.dimensions = dimensions
+            plane.spacing = self.grid_data.spacing
+            self.planes[axis] = plane
+        origin = list(self.grid_data.origin)
+        origin[axis] += k * self.grid_data.spacing[axis]
+        plane.origin = origin
+        index = [slice(None)] * 3
+        index[axis] = slice(k, k + 1)
+        # Fortran顺序的视图按F顺序展开；z方向的切片是连续的，不产生拷贝
+        plane.point_data[self.name] = np.ravel(self.numpy_data[tuple(index)], order='F')
+        return plane
+
+
+def oblique_slice(grid_data, normal, origin):
+    """任意方向的切片，vtkFlyingEdgesPlaneCutter是专门针对规则网格的多线程实现"""
+    plane = vtk.vtkPlane()
+    plane.SetNormal(*normal)
+    plane.SetOrigin(*origin)
+    cutter = vtk.vtkFlyingEdgesPlaneCutter()
+    cutter.SetInputData(grid_data)
+    cutter.SetPlane(plane)
+    cutter.ComputeNormalsOff()
+    cutter.InterpolateAttributesOn()
+    cutter.Update()
+    return pyvista.wrap(cutter.GetOutput())
+
+
+# 每个方向缓存的已着色切片数与向前预取的层数
+RING_SIZE = 32
+PREFETCH = 8
+# 整数数据取值范围不超过该值时用查找表一次完成窗宽窗位与颜色映射
+MAX_LUT_SIZE = 1 << 20
+
+
+def plane_view(numpy_data, axis, k):
+    """(x, y, z)体数据第k层切片的显示方向视图：轴位(z)行为y、列为x；冠状位(y)与矢状位(x)行为z，上方朝上"""
+    if axis == 2:
+        return numpy_data[:, :, k].T
+    if axis == 1:
+        return numpy_data[:, k, :].T[::-1]
+    return numpy_data[k, :, :].T[::-1]
+
+
+class SliceCache:
+    """一个方向上已完成窗宽窗位和颜色映射的切片(RGB uint8)的环形缓存
+
+    切片存放在预先分配的RING_SIZE个槽中，按环形顺序复用，内存固定。每次取切片后
+    在后台线程预取前后的层，沿移动方向多预取一些，滚动时直接从缓存中取出。
+    正在显示的切片所在的槽不会被覆盖。修改窗宽窗位或颜色表后缓存失效。
+    """
+
+    def __init__(self, numpy_data, axis, window, cmap='gray', size=RING_SIZE, prefetch=PREFETCH) -> None:
+        self.numpy_data = np.asarray(numpy_data)
+        self.axis = axis
+        self.count = self.numpy_data.shape[axis]
+        self.prefetch = prefetch
+        shape = plane_view(self.numpy_data, axis, 0).shape
+        self.slots = np.empty((max(size, 2 * prefetch + 2),) + shape + (3,), dtype=np.uint8)
+        self.slotOf = {}  # 层 -> 槽
+        self.indexOf = {}  # 槽 -> 层
+        self.nextSlot = 0
+        self.current = None
+        self.direction = 1
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.set_window(window, cmap)
+
+    def set_window(self, window, cmap=None):
+        """窗宽窗位(low, high)或颜色表改变，缓存失效"""
+        if cmap is not None:
+            self.cmap = cmap
+        self.window = (float(window[0]), float(window[1]))
+        self.colors = (matplotlib.colormaps[self.cmap](np.linspace(0, 1, 256))[:, :3] * 255).astype(np.uint8)
+        self.lut = None
+        self.lutOffset = 0
+        if np.issubdtype(self.numpy_data.dtype, np.integer):
+            info = np.iinfo(self.numpy_data.dtype)
+            if int(info.max) - int(info.min) < MAX_LUT_SIZE:
+                # 该类型每个可能取值 -> 颜色
+                values = np.arange(int(info.min), int(info.max) + 1)
+                self.lut = self.colors[self.color_index(values)]
+                self.lutOffset = -int(info.min)
+        with self.lock:
+            self.generation += 1
+            self.slotOf.clear()
+            self.indexOf.clear()
+
+    def color_index(self, values):
+        low, high = self.window
+        scale = 255.0 / (high - low) if high > low else 0.0
+        index = (np.asarray(values, dtype=np.float32) - low) * scale
+        return np.clip(index, 0, 255, out=index).astype(np.uint8)
+
+    def colorize(self, plane, out):
+        if self.lut is not None:
+            index = plane.astype(np.int32)
+            if self.lutOffset:
+                index += self.lutOffset
+            np.take(self.lut, index, axis=0, out=out)
+        else:
+            np.take(self.colors, self.color_index(plane), axis=0, out=out)
+
+    def get(self, k):
+        """第k层的RGB图像(缓存槽的视图)，未缓存时立即计算"""
+        k = min(max(int(k), 0), self.count - 1)
+        if self.current is not None and k != self.current:
+            self.direction = 1 if k > self.current else -1
+        with self.lock:
+            self.current = k
+            slot = self.slotOf.get(k)
+        if slot is None:
+            slot = self.fill(k, self.generation)
+        self.executor.submit(self.prefetchAround, k, self.generation)
+        return self.slots[slot]
+
+    def fill(self, k, generation):
+        with self.lock:
+            if generation != self.generation:
+                return None
+            if k in self.slotOf:
+                return self.slotOf[k]
+            slot = self.take_slot()
+        self.colorize(plane_view(self.numpy_data, self.axis, k), self.slots[slot])
+        with self.lock:
+            if generation != self.generation:
+                return slot
+            if k in self.slotOf:
+                # 另一个线程已经算好了这一层，本槽留作空闲
+                return self.slotOf[k]
+            self.slotOf[k] = slot
+            self.indexOf[slot] = k
+        return slot
+
+    def take_slot(self):
+        """按环形顺序取下一个槽，跳过正在显示的切片(调用时已持有锁)"""
+        while True:
+            slot = self.nextSlot
+            self.nextSlot = (self.nextSlot + 1) % len(self.slots)
+            old = self.indexOf.get(slot)
+            if old is not None and old == self.current:
+                continue
+            if old is not None:
+                del self.indexOf[slot]
+                if self.slotOf.get(old) == slot:
+                    del self.slotOf[old]
+            return slot
+
+    def prefetchAround(self, k, generation):
+        # 沿移动方向预取prefetch层，反方向预取一半
+        ahead = [k + self.direction * i for i in range(1, self.prefetch + 1)]
+        behind = [k - self.direction * i for i in range(1, self.prefetch // 2 + 1)]
+        for index in ahead + behind:
+            if generation != self.generation or self.current != k:
+                return
+            if 0 <= index < self.count:
+                self.fill(index, generation)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,148 @@
+import os
+
+import numpy as np
+
+from Lazy import lazy_import
+
+sp_fft = lazy_import('scipy.fft')
+
+# scipy.fft的并行线程数；pocketfft内部缓存了各长度的变换计划，重复变换时直接复用
+WORKERS = os.cpu_count() or 1
+
+
+class Spectrum:
+    """实数数据的频谱，使用float32的rfftn，只保存一半系数(厄米对称)
+
+    与complex128的fftn相比内存约为1/4。三维体数据(Fortran顺序)在C顺序的转置
+    视图上变换，使连续的轴被减半。
+    """
+
+    def __init__(self, coefficients, shape, axes, dtype, transposed=False) -> None:
+        self.coefficients = coefficients
+        self.shape = shape  # 变换时(可能转置后)数组的形状
+        self.axes = axes
+        self.dtype = dtype  # 原数据类型，逆变换时转换回该类型
+        self.transposed = transposed
+
+    @classmethod
+    def forward(cls, data, axes=None):
+        """:param axes: 变换的轴，二维图像为(0, 1)，各颜色通道分别变换"""
+        transposed = data.ndim > 1 and data.flags.f_contiguous and not data.flags.c_contiguous
+        if axes is None:
+            axes = tuple(range(data.ndim))
+        if transposed:
+            data = data.T
+            axes = tuple(sorted(data.ndim - 1 - axis for axis in axes))
+        real = data if data.dtype == np.float32 else data.astype(np.float32)
+        coefficients = sp_fft.rfftn(real, axes=axes, workers=WORKERS)
+        return cls(coefficients, data.shape, axes, data.dtype, transposed)
+
+    def inverse(self, coefficients=None, dtype=None):
+        """逆变换，整数类型的结果四舍五入并截断到该类型的取值范围"""
+        if coefficients is None:
+            coefficients = self.coefficients
+        lengths = [self.shape[axis] for axis in self.axes]
+        result = sp_fft.irfftn(coefficients, s=lengths, axes=self.axes, workers=WORKERS)
+        dtype = np.dtype(dtype or self.dtype)
+        if np.issubdtype(dtype, np.integer):
+            info = np.iinfo(dtype)
+            np.rint(result, out=result)
+            np.clip(result, info.min, info.max, out=result)
+        return self._oriented(result.astype(dtype, copy=False))
+
+    def magnitude(self, centered=False):
+        return self._oriented(self._full(np.abs(self.coefficients), centered))
+
+    def log_magnitude(self, centered=False):
+        """log(1 + |F|)归一化到0~255的uint8，用于显示"""
+        magnitude = np.abs(self.coefficients)
+        np.log1p(magnitude, out=magnitude)
+        return self._oriented(to_display(self._full(magnitude, centered)))
+
+    def phase(self, centered=False):
+        """相位(-pi~pi)归一化到0~255的uint8，用于显示"""
+        return self._oriented(to_display(self._full(np.angle(self.coefficients), centered, odd=True)))
+
+    def frequencies(self):
+        """各变换轴上的频率(周期/像素)，形状可与coefficients广播"""
+        grids = []
+        for axis in self.axes:
+            if axis == self.axes[-1]:
+                values = sp_fft.rfftfreq(self.shape[axis]).astype(np.float32)
+            else:
+                values = sp_fft.fftfreq(self.shape[axis]).astype(np.float32)
+            shape = [1] * len(self.shape)
+            shape[axis] = values.size
+            grids.append(values.reshape(shape))
+        return grids
+
+    def filtered(self, response, dtype=None):
+        """频域相乘后逆变换，response为transfer_function的结果"""
+        return self.inverse(self.coefficients * response, dtype=dtype)
+
+    def radius(self):
+        """各系数到零频的距离(周期/像素)，范围0~0.5*sqrt(变换维数)"""
+        squared = None
+        for grid in self.frequencies():
+            squared = grid * grid if squared is None else squared + grid * grid
+        return np.sqrt(squared)
+
+    def _full(self, values, centered, odd=False):
+        """由一半系数按厄米对称 F(-k) = conj(F(k)) 恢复完整频谱，centered时把零频移到中心"""
+        last = self.axes[-1]
+        n = self.shape[last]
+        missing = np.flip(np.take(values, range(1, n - n // 2), axis=last), axis=last)
+        for axis in self.axes[:-1]:
+            # 下标取反：i -> (-i) mod n
+            missing = np.roll(np.flip(missing, axis=axis), 1, axis=axis)
+        if odd:
+            missing = -missing
+        full = np.concatenate([values, missing], axis=last)
+        if centered:
+            full = sp_fft.fftshift(full, axes=self.axes)
+        return full
+
+    def _oriented(self, result):
+        return result.T if self.transposed else result
+
+
+def to_display(values):
+    """线性归一化到0~255的uint8"""
+    low = float(values.min())
+    high = float(values.max())
+    scale = 255.0 / (high - low) if high > low else 0.0
+    values = values - low
+    values *= scale
+    return values.astype(np.uint8)
+
+
+def transfer_function(spectrum, kind='ideal', band='lowpass', cutoff=0.1, high_cutoff=None, order=2):
+    """频域滤波器的传递函数，形状可与spectrum.coefficients广播
+
+    :param kind: 'ideal' | 'butterworth' | 'gaussian'
+    :param band: 'lowpass' | 'highpass' | 'bandpass'
+    :param cutoff: 截止频率(周期/像素，0~0.5)，带通时为下截止频率
+    :param high_cutoff: 带通的上截止频率
+    :param order: Butterworth滤波器的阶数
+    """
+    radius = spectrum.radius()
+    if band == 'lowpass':
+        return _lowpass(radius, kind, cutoff, order)
+    if band == 'highpass':
+        return 1 - _lowpass(radius, kind, cutoff, order)
+    if band == 'bandpass':
+        if high_cutoff is None or high_cutoff <= cutoff:
+            raise ValueError('bandpass needs high_cutoff > cutoff')
+        return _lowpass(radius, kind, high_cutoff, order) * (1 - _lowpass(radius, kind, cutoff, order))
+    raise ValueError('unknown band: ' + str(band))
+
+
+def _lowpass(radius, kind, cutoff, order):
+    cutoff = np.float32(max(cutoff, 1e-6))
+    if kind == 'ideal':
+        return (radius <= cutoff).astype(np.float32)
+    if kind == 'butterworth':
+        return 1 / (1 + (radius / cutoff) ** (2 * order))
+    if kind == 'gaussian':
+        return np.exp(-radius * radius / (2 * cutoff * cutoff))
+    raise ValueError('unknown filter kind: ' + str(kind))
@@ -0,0 +1,173 @@
+"""MedicalVis原生数据格式(.mvol未压缩 / .mvolz zlib压缩)：分块的体素数组、几何信息、DICOM元数据与处理历史
+
+文件结构：
+    0      8字节标识 b'MVOL0001'
+    8      文件头的偏移与长度(两个小端uint64)
+    4096   各块数据，按顺序紧密排列
+    末尾   文件头(UTF-8 JSON)：形状、类型、内存顺序、分块轴与每块的层数、压缩方式、
+           块索引[(偏移, 长度)]、spacing/origin、DICOM元数据、处理历史与数据指纹
+
+数组沿内存中最外层的轴(Fortran顺序为最后一个轴)分块，每块是原数组中连续的一段内存。
+未压缩时所有块首尾相接正好是整个数组，重新打开时直接内存映射，不读取像素；
+压缩时各块多线程解压，read(start, stop)只解压与给定范围相交的块。
+"""
+import json
+import os
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from Volume import numpy_to_grid
+
+MAGIC = b'MVOL0001'
+# 块数据的起始位置，对齐到页大小，内存映射时不需要额外偏移
+DATA_OFFSET = 4096
+# 每块的大致字节数
+CHUNK_BYTES = 4 * 1024 * 1024
+# zlib压缩等级，1最快，压缩率对医学图像已足够
+COMPRESSION_LEVEL = 1
+# 压缩与解压的线程数，zlib会释放GIL
+WORKERS = os.cpu_count() or 1
+
+
+class StoredVolume:
+    """已打开的原生格式文件，只读取了文件头"""
+
+    def __init__(self, file_path, header) -> None:
+        self.file_path = file_path
+        self.header = header
+        self.shape = tuple(header['shape'])
+        self.dtype = np.dtype(header['dtype'])
+        self.order = header['order']
+        self.axis = header['chunk_axis']
+        self.depth = header['chunk_depth']
+        self.chunks = header['chunks']
+        self.compression = header['compression']
+        self.spacing = tuple(header.get('spacing') or (1.0, 1.0, 1.0))
+        self.origin = tuple(header.get('origin') or (0.0, 0.0, 0.0))
+        self.is_volume = header.get('volume', False)
+
+    def array(self):
+        """整个数组：未压缩时为写时复制的内存映射，压缩时多线程解压到内存"""
+        if self.compression is None:
+            offset = self.chunks[0][0] if self.chunks else DATA_OFFSET
+            # 'c'为写时复制，原文件不会被修改
+            return np.memmap(self.file_path, dtype=self.dtype, mode='c', offset=offset, shape=self.shape,
+                             order=self.order)
+        return self.read(0, self.shape[self.axis])
+
+    def read(self, start, stop):
+        """分块轴上[start, stop)范围的数据，只读取和解压与之相交的块"""
+        stop = min(stop, self.shape[self.axis])
+        shape = list(self.shape)
+        shape[self.axis] = max(stop - start, 0)
+        out = np.empty(shape, dtype=self.dtype, order=self.order)
+        first, last = start // self.depth, -(-stop // self.depth)
+
+        def load(index):
+            lo = index * self.depth
+            hi = min(lo + self.depth, self.shape[self.axis])
+            chunk = self._chunk(index, hi - lo)
+            # 块与请求范围的交集
+            a, b = max(lo, start), min(hi, stop)
+            source = [slice(None)] * len(shape)
+            source[self.axis] = slice(a - lo, b - lo)
+            target = [slice(None)] * len(shape)
+            target[self.axis] = slice(a - start, b - start)
+            out[tuple(target)] = chunk[tuple(source)]
+
+        with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+            list(executor.map(load, range(first, last)))
+        return out
+
+    def _chunk(self, index, count):
+        offset, length = self.chunks[index]
+        with open(self.file_path, 'rb') as f:
+            f.seek(offset)
+            data = f.read(length)
+        if self.compression == 'zlib':
+            data = zlib.decompress(data)
+        shape = list(self.shape)
+        shape[self.axis] = count
+        return np.frombuffer(data, dtype=self.dtype).reshape(shape, order=self.order)
+
+    def to_grid(self, array):
+        return numpy_to_grid(array, spacing=self.spacing, origin=self.origin)
+
+
+def open_store(file_path):
+    """读取文件头，不是原生格式时抛出ValueError"""
+    with open(file_path, 'rb') as f:
+        start = f.read(len(MAGIC) + 16)
+        if len(start) < len(MAGIC) + 16 or start[:len(MAGIC)] != MAGIC:
+            raise ValueError('not a MedicalVis volume file: ' + file_path)
+        offset, length = struct.unpack('<2Q', start[len(MAGIC):])
+        f.seek(offset)
+        header = json.loads(f.read(length).decode('utf-8'))
+    return StoredVolume(file_path, header)
+
+
+def save_store(file_path, numpy_data, compression=None, spacing=None, origin=None, is_volume=False,
+               metadata=None):
+    """保存数组，compression为None或'zlib'；metadata为写入文件头的其他内容(DICOM元数据、处理历史等)
+
+    逐块写入，内存映射的大数组不需要整体读入内存。先写入同一文件夹下的临时文件，完成后再替换
+    file_path：出错时不会留下不完整的文件，覆盖正被内存映射的文件(如重新打开的.mvol)也不会影响映射。
+    """
+    order = 'F' if numpy_data.flags.f_contiguous and not numpy_data.flags.c_contiguous else 'C'
+    if not numpy_data.flags.forc:
+        numpy_data = np.ascontiguousarray(numpy_data)
+        order = 'C'
+    # 分块轴为内存中最外层的轴，每块是连续的一段内存
+    axis = numpy_data.ndim - 1 if order == 'F' else 0
+    size = numpy_data.shape[axis]
+    slice_bytes = max(numpy_data.nbytes // max(size, 1), 1)
+    depth = max(CHUNK_BYTES // slice_bytes, 1)
+    starts = list(range(0, size, depth))
+    header = {'shape': list(numpy_data.shape), 'dtype': numpy_data.dtype.str, 'order': order, 'chunk_axis': axis,
+              'chunk_depth': depth, 'compression': compression, 'volume': is_volume,
+              'spacing': None if spacing is None else [float(d) for d in spacing],
+              'origin': None if origin is None else [float(o) for o in origin]}
+    header.update(metadata or {})
+    # 在写入数据前检查文件头能否保存，块索引在写入后补上
+    json.dumps(header, default=_json_default)
+
+    def encode(start):
+        index = [slice(None)] * numpy_data.ndim
+        index[axis] = slice(start, start + depth)
+        data = np.asarray(numpy_data[tuple(index)]).tobytes(order=order)
+        return zlib.compress(data, COMPRESSION_LEVEL) if compression == 'zlib' else data
+
+    chunks = []
+    temp_path = '%s.%d.tmp' % (file_path, os.getpid())
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(b'\0' * DATA_OFFSET)
+            with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+                # 每次只提交若干块，限制同时在内存中的块数
+                for batch in range(0, len(starts), 2 * WORKERS):
+                    for data in executor.map(encode, starts[batch:batch + 2 * WORKERS]):
+                        chunks.append((f.tell(), len(data)))
+                        f.write(data)
+            header['chunks'] = chunks
+            header = json.dumps(header, default=_json_default).encode('utf-8')
+            offset = f.tell()
+            f.write(header)
+            f.seek(0)
+            f.write(MAGIC + struct.pack('<2Q', offset, len(header)))
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _json_default(value):
+    """文件头中json不支持的值：numpy标量与数组转换为Python类型，其他对象(如处理参数中的函数)保存为repr"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return repr(value)
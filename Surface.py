@@ -0,0 +1,85 @@
+from collections import OrderedDict
+
+from Jobs import check_cancelled
+from Lazy import lazy_import
+
+pyvista = lazy_import('pyvista')
+vtk = lazy_import('vtk')
+
+# 缓存的等值面个数
+CACHE_SIZE = 64
+# 简化结果超出三角形上限时重新计算的次数
+MAX_DECIMATE_PASSES = 3
+
+
+def extract_isosurface(grid_data, level, max_triangles=None):
+    """用vtkFlyingEdges3D提取一个等值面，三角形数超过max_triangles时简化
+
+    FlyingEdges3D是多线程的，比contour默认使用的通用算法快数倍。只计算法向量，
+    不把标量值复制到输出的每个点上。
+    """
+    flyingEdges = vtk.vtkFlyingEdges3D()
+    flyingEdges.SetInputData(grid_data)
+    flyingEdges.SetInputArrayToProcess(0, 0, 0, vtk.vtkDataObject.FIELD_ASSOCIATION_POINTS, grid_data.array_names[0])
+    flyingEdges.SetValue(0, float(level))
+    flyingEdges.ComputeNormalsOn()
+    flyingEdges.ComputeGradientsOff()
+    flyingEdges.ComputeScalarsOff()
+    flyingEdges.Update()
+    surface = pyvista.wrap(flyingEdges.GetOutput())
+    check_cancelled()
+    if max_triangles is not None and surface.n_cells > max_triangles:
+        surface = decimate(surface, max_triangles, grid_data.dimensions)
+    return surface
+
+
+def decimate(surface, max_triangles, grid_shape=None):
+    """用顶点聚类(vtkQuadricClustering)简化到不超过max_triangles个三角形
+
+    聚类的耗时与输入大小成线性关系，比逐条边折叠的vtkQuadricDecimation快一个数量级以上。
+    输出三角形数约与划分数的平方成正比，先按此估计划分数，超出上限时再修正。
+    """
+    scale = (max_triangles / (2.0 * surface.n_cells)) ** 0.5
+    bounds = surface.bounds
+    lengths = [max(bounds[2 * i + 1] - bounds[2 * i], 1e-12) for i in range(3)]
+    if grid_shape is None:
+        grid_shape = (int(round(surface.n_points ** (1 / 2.0))),) * 3
+    # 按包围盒的长宽比分配各轴的划分数，使聚类单元接近立方体
+    base = max(grid_shape) * scale / max(lengths)
+    for _ in range(MAX_DECIMATE_PASSES):
+        divisions = [max(int(base * length), 2) for length in lengths]
+        clustering = vtk.vtkQuadricClustering()
+        clustering.SetInputData(surface)
+        clustering.AutoAdjustNumberOfDivisionsOff()
+        clustering.SetNumberOfDivisions(*divisions)
+        clustering.Update()
+        output = clustering.GetOutput()
+        if output.GetNumberOfCells() <= max_triangles:
+            break
+        base *= 0.95 * (max_triangles / output.GetNumberOfCells()) ** 0.5
+    # 简化后重新计算法向量，避免光照出现块状
+    normals = vtk.vtkPolyDataNormals()
+    normals.SetInputData(output)
+    normals.SplittingOff()
+    normals.Update()
+    return pyvista.wrap(normals.GetOutput())
+
+
+class SurfaceCache:
+    """一个体数据的等值面缓存，键为(等值, 三角形上限)，按LRU淘汰"""
+
+    def __init__(self, size=CACHE_SIZE) -> None:
+        self.size = size
+        self.surfaces = OrderedDict()
+
+    def get(self, level, max_triangles):
+        key = (float(level), max_triangles)
+        if key in self.surfaces:
+            self.surfaces.move_to_end(key)
+            return self.surfaces[key]
+        return None
+
+    def put(self, level, max_triangles, surface):
+        self.surfaces[(float(level), max_triangles)] = surface
+        while len(self.surfaces) > self.size:
+            self.surfaces.popitem(last=False)
@@ -0,0 +1,216 @@
+"""耗时追踪：记录读取、处理函数、显示与渲染的耗时、数组形状与内存，导出为Chrome/Perfetto追踪文件
+
+默认关闭，关闭时被追踪的函数只多一次属性判断。启用方式：环境变量 MEDICALVIS_TRACE=1
+(=memory 时同时用tracemalloc统计分配的内存，会使计算明显变慢)，或 tracer.enable()。
+导出的JSON可以在 chrome://tracing 或 https://ui.perfetto.dev 中打开。
+"""
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+# 保存的最多记录数，超出时丢弃最早的记录
+MAX_EVENTS = 100000
+
+
+class Tracer:
+    def __init__(self) -> None:
+        self.enabled = False
+        self.memory = False
+        self.events = deque(maxlen=MAX_EVENTS)
+        self.origin = time.perf_counter()
+        self._local = threading.local()
+        self._started_tracemalloc = False
+
+    def enable(self, memory=False):
+        """开始记录；memory时用tracemalloc统计每个记录期间分配的内存"""
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self.memory = memory and tracemalloc.is_tracing()
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+        self.memory = False
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def clear(self):
+        self.events.clear()
+
+    def stack(self):
+        """当前线程中正在进行的记录"""
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def recent(self, count=5):
+        """最近完成的count个最外层记录，按完成顺序"""
+        result = []
+        for event in reversed(self.events):
+            if event['depth'] == 0:
+                result.append(event)
+                if len(result) == count:
+                    break
+        return result[::-1]
+
+    def export_chrome(self, file_path):
+        """保存为Chrome追踪格式(Trace Event Format)的JSON"""
+        pid = os.getpid()
+        threads = {}
+        trace_events = []
+        for event in list(self.events):
+            threads.setdefault(event['tid'], event['thread'])
+            trace_events.append({'name': event['name'], 'cat': event['cat'], 'ph': 'X', 'pid': pid,
+                                'tid': event['tid'], 'ts': event['ts'], 'dur': event['dur'], 'args': event['args']})
+        for tid, name in threads.items():
+            trace_events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}})
+        with open(file_path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f)
+
+
+tracer = Tracer()
+if os.environ.get('MEDICALVIS_TRACE', '0') not in ('', '0'):
+    tracer.enable(memory=os.environ['MEDICALVIS_TRACE'] == 'memory')
+
+
+class Span:
+    """一条记录，with块结束时加入tracer.events；set()添加参数(如输出形状)"""
+
+    def __init__(self, name, cat, args) -> None:
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.child_peak = 0
+
+    def set(self, **args):
+        self.args.update(args)
+
+    def __enter__(self):
+        stack = tracer.stack()
+        self.depth = len(stack)
+        stack.append(self)
+        if tracer.memory and tracemalloc.is_tracing():
+            self.memory_start, _ = tracemalloc.get_traced_memory()
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+        else:
+            self.memory_start = None
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        stack = tracer.stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        if self.memory_start is not None and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            # 内层记录重置了峰值，取本记录最近一次重置后的峰值与内层记录峰值中较大的
+            peak = max(peak, self.child_peak)
+            self.args['allocated'] = current - self.memory_start
+            self.args['peak'] = peak - self.memory_start
+            if stack:
+                stack[-1].child_peak = max(stack[-1].child_peak, peak)
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        tracer.events.append({'name': self.name, 'cat': self.cat, 'ts': (self.start - tracer.origin) * 1e6,
+                              'dur': (end - self.start) * 1e6, 'tid': threading.get_ident(),
+                              'thread': threading.current_thread().name, 'depth': self.depth, 'args': self.args})
+        return False
+
+
+class NullSpan:
+    """关闭时使用的空记录"""
+
+    def set(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+def span(name, cat='app', **args):
+    """with span('name', key=value): ...  关闭时返回共用的空记录"""
+    if not tracer.enabled:
+        return NULL_SPAN
+    return Span(name, cat, args)
+
+
+def describe(value):
+    """数组或DataManager的形状、类型与字节数，其他对象返回None"""
+    data = getattr(value, 'numpy_data', value)
+    shape = getattr(data, 'shape', None)
+    if shape is None or not hasattr(data, 'dtype'):
+        return None
+    return {'shape': list(shape), 'dtype': str(data.dtype), 'bytes': int(data.nbytes)}
+
+
+def traced(func=None, name=None, cat='app'):
+    """函数/方法的装饰器，记录耗时、其他参数与输入、返回值的数组形状；也可以 traced(func, 'name') 包装已有函数"""
+    if func is None:
+        return functools.partial(traced, name=name, cat=cat)
+    name = name or func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not tracer.enabled:
+            return func(*args, **kwargs)
+        with Span(name, cat, {}) as record:
+            # 第一个数组或DataManager参数(方法一般为self)
+            source = next((info for info in map(describe, args) if info is not None), None)
+            if source is not None:
+                record.set(input=source)
+            params = [repr(arg) for arg in args[1:] if describe(arg) is None]
+            params += ['%s=%r' % item for item in kwargs.items() if describe(item[1]) is None]
+            if params:
+                record.set(params=', '.join(params)[:200])
+            result = func(*args, **kwargs)
+            # 返回None的方法(如read_data)修改了self，记录修改后的数据
+            output = describe(result if result is not None or not args else args[0])
+            if output is not None:
+                record.set(output=output)
+        return result
+
+    return wrapper
+
+
+def trace_render_window(render_window, name='render'):
+    """用VTK渲染窗口的StartEvent/EndEvent记录每一帧的渲染耗时(Qt中的渲染是异步的，不能在调用render()处计时)"""
+    current = []
+
+    def on_start(obj, event):
+        if tracer.enabled:
+            current.append(Span(name, 'render', {}).__enter__())
+
+    def on_end(obj, event):
+        if current:
+            record = current.pop()
+            record.set(size=list(obj.GetSize()))
+            record.__exit__(None, None, None)
+
+    render_window.AddObserver('StartEvent', on_start)
+    render_window.AddObserver('EndEvent', on_end)
+
+
+def format_event(event):
+    """状态栏显示的一条记录：名称 耗时 [输出形状] [分配内存]"""
+    parts = [event['name'].split('.')[-1], '%.0fms' % (event['dur'] / 1e3)]
+    output = event['args'].get('output')
+    if output is not None:
+        parts.append('x'.join(str(n) for n in output['shape']))
+    if 'allocated' in event['args']:
+        parts.append('%+.1fMB' % (event['args']['allocated'] / 2 ** 20))
+    return ' '.join(parts)
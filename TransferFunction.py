@@ -0,0 +1,84 @@
+import os
+
+import numpy as np
+
+from Lazy import lazy_import
+
+matplotlib = lazy_import('matplotlib')
+pyvista = lazy_import('pyvista')
+vtk = lazy_import('vtk')
+
+# 颜色传递函数的采样点数
+N_COLORS = 256
+# 不透明度预设转换为可拖动控制点时的点数
+CONTROL_POINTS = 9
+OPACITY_PRESETS = ['linear', 'linear_r', 'geom', 'geom_r', 'sigmoid', 'sigmoid_r']
+
+
+class TransferFunction:
+    """体绘制的颜色与不透明度传递函数
+
+    定义在原始标量值上(clim)，不需要像pyvista.add_volume那样把整个体数据缩放到0~255的
+    float64拷贝，各分辨率层级的体数据可以共用。修改颜色表或不透明度时只更新
+    vtkColorTransferFunction与vtkPiecewiseFunction，不重新创建mapper和actor。
+    不透明度由若干控制点[(t, opacity)]给出，t为0~1的相对位置，控制点之间线性插值。
+    """
+
+    def __init__(self, clim, cmap='viridis', opacity='linear') -> None:
+        self.clim = (float(clim[0]), float(clim[1]))
+        self.color = vtk.vtkColorTransferFunction()
+        self.opacity = vtk.vtkPiecewiseFunction()
+        self.cmap = None
+        self.points = []
+        self.set_colormap(cmap)
+        self.set_opacity(opacity)
+
+    def value(self, t):
+        """相对位置 -> 标量值"""
+        return self.clim[0] + t * (self.clim[1] - self.clim[0])
+
+    def set_colormap(self, cmap):
+        self.cmap = cmap
+        colors = matplotlib.colormaps[cmap](np.linspace(0, 1, N_COLORS))
+        self.color.RemoveAllPoints()
+        for t, (r, g, b, _) in zip(np.linspace(0, 1, N_COLORS), colors):
+            self.color.AddRGBPoint(self.value(t), r, g, b)
+
+    def set_opacity(self, opacity):
+        """opacity为预设名称(见OPACITY_PRESETS)或控制点列表"""
+        if isinstance(opacity, str):
+            values = pyvista.opacity_transfer_function(opacity, CONTROL_POINTS) / 255.0
+            opacity = list(zip(np.linspace(0, 1, CONTROL_POINTS), values))
+        self.set_opacity_points(opacity)
+
+    def set_opacity_points(self, points):
+        self.points = sorted((float(t), float(np.clip(a, 0, 1))) for t, a in points)
+        self.opacity.RemoveAllPoints()
+        for t, a in self.points:
+            self.opacity.AddPoint(self.value(t), a)
+
+
+def create_volume(grid_data, transfer_function, blending='composite'):
+    """用grid_data的点数据(不拷贝)创建vtkVolume，mapper的选择与pyvista默认相同"""
+    mapper = vtk.vtkFixedPointVolumeRayCastMapper() if os.name == 'nt' else vtk.vtkSmartVolumeMapper()
+    mapper.SetInputData(grid_data)
+    mapper.SetScalarModeToUsePointFieldData()
+    mapper.SelectScalarArray(grid_data.array_names[0])
+    if blending == 'maximum':
+        mapper.SetBlendModeToMaximumIntensity()
+    else:
+        mapper.SetBlendModeToComposite()
+
+    prop = vtk.vtkVolumeProperty()
+    prop.SetColor(transfer_function.color)
+    prop.SetScalarOpacity(transfer_function.opacity)
+    prop.SetAmbient(0.0)
+    prop.SetDiffuse(0.7)
+    prop.SetSpecular(0.2)
+    prop.SetSpecularPower(10.0)
+    prop.SetScalarOpacityUnitDistance(grid_data.length / (np.mean(grid_data.dimensions) - 1))
+
+    volume = vtk.vtkVolume()
+    volume.SetMapper(mapper)
+    volume.SetProperty(prop)
+    return volume
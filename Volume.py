@@ -0,0 +1,286 @@
+import os
+import struct
+import tempfile
+import weakref
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+
+from Jobs import report_progress
+from Lazy import lazy_import
+from Trace import traced
+
+pyvista = lazy_import('pyvista')
+
+# 逐块处理时每一块(含重叠区域)的大致内存上限
+SLAB_BYTES = 64 * 1024 * 1024
+# 并行处理各块的线程数，scipy.ndimage/skimage的滤波会释放GIL
+WORKERS = os.cpu_count() or 1
+# 小于该大小的内存中体数据不分块，直接整体计算
+MIN_TILED_BYTES = 16 * 1024 * 1024
+# 处理结果的内存映射文件所在目录，None时使用系统临时目录
+SCRATCH_DIR = None
+# 交互渲染用的多分辨率金字塔层数(2x、4x、8x)，各轴小于该体素数时不再降采样
+PYRAMID_LEVELS = 3
+PYRAMID_MIN_SIZE = 16
+# 调试模式：numpy数组与UniformGrid之间发生隐式拷贝时抛出AssertionError
+DEBUG_COPY = os.environ.get('MEDICALVIS_DEBUG_COPY', '0') == '1'
+
+NIFTI_DTYPES = {2: np.uint8, 4: np.int16, 8: np.int32, 16: np.float32, 64: np.float64,
+                256: np.int8, 512: np.uint16, 768: np.uint32, 1024: np.int64, 1280: np.uint64}
+META_DTYPES = {'MET_UCHAR': np.uint8, 'MET_CHAR': np.int8, 'MET_USHORT': np.uint16, 'MET_SHORT': np.int16,
+               'MET_UINT': np.uint32, 'MET_INT': np.int32, 'MET_ULONG': np.uint64, 'MET_LONG': np.int64,
+               'MET_FLOAT': np.float32, 'MET_DOUBLE': np.float64}
+
+
+class MappedVolume:
+    """磁盘上未压缩的体数据，像素以内存映射方式按需读取
+
+    array的形状为(x, y, z)，Fortran顺序，与VTK的点数据顺序一致，
+    因此可以不经拷贝直接作为UniformGrid的点数据。
+    """
+
+    def __init__(self, file_path, shape, dtype, offset=0, spacing=(1.0, 1.0, 1.0), origin=(0.0, 0.0, 0.0)):
+        self.file_path = file_path
+        self.shape = tuple(int(n) for n in shape)
+        self.dtype = np.dtype(dtype)
+        self.offset = int(offset)
+        self.spacing = tuple(float(d) for d in spacing)
+        self.origin = tuple(float(o) for o in origin)
+
+    @property
+    def array(self):
+        # 'c'为写时复制，原文件不会被修改
+        return np.memmap(self.file_path, dtype=self.dtype, mode='c', offset=self.offset,
+                         shape=self.shape, order='F')
+
+    def to_grid(self, array=None):
+        if array is None:
+            array = self.array
+        return numpy_to_grid(array, spacing=self.spacing, origin=self.origin)
+
+
+def as_volume_layout(numpy_data):
+    """体数据统一使用(x, y, z)的Fortran顺序，这样ravel(order='F')就是VTK点数据的视图
+
+    只有输入不是Fortran顺序时才会拷贝，调试模式下会报告这次拷贝。
+    """
+    if numpy_data.flags.f_contiguous:
+        return numpy_data
+    report_copy('numpy_data is not Fortran-contiguous', numpy_data.nbytes)
+    return np.asfortranarray(numpy_data)
+
+
+@traced
+def numpy_to_grid(numpy_data, spacing=None, origin=None):
+    """用Fortran顺序的numpy数组构造UniformGrid，点数据与numpy_data共享内存"""
+    if not numpy_data.flags.f_contiguous:
+        raise ValueError('numpy_data must be Fortran-contiguous, use as_volume_layout first')
+    grid_data = pyvista.UniformGrid()
+    grid_data.dimensions = numpy_data.shape + (1,) * (3 - numpy_data.ndim)
+    if spacing is not None:
+        grid_data.spacing = spacing
+    if origin is not None:
+        grid_data.origin = origin
+    grid_data.point_data['values'] = numpy_data.ravel(order='F')
+    check_shared(numpy_data, grid_data)
+    return grid_data
+
+
+def grid_to_numpy(grid_data):
+    """UniformGrid的点数据按VTK的x最快顺序重塑为(x, y, z)视图，不产生拷贝"""
+    numpy_data = grid_data[grid_data.array_names[0]]
+    return numpy_data.reshape(grid_data.dimensions, order='F')
+
+
+def check_shared(numpy_data, grid_data):
+    """检查numpy_data与grid_data的点数据是否为同一块内存"""
+    if not DEBUG_COPY or numpy_data is None or grid_data is None:
+        return
+    point_data = grid_data[grid_data.array_names[0]]
+    if not np.shares_memory(numpy_data, point_data):
+        report_copy('numpy_data and ugrid_data do not share memory', numpy_data.nbytes)
+
+
+def report_copy(reason, nbytes):
+    if DEBUG_COPY:
+        raise AssertionError('hidden copy of %.1f MB: %s' % (nbytes / 1024 ** 2, reason))
+
+
+def open_nifti(file_path):
+    """解析未压缩的NIfTI-1文件头，不支持时返回None"""
+    with open(file_path, 'rb') as f:
+        header = f.read(348)
+    if len(header) < 348:
+        return None
+    for endian in '<>':
+        if struct.unpack(endian + 'i', header[:4])[0] == 348:
+            break
+    else:
+        return None
+    dim = struct.unpack(endian + '8h', header[40:56])
+    datatype = struct.unpack(endian + 'h', header[70:72])[0]
+    pixdim = struct.unpack(endian + '8f', header[76:108])
+    vox_offset = struct.unpack(endian + 'f', header[108:112])[0]
+    scl_slope, scl_inter = struct.unpack(endian + '2f', header[112:120])
+    qoffset = struct.unpack(endian + '3f', header[268:280])
+    if dim[0] != 3 or datatype not in NIFTI_DTYPES:
+        return None
+    if scl_slope not in (0.0, 1.0) or scl_inter != 0.0:
+        # 需要线性变换的数据交给SimpleITK处理
+        return None
+    dtype = np.dtype(NIFTI_DTYPES[datatype]).newbyteorder(endian)
+    # NIfTI使用RAS坐标，转换为与DICOM/ITK一致的LPS坐标
+    origin = (-qoffset[0], -qoffset[1], qoffset[2])
+    return MappedVolume(file_path, dim[1:4], dtype, offset=vox_offset, spacing=pixdim[1:4], origin=origin)
+
+
+def open_metaimage(file_path):
+    """解析MetaImage(.mhd)文件头及其对应的未压缩raw文件，不支持时返回None"""
+    fields = {}
+    with open(file_path, 'r') as f:
+        for line in f:
+            if '=' in line:
+                key, value = line.split('=', 1)
+                fields[key.strip()] = value.strip()
+    if fields.get('CompressedData', 'False').lower() == 'true':
+        return None
+    data_file = fields.get('ElementDataFile')
+    shape = [int(n) for n in fields.get('DimSize', '').split()]
+    if data_file is None or data_file == 'LOCAL' or len(shape) != 3 \
+            or fields.get('ElementType') not in META_DTYPES or int(fields.get('ElementNumberOfChannels', 1)) != 1:
+        return None
+    dtype = np.dtype(META_DTYPES[fields['ElementType']])
+    if fields.get('BinaryDataByteOrderMSB', fields.get('ElementByteOrderMSB', 'False')).lower() == 'true':
+        dtype = dtype.newbyteorder('>')
+    spacing = [float(d) for d in fields.get('ElementSpacing', '1 1 1').split()]
+    origin = [float(o) for o in fields.get('Offset', fields.get('Origin', '0 0 0')).split()]
+    raw_path = os.path.join(os.path.dirname(file_path), data_file)
+    offset = int(fields.get('HeaderSize', 0))
+    if offset < 0:
+        # -1 表示数据位于文件末尾
+        offset = os.path.getsize(raw_path) - int(np.prod(shape)) * dtype.itemsize
+    return MappedVolume(raw_path, shape, dtype, offset=offset, spacing=spacing, origin=origin)
+
+
+def create_output(shape, dtype):
+    """在临时目录中创建内存映射的输出数组，数组释放后删除文件"""
+    fd, path = tempfile.mkstemp(suffix='.raw', dir=SCRATCH_DIR)
+    os.close(fd)
+    out = np.memmap(path, dtype=dtype, mode='w+', shape=tuple(shape), order='F')
+    weakref.finalize(out, _remove_file, path)
+    return out
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def downsample(numpy_data, factors):
+    """按块取平均降采样，factors为各轴的倍数，尾部不足一块的体素丢弃
+
+    每次从输入中按步长取出一个偏移位置的体素累加，只需分配输出大小的数组。
+    """
+    shape = tuple(n // f for n, f in zip(numpy_data.shape, factors))
+    total = np.zeros(shape, dtype=np.float32, order='F')
+    for offset in np.ndindex(*factors):
+        total += numpy_data[tuple(slice(o, o + n * f, f) for o, n, f in zip(offset, shape, factors))]
+    total /= np.prod(factors)
+    if np.issubdtype(numpy_data.dtype, np.integer):
+        np.rint(total, out=total)
+    return total.astype(numpy_data.dtype, order='F', copy=False)
+
+
+def build_pyramid(grid_data, levels=None):
+    """由全分辨率的体数据生成每层尺寸减半的UniformGrid列表，第i层约为原数据的1/2^(i+1)
+
+    每层由上一层降采样得到，总耗时约为读一遍原数据。体素中心位置保持不变。
+    """
+    if levels is None:
+        levels = PYRAMID_LEVELS
+    numpy_data = grid_to_numpy(grid_data)
+    spacing = np.array(grid_data.spacing, dtype=float)
+    origin = np.array(grid_data.origin, dtype=float)
+    pyramid = []
+    for _ in range(levels):
+        factors = tuple(2 if n >= 2 * PYRAMID_MIN_SIZE else 1 for n in numpy_data.shape)
+        if factors == (1,) * numpy_data.ndim:
+            break
+        numpy_data = downsample(numpy_data, factors)
+        origin = origin + (np.array(factors) - 1) / 2 * spacing
+        spacing = spacing * np.array(factors)
+        pyramid.append(numpy_to_grid(numpy_data, tuple(spacing), tuple(origin)))
+        report_progress(len(pyramid) / levels)
+    return pyramid
+
+
+def use_tiling(data):
+    """内存映射的体数据总是分块处理，内存中的体数据足够大时分块并行处理"""
+    return isinstance(data, np.memmap) or (data.nbytes >= MIN_TILED_BYTES and WORKERS > 1)
+
+
+def apply_slabwise(func, data, halo, out_dtype=None, slab_bytes=None, workers=None):
+    """沿最后一个轴把体数据分成若干块，每块带halo层重叠，多线程并行计算后拼接
+
+    func接收一块numpy数组并返回同形状的结果。只要halo不小于滤波核半径，
+    结果与对整个体数据调用func完全一致。内存映射的输入写入内存映射输出，
+    内存占用只与块大小和线程数有关；内存中的输入写入同样内存布局的数组。
+    """
+    depth = data.shape[-1]
+    if workers is None:
+        workers = WORKERS
+    plane_bytes = max(int(np.prod(data.shape[:-1])) * 8, 1)
+    if slab_bytes is None:
+        slab_bytes = SLAB_BYTES
+    thickness = max(slab_bytes // plane_bytes - 2 * halo, 1)
+    if not isinstance(data, np.memmap):
+        # 内存中的数据至少分成每个线程两块，便于负载均衡
+        thickness = min(thickness, max(-(-depth // (2 * workers)), 1))
+    starts = list(range(0, depth, thickness))
+
+    def run(start):
+        stop = min(start + thickness, depth)
+        lo = max(start - halo, 0)
+        hi = min(stop + halo, depth)
+        result = func(np.asarray(data[..., lo:hi]))
+        return start, stop, result[..., start - lo:start - lo + stop - start]
+
+    # 先算第一块以确定输出类型
+    start, stop, tile = run(starts[0])
+    out_dtype = out_dtype or tile.dtype
+    if isinstance(data, np.memmap):
+        out = create_output(data.shape, out_dtype)
+    else:
+        out = np.empty(data.shape, dtype=out_dtype, order='F' if data.flags.f_contiguous else 'C')
+    out[..., start:stop] = tile
+    done = 1
+    report_progress(done / len(starts))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        remaining = iter(starts[1:])
+        try:
+            while True:
+                # 同时进行的块数不超过线程数的两倍，限制内存占用
+                for start in remaining:
+                    pending.add(executor.submit(run, start))
+                    if len(pending) >= 2 * workers:
+                        break
+                if not pending:
+                    break
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    start, stop, tile = future.result()
+                    out[..., start:stop] = tile
+                    done += 1
+                report_progress(done / len(starts))
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+    if isinstance(out, np.memmap):
+        out.flush()
+    return out
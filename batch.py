@@ -0,0 +1,259 @@
+"""批量处理：对目录或通配符匹配的每个数据文件依次执行一组DataManager处理函数并保存结果，不导入Qt
+
+    python batch.py data/*.slc --ops "median_blur,gaussian_blur(sigma=3),sharpenSobel" --output out
+    python batch.py "studies/*" --dicom-series --ops median_blur --output out --format nii
+
+每个文件在进程池的一个进程中处理，结果先写入临时文件再改名，不会留下不完整的输出。
+处理完的文件记录在输出目录的清单(batch_manifest.jsonl)中，中断后用相同的参数重新运行
+会跳过已完成的文件。运行时逐个输出每个文件读取、各处理步骤与保存的耗时，最后输出汇总，
+--report 可另存为CSV。
+"""
+import argparse
+import ast
+import csv
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from glob import glob
+
+from Manager import DEFAULT_PRECISION, PRECISIONS, DataManager
+from Pipeline import OPERATIONS
+
+MANIFEST_NAME = 'batch_manifest.jsonl'
+
+
+def parse_operations(text):
+    """'median_blur,gaussian_blur(sigma=3)' -> [('median_blur', (), {}), ('gaussian_blur', (), {'sigma': 3})]
+
+    参数按Python字面量解析，如 maximum_filter(size=(20, 20, 5))。
+    """
+    try:
+        elements = ast.parse('[%s]' % text, mode='eval').body.elts
+    except SyntaxError:
+        raise ValueError('invalid operation list: ' + text)
+    operations = []
+    for node in elements:
+        if isinstance(node, ast.Name):
+            name, args, kwargs = node.id, (), {}
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+            name = node.func.id
+            args = tuple(ast.literal_eval(arg) for arg in node.args)
+            kwargs = {keyword.arg: ast.literal_eval(keyword.value) for keyword in node.keywords}
+        else:
+            raise ValueError('invalid operation: ' + ast.dump(node))
+        if name not in OPERATIONS:
+            raise ValueError('unknown operation: %s (available: %s)' % (name, ', '.join(OPERATIONS)))
+        operations.append((name, args, kwargs))
+    return operations
+
+
+def format_operations(operations):
+    """规范化的处理步骤文本，用于在清单中判断是否为同一组处理"""
+    parts = []
+    for name, args, kwargs in operations:
+        values = [repr(arg) for arg in args] + ['%s=%r' % item for item in sorted(kwargs.items())]
+        parts.append('%s(%s)' % (name, ', '.join(values)) if values else name)
+    return ','.join(parts)
+
+
+def find_inputs(patterns, dicom_series=False):
+    """展开输入的目录与通配符
+
+    目录中扩展名可以由DataManager.read_data读取的文件各为一个数据；dicom_series时
+    每个目录作为一个DICOM切片序列。
+    """
+    extensions = set(DataManager().read_func_dict)
+    inputs = []
+    for pattern in patterns:
+        paths = sorted(glob(pattern)) if any(c in pattern for c in '*?[') else [pattern]
+        for path in paths:
+            if os.path.isdir(path) and not dicom_series:
+                for name in sorted(os.listdir(path)):
+                    file_path = os.path.join(path, name)
+                    if os.path.isfile(file_path) and name[name.rfind('.') + 1:] in extensions:
+                        inputs.append(file_path)
+            elif os.path.isdir(path) == dicom_series:
+                inputs.append(path)
+    # 去重并保持顺序
+    return list(dict.fromkeys(os.path.normpath(path) for path in inputs))
+
+
+def output_base(input_path, root, output_dir, suffix):
+    """输出路径(不含扩展名)，保持输入相对于root的目录结构"""
+    relative = os.path.relpath(input_path, root)
+    if not os.path.isdir(input_path):
+        relative = os.path.splitext(relative)[0]
+        if relative.endswith('.nii'):
+            relative = relative[:-len('.nii')]
+    return os.path.join(output_dir, relative + suffix)
+
+
+def init_worker(threads):
+    # 每个进程内的并行线程数，避免进程数 x 线程数远超CPU核数
+    import Filters
+    import Noise
+    import Spectral
+    import Store
+    import Volume
+    from Cache import result_cache
+    Volume.WORKERS = Spectral.WORKERS = Filters.WORKERS = Noise.WORKERS = Store.WORKERS = threads
+    # 每个数据只处理一次，不需要计算指纹和缓存中间结果
+    result_cache.enabled = False
+
+
+def process_file(input_path, base, operations, file_format=None, precision=None):
+    """读取、依次处理并保存一个数据，返回清单记录(含各步骤耗时)"""
+    record = {'input': input_path, 'operations': format_operations(operations), 'precision': precision,
+              'status': 'error'}
+    times = {'operations': []}
+    start = time.perf_counter()
+    try:
+        data_manager = DataManager(precision=precision)
+        data_manager.read_data(input_path)
+        if precision is not None:
+            # 命令行指定的精度优先于原生格式文件中保存的精度
+            data_manager.precision = precision
+        times['read'] = time.perf_counter() - start
+        for name, args, kwargs in operations:
+            step_start = time.perf_counter()
+            data_manager = getattr(data_manager, name)(*args, **kwargs)
+            times['operations'].append([name, time.perf_counter() - step_start])
+
+        save_start = time.perf_counter()
+        if file_format is None:
+            file_format = 'vti' if data_manager.ugrid_data is not None else 'png'
+        output = base + '.' + file_format
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        # 先写临时文件再改名，中断时不会留下不完整的结果
+        partial = '%s.part%d.%s' % (base, os.getpid(), file_format)
+        data_manager.save_data(partial)
+        os.replace(partial, output)
+        times['save'] = time.perf_counter() - save_start
+        record.update(status='ok', output=output, shape=list(data_manager.numpy_data.shape),
+                      dtype=str(data_manager.numpy_data.dtype))
+    except Exception as e:
+        record['error'] = '%s: %s' % (type(e).__name__, e)
+        record['traceback'] = traceback.format_exc()
+    times['total'] = time.perf_counter() - start
+    record['times'] = times
+    return record
+
+
+def load_manifest(path):
+    """输入路径 -> 最后一条记录"""
+    records = {}
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 中断时可能写了一半的最后一行
+                    continue
+                records[record['input']] = record
+    return records
+
+
+def is_done(record, operations, precision):
+    return (record is not None and record['status'] == 'ok' and record['operations'] == operations
+            and record.get('precision') == precision and os.path.exists(record['output']))
+
+
+def format_times(times):
+    parts = ['read %.2fs' % times['read']] if 'read' in times else []
+    parts += ['%s %.2fs' % (name, seconds) for name, seconds in times['operations']]
+    if 'save' in times:
+        parts.append('save %.2fs' % times['save'])
+    parts.append('total %.2fs' % times['total'])
+    return '  '.join(parts)
+
+
+def write_report(path, records):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['input', 'output', 'status', 'step', 'seconds'])
+        for record in records:
+            times = record['times']
+            steps = [('read', times.get('read'))] + [tuple(step) for step in times['operations']]
+            steps += [('save', times.get('save')), ('total', times['total'])]
+            for step, seconds in steps:
+                if seconds is not None:
+                    writer.writerow([record['input'], record.get('output', ''), record['status'], step, '%.6f' % seconds])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('inputs', nargs='+', help='数据文件、目录或通配符')
+    parser.add_argument('--ops', required=True, help='以逗号分隔的处理函数，按顺序执行，如 median_blur,gaussian_blur(sigma=3)')
+    parser.add_argument('--output', required=True, help='输出目录，清单也保存在这里')
+    parser.add_argument('--format', default=None, help='输出格式(扩展名)，默认体数据为vti、二维图像为png')
+    parser.add_argument('--suffix', default='', help='输出文件名的后缀')
+    parser.add_argument('--precision', choices=PRECISIONS, default=DEFAULT_PRECISION,
+                        help='处理结果的精度策略：native保持原数据类型，float32/float64为浮点结果的类型')
+    parser.add_argument('--dicom-series', action='store_true', help='每个目录作为一个DICOM切片序列')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='进程数')
+    parser.add_argument('--threads', type=int, default=None, help='每个进程的线程数，默认为CPU核数/进程数')
+    parser.add_argument('--force', action='store_true', help='忽略清单，重新处理所有文件')
+    parser.add_argument('--report', default=None, help='本次运行的耗时保存为CSV')
+    args = parser.parse_args()
+
+    try:
+        operations = parse_operations(args.ops)
+    except ValueError as e:
+        parser.error(str(e))
+    operations_text = format_operations(operations)
+    inputs = find_inputs(args.inputs, args.dicom_series)
+    if not inputs:
+        parser.error('no input files found')
+    file_format = args.format.lstrip('.') if args.format else None
+    threads = args.threads or max((os.cpu_count() or 1) // args.workers, 1)
+
+    os.makedirs(args.output, exist_ok=True)
+    manifest_path = os.path.join(args.output, MANIFEST_NAME)
+    manifest = {} if args.force else load_manifest(manifest_path)
+    pending = [path for path in inputs if not is_done(manifest.get(path), operations_text, args.precision)]
+    print('%d inputs, %d already done, %d workers x %d threads' % (len(inputs), len(inputs) - len(pending),
+                                                                  args.workers, threads))
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(path)) for path in inputs])
+
+    records = []
+    start = time.perf_counter()
+    with open(manifest_path, 'a', encoding='utf-8') as manifest_file, \
+            ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker, initargs=(threads,)) as executor:
+        futures = [executor.submit(process_file, path, output_base(os.path.abspath(path), root, args.output, args.suffix),
+                                   operations, file_format, args.precision) for path in pending]
+        for done, future in enumerate(as_completed(futures), 1):
+            record = future.result()
+            records.append(record)
+            # 每完成一个文件写一行并立即刷新，中断后可从清单继续
+            manifest_file.write(json.dumps({key: value for key, value in record.items() if key != 'traceback'}) + '\n')
+            manifest_file.flush()
+            print('[%d/%d] %s %s  %s' % (done, len(pending), record['status'], record['input'], format_times(record['times'])))
+            if record['status'] != 'ok':
+                print(record['traceback'], file=sys.stderr)
+    elapsed = time.perf_counter() - start
+
+    ok = [record for record in records if record['status'] == 'ok']
+    print('\n%d processed, %d failed, %d skipped in %.1fs' % (len(ok), len(records) - len(ok),
+                                                             len(inputs) - len(pending), elapsed))
+    if ok:
+        # 各步骤在所有文件上的总耗时与平均耗时
+        steps = {}
+        for record in ok:
+            times = record['times']
+            for name, seconds in [('read', times['read'])] + times['operations'] + [('save', times['save'])]:
+                steps.setdefault(name, []).append(seconds)
+        print('%-20s %10s %10s' % ('step', 'total (s)', 'mean (s)'))
+        for name, values in steps.items():
+            print('%-20s %10.2f %10.3f' % (name, sum(values), sum(values) / len(values)))
+        print('%.2f files/s' % (len(ok) / elapsed))
+    if args.report:
+        write_report(args.report, records)
+    return 0 if len(ok) == len(records) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""启动时的导入耗时测试
+
+在新的Python进程中用 -X importtime 导入启动时加载的模块(默认为MyWidget，即main.py导入的全部模块)，
+取多次运行中最快的一次，输出总耗时和自身+子模块耗时最多的模块，并检查推迟导入的库
+(SimpleITK、pyvista、vtk、matplotlib.figure等)没有在启动时被导入。
+超出 --max-seconds 或有库被提前导入时返回非零值，可用于发现启动变慢。
+
+    python benchmark/bench_import.py --repeat 5 --max-seconds 1.5
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 应在第一次使用时才导入的库
+DEFERRED = ['SimpleITK', 'pydicom', 'imageio', 'PIL.Image', 'pyvista', 'pyvistaqt', 'vtk', 'scipy.ndimage',
+            'scipy.fft', 'skimage', 'matplotlib.figure', 'matplotlib.pyplot']
+
+
+def import_times(module):
+    """导入module，返回(总耗时(秒), {模块名: (自身耗时, 累计耗时)}, 导入后sys.modules中的模块名)"""
+    code = 'import sys, %s; print(chr(10).join(sys.modules))' % module
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=ROOT,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if process.returncode != 0:
+        raise RuntimeError(process.stderr.strip().splitlines()[-1])
+    times = {}
+    for line in process.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        selfTime, cumulative, name = line[len('import time:'):].split('|')
+        # 同一模块只在第一次导入时有记录，缩进表示导入层次
+        times[name.strip()] = (int(selfTime) / 1e6, int(cumulative) / 1e6)
+    return times[module][1], times, set(process.stdout.split())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--module', default='MyWidget', help='测试导入的模块')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--top', type=int, default=15, help='输出累计耗时最多的模块数')
+    parser.add_argument('--max-seconds', type=float, default=None, help='总耗时的上限')
+    args = parser.parse_args()
+
+    best = None
+    for _ in range(args.repeat):
+        result = import_times(args.module)
+        if best is None or result[0] < best[0]:
+            best = result
+    total, times, modules = best
+
+    print('%-40s %10s %10s' % ('module', 'self (ms)', 'cum. (ms)'))
+    for name, (selfTime, cumulative) in sorted(times.items(), key=lambda item: -item[1][1])[:args.top]:
+        print('%-40s %10.1f %10.1f' % (name, selfTime * 1e3, cumulative * 1e3))
+    print('import %s: %.3f s (best of %d)' % (args.module, total, args.repeat))
+
+    failed = False
+    # scipy等使用延迟加载的包，子模块不一定出现在importtime的记录中，按sys.modules检查
+    eager = [name for name in DEFERRED if name in modules]
+    if eager:
+        print('imported at startup: ' + ', '.join(eager))
+        failed = True
+    if args.max_seconds is not None and total > args.max_seconds:
+        print('slower than %.3f s' % args.max_seconds)
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,328 @@
+"""DataManager读取与处理函数、离屏渲染的耗时与内存测试，与保存的基准比较
+
+测试项目：
+  - read_data：read_func_dict中的每种格式。slc、DCM、jpg使用data/下自带的文件，
+    其他格式在临时目录中由自带文件或合成体数据写出；无法写出或读取的格式标记为skipped
+  - 处理函数：FFT、秩滤波(最大/最小/中值)、均值与高斯滤波、gray、各种噪声、锐化与轮廓、
+    histogram统计，分别在embryo.slc、cat.jpg与 --sizes 给出大小的合成体数据上运行
+  - 离屏渲染：体绘制(create_volume)与等值面(extract_isosurface)的第一帧
+
+每项取 --repeat 次中最快的耗时，另运行一次用tracemalloc记录峰值内存。numpy数组的内存会被
+统计，VTK内部(读取器、渲染)分配的内存不会。运行时关闭结果缓存，每次都从新的DataManager开始。
+
+    python benchmark/bench_suite.py --save-baseline benchmark/baseline.json
+    python benchmark/bench_suite.py --baseline benchmark/baseline.json --threshold 0.25
+
+给出 --baseline 时，耗时或峰值内存超出基准 --threshold 比例(且差值超过 --min-seconds /
+--min-mb，避免很快的项目受噪声影响)的项目为退化，返回非零值。基准与机器有关，
+应在同一台机器上保存和比较。
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from Cache import result_cache
+from Lazy import lazy_import
+from Manager import DataManager
+
+pyvista = lazy_import('pyvista')
+vtk = lazy_import('vtk')
+sitk = lazy_import('SimpleITK')
+imageio = lazy_import('imageio')
+
+# (名称, 参数)，均为DataManager的处理函数
+VOLUME_OPERATIONS = [
+    ('fft', {}), ('shift_fft', {}), ('fft_phase', {}), ('inverse_fft', {}),
+    ('maximum_filter', {'size': 3}), ('minimum_filter', {'size': 3}), ('median_blur', {}),
+    ('uniform_filter', {'size': 5}), ('gaussian_blur', {'sigma': 2}),
+    ('frequency_filter', {'kind': 'gaussian', 'cutoff': 0.1}),
+    ('gray', {'n': 1}), ('gray', {'n': 0}),
+    ('Salt_noice', {'seed': 0}), ('Gaussian_noice', {'seed': 0}), ('Poisson_noice', {'seed': 0}),
+    ('Speckle_noice', {'seed': 0}),
+    ('sharpenSobel', {}), ('sharpenPrewitt', {}), ('sharpenLaplace', {}),
+]
+# 只用于二维图像的处理函数
+IMAGE_OPERATIONS = VOLUME_OPERATIONS + [('counterDetail', {}), ('embossFilter', {}), ('sharpen2D', {})]
+# 三维格式中按体数据的网格写出的格式，其余为表面网格
+GRID_FORMATS = ['vti', 'vtk', 'vtr', 'vtu', 'pvti', 'pvtr', 'pvtu', 'pvtk', 'nii', 'gz', 'mhd', 'mvol', 'mvolz']
+MESH_FORMATS = ['vtp', 'ply', 'obj']
+IMAGE_FORMATS = ['png', 'tif', 'jpeg', 'bmp']
+
+
+def load(path):
+    dataManager = DataManager()
+    dataManager.read_data(path)
+    return dataManager
+
+
+def synthetic_volume(size):
+    """平滑的合成体数据(uint16)，形状为size^3，与读取的体数据一样为Fortran顺序"""
+    rng = np.random.default_rng(size)
+    coarse = rng.random((8, 8, 8)) * 4000
+    index = np.linspace(0, 7, size)
+    # 由粗网格最近邻放大后加噪声，有等值面与较宽的取值范围
+    volume = coarse[np.ix_(*[np.round(index).astype(int)] * 3)] + rng.normal(0, 50, (size,) * 3)
+    return np.asfortranarray(np.clip(volume, 0, 4095).astype(np.uint16))
+
+
+def write_sample(ext, path, volume, image, surface):
+    """把样本写成ext格式，不能写出时抛出异常"""
+    if ext in ('mvol', 'mvolz'):
+        DataManager(volume).save_data(path)
+        return
+    if ext in ('nii', 'gz', 'mhd'):
+        # SimpleITK的数组为(z, y, x)
+        sitk.WriteImage(sitk.GetImageFromArray(np.ascontiguousarray(volume.T)), path)
+        return
+    if ext in IMAGE_FORMATS or ext in ('DCM', 'dcm', 'jpg'):
+        imageio.imwrite(path, image.squeeze())
+        return
+    if ext in MESH_FORMATS:
+        if ext == 'obj':
+            writer = vtk.vtkOBJWriter()
+            writer.SetFileName(path)
+            writer.SetInputData(surface)
+            writer.Write()
+        else:
+            surface.save(path)
+        return
+    grid = DataManager().convert_numpy_to_grid(volume)
+    if ext in ('vtr', 'pvtr'):
+        grid = grid.cast_to_rectilinear_grid()
+    elif ext in ('vtu', 'pvtu'):
+        grid = grid.cast_to_unstructured_grid()
+    if ext.startswith('p'):
+        writers = {'pvti': vtk.vtkXMLPImageDataWriter, 'pvtr': vtk.vtkXMLPRectilinearGridWriter,
+                   'pvtu': vtk.vtkXMLPUnstructuredGridWriter}
+        if ext not in writers:
+            raise ValueError('no writer for .' + ext)
+        writer = writers[ext]()
+        writer.SetFileName(path)
+        writer.SetInputData(grid)
+        writer.SetNumberOfPieces(2)
+        writer.SetStartPiece(0)
+        writer.SetEndPiece(1)
+        writer.Write()
+    else:
+        grid.save(path)
+
+
+class Case:
+    """一个测试项目：setup()返回run的参数(不计时)，run(arg)为计时的部分"""
+
+    def __init__(self, group, name, run, setup=None) -> None:
+        self.group = group
+        self.name = name
+        self.run = run
+        self.setup = setup or (lambda: None)
+
+
+def reader_cases(workdir, sizes):
+    from Surface import extract_isosurface
+    embryo = os.path.join(ROOT, 'data', 'embryo.slc')
+    skull = os.path.join(ROOT, 'data', 'SKULLBASE.DCM')
+    cat = os.path.join(ROOT, 'data', 'cat.jpg')
+    bundled = {'slc': embryo, 'DCM': skull, 'jpg': cat}
+    image = load(cat).numpy_data
+    cases = []
+    for ext in DataManager().read_func_dict:
+        if ext in GRID_FORMATS:
+            samples = [('%d^3' % size, size) for size in sizes]
+        else:
+            source = skull if ext == 'dcm' else bundled.get(ext, cat if ext in IMAGE_FORMATS else embryo)
+            samples = [(os.path.basename(source), None)]
+        for label, size in samples:
+            name = 'read %s %s' % (ext, label)
+            if ext in bundled:
+                path = bundled[ext]
+            elif ext == 'dcm':
+                path = os.path.join(workdir, 'SKULLBASE.dcm')
+                shutil.copyfile(skull, path)
+            else:
+                path = os.path.join(workdir, 'sample%s.%s' % ('' if size is None else size, 'nii.gz' if ext == 'gz' else ext))
+                try:
+                    volume = synthetic_volume(size) if size else None
+                    surface = None
+                    if ext in MESH_FORMATS:
+                        surface = extract_isosurface(load(embryo).ugrid_data, 100)
+                    write_sample(ext, path, volume, image, surface)
+                except Exception as e:
+                    cases.append(Case('read', name, None, setup=lambda e=e: e))
+                    continue
+            cases.append(Case('read', name, lambda _, path=path: load(path)))
+    return cases
+
+
+def operation_cases(label, dataManager, operations):
+    cases = []
+    numpy_data = dataManager.numpy_data
+    for name, kwargs in operations:
+        text = '%s(%s)' % (name, ', '.join('%s=%r' % item for item in sorted(kwargs.items())))
+        # 每次从新的DataManager开始，频谱与直方图不会沿用上一次的结果
+        cases.append(Case('process', '%s %s' % (text, label),
+                          lambda d, name=name, kwargs=kwargs: getattr(d, name)(**kwargs),
+                          setup=lambda: DataManager(numpy_data)))
+    cases.append(Case('process', 'histogram(bins=256) %s' % label, lambda d: d.histogram(256),
+                      setup=lambda: DataManager(numpy_data)))
+    return cases
+
+
+def render_first_frame(actor):
+    plotter = pyvista.Plotter(off_screen=True, window_size=(512, 512))
+    try:
+        plotter.add_actor(actor)
+        plotter.reset_camera()
+        plotter.screenshot()
+    finally:
+        plotter.close()
+
+
+def render_cases(label, grid):
+    from Surface import extract_isosurface
+    from TransferFunction import TransferFunction, create_volume
+    low, high = (float(v) for v in np.percentile(np.asarray(grid.active_scalars), [1, 99]))
+
+    def volume(_):
+        render_first_frame(create_volume(grid, TransferFunction((low, high))))
+
+    def contour(_):
+        surface = extract_isosurface(grid, (low + high) / 2)
+        mapper = vtk.vtkPolyDataMapper()
+        mapper.SetInputData(surface)
+        actor = vtk.vtkActor()
+        actor.SetMapper(mapper)
+        render_first_frame(actor)
+
+    return [Case('render', 'add_volume %s' % label, volume), Case('render', 'contour %s' % label, contour)]
+
+
+def build_cases(workdir, sizes):
+    cases = reader_cases(workdir, sizes)
+    embryo = load(os.path.join(ROOT, 'data', 'embryo.slc'))
+    cat = load(os.path.join(ROOT, 'data', 'cat.jpg'))
+    cases += operation_cases('embryo.slc', embryo, VOLUME_OPERATIONS)
+    cases += operation_cases('cat.jpg', cat, IMAGE_OPERATIONS)
+    volumes = {'%d^3' % size: DataManager(synthetic_volume(size)) for size in sizes}
+    for label, dataManager in volumes.items():
+        cases += operation_cases(label, dataManager, VOLUME_OPERATIONS)
+    cases += render_cases('embryo.slc', embryo.ugrid_data)
+    for label, dataManager in volumes.items():
+        cases += render_cases(label, dataManager.ugrid_data)
+    return cases
+
+
+def measure(case, repeat):
+    """返回(最快的耗时(秒), 峰值内存(字节))，setup返回异常时抛出该异常"""
+    best = None
+    for _ in range(repeat):
+        arg = case.setup()
+        if isinstance(arg, Exception):
+            raise arg
+        start = time.perf_counter()
+        result = case.run(arg)
+        elapsed = time.perf_counter() - start
+        del result, arg
+        best = elapsed if best is None else min(best, elapsed)
+    arg = case.setup()
+    tracemalloc.start()
+    try:
+        case.run(arg)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def compare(results, baseline, threshold, min_seconds, min_mb):
+    """超出基准的项目 -> 原因列表"""
+    regressions = {}
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None or 'seconds' not in result or 'seconds' not in base:
+            continue
+        reasons = []
+        if result['seconds'] > base['seconds'] * (1 + threshold) and result['seconds'] - base['seconds'] > min_seconds:
+            reasons.append('time %.3fs -> %.3fs' % (base['seconds'], result['seconds']))
+        if result['peak_mb'] > base['peak_mb'] * (1 + threshold) and result['peak_mb'] - base['peak_mb'] > min_mb:
+            reasons.append('memory %.1fMB -> %.1fMB' % (base['peak_mb'], result['peak_mb']))
+        if reasons:
+            regressions[name] = reasons
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='64,128', help='合成体数据的边长，以逗号分隔')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--filter', default=None, help='只运行名称中包含该文本的项目')
+    parser.add_argument('--baseline', default=None, help='与该基准JSON比较')
+    parser.add_argument('--save-baseline', default=None, help='把本次结果保存为基准JSON')
+    parser.add_argument('--threshold', type=float, default=0.25, help='超出基准的比例')
+    parser.add_argument('--min-seconds', type=float, default=0.01, help='耗时退化的最小差值')
+    parser.add_argument('--min-mb', type=float, default=1.0, help='内存退化的最小差值(MB)')
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+
+    result_cache.enabled = False
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+
+    results = {}
+    workdir = tempfile.mkdtemp(prefix='bench_suite_')
+    try:
+        cases = build_cases(workdir, sizes)
+        if args.filter:
+            cases = [case for case in cases if args.filter in case.name]
+        print('%-56s %10s %10s %10s' % ('case', 'time (ms)', 'peak (MB)', 'baseline'))
+        for case in cases:
+            try:
+                seconds, peak = measure(case, args.repeat)
+            except Exception as e:
+                results[case.name] = {'group': case.group, 'skipped': '%s: %s' % (type(e).__name__, e)}
+                print('%-56s skipped (%s)' % (case.name, results[case.name]['skipped']))
+                continue
+            results[case.name] = {'group': case.group, 'seconds': seconds, 'peak_mb': peak / 2 ** 20}
+            base = baseline.get(case.name, {})
+            ratio = '%.2fx' % (seconds / base['seconds']) if base.get('seconds') else ''
+            print('%-56s %10.1f %10.1f %10s' % (case.name, seconds * 1e3, peak / 2 ** 20, ratio))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.save_baseline:
+        machine = {'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+                   'processor': platform.processor(), 'cpu_count': os.cpu_count()}
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump({'machine': machine, 'repeat': args.repeat, 'results': results}, f, indent=1, sort_keys=True)
+        print('baseline saved to %s' % args.save_baseline)
+
+    skipped = [name for name, result in results.items() if 'skipped' in result]
+    if skipped:
+        print('%d skipped' % len(skipped))
+    if args.baseline:
+        regressions = compare(results, baseline, args.threshold, args.min_seconds, args.min_mb)
+        missing = [name for name, result in baseline.items() if 'seconds' in result and 'seconds' not in
+                   results.get(name, {}) and (not args.filter or args.filter in name)]
+        for name, reasons in regressions.items():
+            print('REGRESSION %s: %s' % (name, ', '.join(reasons)))
+        for name in missing:
+            print('MISSING %s: in baseline but not measured' % name)
+        print('%d regressions (threshold %d%%)' % (len(regressions), args.threshold * 100))
+        return 1 if regressions or missing else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+"""分块多线程滤波的吞吐量测试
+
+对data/embryo.slc和合成的体数据，分别用1到N个线程执行各个滤波，
+输出每秒处理的体素数(MVox/s)和相对单次整体调用的加速比，并检查结果完全一致。
+
+    python benchmark/bench_tiling.py --size 512
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scipy import ndimage
+from skimage import filters
+
+from Manager import DataManager
+from Volume import apply_slabwise
+
+FILTERS = {
+    'median_blur': (lambda data: ndimage.median_filter(data, size=3), 1),
+    'gaussian_blur': (lambda data: ndimage.gaussian_filter(data, sigma=5), 20),
+    'maximum_filter': (lambda data: ndimage.maximum_filter(data, size=20), 10),
+    'sharpenSobel': (filters.sobel, 1),
+    'sharpenPrewitt': (filters.prewitt, 1),
+    'sharpenLaplace': (filters.laplace, 1),
+}
+
+
+def load_volumes(size):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    dataManager = DataManager()
+    dataManager.read_data(os.path.join(root, 'data', 'embryo.slc'))
+    volumes = {'embryo.slc': np.asarray(dataManager.numpy_data)}
+    rng = np.random.default_rng(0)
+    synthetic = rng.integers(0, 4096, size=(size, size, size), dtype=np.uint16)
+    volumes['synthetic %d^3' % size] = np.asfortranarray(synthetic)
+    return volumes
+
+
+def timed(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=512, help='合成体数据的边长')
+    parser.add_argument('--max-workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--filters', default=','.join(FILTERS), help='以逗号分隔的滤波名')
+    args = parser.parse_args()
+
+    workers = [1]
+    while workers[-1] * 2 <= args.max_workers:
+        workers.append(workers[-1] * 2)
+    if workers[-1] != args.max_workers:
+        workers.append(args.max_workers)
+
+    print('%-16s %-16s %8s %10s %8s %s' % ('volume', 'filter', 'workers', 'MVox/s', 'speedup', 'identical'))
+    for volumeName, volume in load_volumes(args.size).items():
+        voxels = volume.size / 1e6
+        for name in args.filters.split(','):
+            func, halo = FILTERS[name]
+            # 与DataManager.apply_filter相同，在C顺序的转置视图上计算
+            transposed = lambda data, func=func: func(data.T).T
+            baseline, expected = timed(lambda: transposed(volume), args.repeat)
+            print('%-16s %-16s %8s %10.1f %8.2f %s' % (volumeName, name, 'single', voxels / baseline, 1.0, '-'))
+            for n in workers:
+                elapsed, result = timed(lambda: apply_slabwise(transposed, volume, halo, workers=n), args.repeat)
+                print('%-16s %-16s %8d %10.1f %8.2f %s' % (volumeName, name, n, voxels / elapsed, baseline / elapsed,
+                                                           np.array_equal(result, expected)))
+            del expected
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+import os
+import sys
+
+import pytest
+
+# 测试直接导入仓库根目录下的模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def volume():
+    """(x, y, z)顺序、Fortran连续的小体数据，各轴长度不同以便发现轴顺序错误"""
+    import numpy as np
+    rng = np.random.default_rng(0)
+    return np.asfortranarray(rng.integers(0, 4096, size=(12, 10, 6), dtype=np.int16))
+
+
+@pytest.fixture
+def fresh_cache():
+    """清空全局的处理结果缓存，测试结束后恢复"""
+    from Cache import result_cache
+    enabled = result_cache.enabled
+    result_cache.clear()
+    result_cache.enabled = True
+    result_cache.hits = result_cache.misses = 0
+    yield result_cache
+    result_cache.clear()
+    result_cache.enabled = enabled
@@ -0,0 +1,64 @@
+import numpy as np
+
+from Manager import DataManager
+
+
+def test_put_keeps_result_writable(fresh_cache, volume):
+    """缓存结果后调用者的数组仍可写，原地修改不影响缓存中的结果"""
+    source = DataManager(volume)
+    result = source.maximum_filter(3)
+    assert result.numpy_data.flags.writeable
+    expected = np.array(result.numpy_data)
+
+    result.update_region(np.s_[0:2, :, :], 0)
+    assert np.all(result.numpy_data[0:2] == 0)
+    assert fresh_cache.hits == 0
+
+    again = source.maximum_filter(3)
+    assert fresh_cache.hits == 1
+    np.testing.assert_array_equal(again.numpy_data, expected)
+
+
+def test_cache_hit_can_be_edited(fresh_cache, volume):
+    """缓存命中的结果(只读)修改时先拷贝，其他共享该结果的对象不变"""
+    source = DataManager(volume)
+    first = source.maximum_filter(3)
+    second = source.maximum_filter(3)
+    third = source.maximum_filter(3)
+    assert fresh_cache.hits == 2
+    expected = np.array(third.numpy_data)
+
+    second.update_region(np.s_[:, :, 0], 7)
+    assert np.all(second.numpy_data[:, :, 0] == 7)
+    np.testing.assert_array_equal(second.ugrid_data['values'], second.numpy_data.ravel(order='F'))
+    np.testing.assert_array_equal(first.numpy_data, expected)
+    np.testing.assert_array_equal(third.numpy_data, expected)
+
+
+def test_fingerprint_changes_after_edit(fresh_cache, volume):
+    source = DataManager(np.array(volume, order='F'))
+    before = source.fingerprint()
+    source.update_region(np.s_[3, 4, 5], 1)
+    assert source.fingerprint() != before
+
+
+def test_memmap_edit_invalidates_cache(fresh_cache, tmp_path, volume):
+    """写时复制的内存映射数据(文件身份作为指纹)修改后不会命中修改前的缓存结果"""
+    path = str(tmp_path / 'volume.mvol')
+    DataManager(volume).save_data(path)
+    source = DataManager()
+    source.read_data(path)
+    assert isinstance(source.numpy_data, np.memmap)
+    before = source.maximum_filter(3)
+
+    source.update_region(np.s_[:, :, 2], 10000)
+    after = source.maximum_filter(3)
+    assert fresh_cache.hits == 0
+    assert np.all(after.numpy_data[:, :, 1:4] == 10000)
+    assert not np.array_equal(before.numpy_data, after.numpy_data)
+
+    # 文件没有被修改，重新读取后仍命中修改前的结果
+    reopened = DataManager()
+    reopened.read_data(path)
+    np.testing.assert_array_equal(reopened.maximum_filter(3).numpy_data, before.numpy_data)
+    assert fresh_cache.hits == 1
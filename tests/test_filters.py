@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from scipy import ndimage
+
+import Filters
+from Manager import DataManager
+
+
+def test_gaussian_fft_float64_matches_spatial():
+    """float64数据的FFT路径保持float64精度"""
+    rng = np.random.default_rng(0)
+    data = 1e6 + rng.random((40, 36, 30))
+    result = Filters.gaussian_filter(data, 4.0, method='fft')
+    assert result.dtype == np.float64
+    np.testing.assert_allclose(result, ndimage.gaussian_filter(data, 4.0), rtol=0, atol=1e-7)
+
+
+def integer_volumes():
+    rng = np.random.default_rng(0)
+    shape = (40, 36, 30)
+    ct = np.where(rng.random(shape) < 0.7, -1024, rng.integers(-1024, 2000, shape)).astype(np.int16)
+    return [rng.integers(0, 256, shape).astype(np.uint8), rng.integers(0, 4096, shape).astype(np.uint16), ct,
+            np.full(shape, 100, dtype=np.uint8)]
+
+
+@pytest.mark.parametrize('data', integer_volumes(), ids=['uint8', 'uint16', 'ct', 'constant'])
+@pytest.mark.parametrize('sigma', [2.0, 5.0, (3.0, 1.5, 0.0)])
+def test_gaussian_fft_integer_equals_ndimage(data, sigma):
+    """整数数据的FFT路径与ndimage逐轴截断的结果完全相同"""
+    result = Filters.gaussian_filter(data, sigma, method='fft')
+    assert result.dtype == data.dtype
+    np.testing.assert_array_equal(result, ndimage.gaussian_filter(data, sigma))
+
+
+def test_gaussian_fft_integer_blocks(monkeypatch):
+    """分块计算与整体计算结果相同"""
+    data = integer_volumes()[1]
+    whole = Filters.gaussian_filter(data, 3.0, method='fft')
+    monkeypatch.setattr(Filters, 'FFT_BLOCK_BYTES', 1)
+    np.testing.assert_array_equal(Filters.gaussian_filter(data, 3.0, method='fft'), whole)
+
+
+def test_gaussian_blur_same_in_memory_and_mapped(fresh_cache, tmp_path):
+    """同一体数据在内存中(FFT)与内存映射(分块空间卷积)时gaussian_blur结果相同"""
+    rng = np.random.default_rng(1)
+    shape = (160, 160, 160)
+    volume = np.where(rng.random(shape) < 0.7, -1024, rng.integers(-1024, 2000, shape)).astype(np.int16, order='F')
+    assert Filters.gaussian_method(volume.shape, 24.0, volume.dtype) == 'fft'
+    in_memory = DataManager(volume).gaussian_blur(24)
+    path = str(tmp_path / 'volume.mvol')
+    DataManager(volume).save_data(path)
+    fresh_cache.clear()
+    mapped = DataManager()
+    mapped.read_data(path)
+    assert isinstance(mapped.numpy_data, np.memmap)
+    np.testing.assert_array_equal(mapped.gaussian_blur(24).numpy_data, in_memory.numpy_data)
@@ -0,0 +1,32 @@
+import numpy as np
+
+import Histogram
+from Manager import DataManager
+
+
+def test_preview_approximates_full_histogram():
+    """抽样预览的总数与体素个数一致，分布与完整数据接近"""
+    rng = np.random.default_rng(1)
+    data = np.asfortranarray(rng.normal(1000, 200, size=(96, 80, 72)).astype(np.int16))
+    counts, edges = Histogram.preview(data).binned(32)
+    assert abs(counts.sum() - data.size) <= 32
+    centers = (edges[:-1] + edges[1:]) / 2
+    assert abs(np.average(centers, weights=counts) - data.mean()) < 10
+
+
+def test_preview_histogram_uses_full_result_when_computed(volume):
+    """完整直方图统计后预览直接返回完整结果"""
+    manager = DataManager(volume)
+    assert not manager.has_histogram()
+    counts, edges = manager.histogram(16)
+    assert manager.has_histogram()
+    preview_counts, preview_edges = manager.preview_histogram(16)
+    np.testing.assert_array_equal(preview_counts, counts)
+    np.testing.assert_array_equal(preview_edges, edges)
+
+
+def test_small_data_preview_is_exact(volume):
+    counts, edges = Histogram.preview(volume).binned(16)
+    expected_counts, expected_edges = Histogram.Histogram.compute(volume).binned(16)
+    np.testing.assert_array_equal(counts, expected_counts)
+    np.testing.assert_array_equal(edges, expected_edges)
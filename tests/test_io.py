@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+
+from Manager import DataManager
+from Store import save_store
+
+SPACING = (0.5, 0.75, 2.0)
+ORIGIN = (-10.0, 20.0, 5.5)
+
+
+def make_manager(volume, precision=None):
+    manager = DataManager(volume, precision=precision)
+    manager.ugrid_data.spacing = SPACING
+    manager.ugrid_data.origin = ORIGIN
+    return manager
+
+
+@pytest.mark.parametrize('suffix', ['.nii', '.nii.gz'])
+def test_nifti_round_trip(tmp_path, volume, suffix):
+    """读取→保存→读取后体素顺序、spacing与origin不变"""
+    path = str(tmp_path / ('volume' + suffix))
+    make_manager(volume).save_data(path)
+
+    loaded = DataManager()
+    loaded.read_data(path)
+    assert loaded.numpy_data.shape == volume.shape
+    np.testing.assert_array_equal(loaded.numpy_data, volume)
+    np.testing.assert_allclose(loaded.ugrid_data.spacing, SPACING)
+    np.testing.assert_allclose(loaded.ugrid_data.origin, ORIGIN, atol=1e-5)
+
+    resaved = str(tmp_path / ('resaved' + suffix))
+    loaded.save_data(resaved)
+    again = DataManager()
+    again.read_data(resaved)
+    np.testing.assert_array_equal(again.numpy_data, volume)
+    np.testing.assert_allclose(again.ugrid_data.spacing, SPACING)
+    np.testing.assert_allclose(again.ugrid_data.origin, ORIGIN, atol=1e-5)
+
+
+@pytest.mark.parametrize('suffix', ['.mvol', '.mvolz'])
+def test_store_round_trip(tmp_path, volume, suffix):
+    """原生格式保存体素、spacing/origin与处理历史，处理结果继承spacing/origin"""
+    path = str(tmp_path / ('volume' + suffix))
+    result = make_manager(volume).maximum_filter(3)
+    np.testing.assert_allclose(result.ugrid_data.spacing, SPACING)
+    np.testing.assert_allclose(result.ugrid_data.origin, ORIGIN)
+    result.save_data(path)
+
+    loaded = DataManager()
+    loaded.read_data(path)
+    np.testing.assert_array_equal(loaded.numpy_data, result.numpy_data)
+    np.testing.assert_allclose(loaded.ugrid_data.spacing, SPACING)
+    np.testing.assert_allclose(loaded.ugrid_data.origin, ORIGIN)
+    assert [entry['name'] for entry in loaded.history] == ['maximum_filter']
+    assert loaded.fingerprint() == result.fingerprint()
+
+
+def test_store_restores_precision(tmp_path, volume):
+    """原生格式读取时恢复保存时的精度策略"""
+    path = str(tmp_path / 'volume.mvol')
+    make_manager(volume, precision='float64').save_data(path)
+
+    loaded = DataManager(precision='float32')
+    loaded.read_data(path)
+    assert loaded.precision == 'float64'
+
+
+def test_store_overwrite_reopened_file(tmp_path, volume):
+    """覆盖正被内存映射的文件时先写临时文件再替换，已打开的数据不受影响"""
+    path = str(tmp_path / 'volume.mvol')
+    make_manager(volume).save_data(path)
+    loaded = DataManager()
+    loaded.read_data(path)
+    assert isinstance(loaded.numpy_data, np.memmap)
+
+    loaded.Gaussian_noice(10.0, seed=np.int64(1)).save_data(path)
+    np.testing.assert_array_equal(loaded.numpy_data, volume)
+    assert [p.name for p in tmp_path.iterdir()] == ['volume.mvol']
+
+    again = DataManager()
+    again.read_data(path)
+    assert again.history[-1]['args'] == [10.0]
+    assert again.history[-1]['kwargs'] == {'seed': 1}
+
+
+def test_store_failed_save_keeps_old_file(tmp_path, volume):
+    path = str(tmp_path / 'volume.mvol')
+    make_manager(volume).save_data(path)
+    with pytest.raises(TypeError):
+        save_store(path, volume, metadata={'history': {(1, 2): 'tuple keys are not valid json'}})
+    loaded = DataManager()
+    loaded.read_data(path)
+    np.testing.assert_array_equal(loaded.numpy_data, volume)
+    assert [p.name for p in tmp_path.iterdir()] == ['volume.mvol']
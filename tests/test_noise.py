@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+import Noise
+
+
+def test_gaussian_int32_near_limits_does_not_wrap():
+    """int32接近2**31的数据加噪声后截断到取值范围，不会溢出变成负数"""
+    info = np.iinfo(np.int32)
+    data = np.full((64, 64), info.max - 3, dtype=np.int32)
+    data[:32] = info.min + 3
+    noisy = Noise.gaussian(data, sigma=100.0, seed=1)
+    assert noisy.dtype == np.int32
+    assert np.all(noisy[32:] > 0) and np.all(noisy[:32] < 0)
+    assert noisy.max() == info.max and noisy.min() == info.min
+
+
+def test_gaussian_int32_keeps_precision():
+    """int32大数值上的小噪声不受float32尾数(24位)限制"""
+    data = np.full(4096, 1 << 30, dtype=np.int32) + np.arange(4096, dtype=np.int32)
+    noisy = Noise.gaussian(data, sigma=0.0, seed=1)
+    np.testing.assert_array_equal(noisy, data)
+
+
+@pytest.mark.parametrize('func', [Noise.gaussian, Noise.speckle])
+def test_float64_keeps_precision(func):
+    """float64数据在float64上计算，噪声为0时结果与输入相同"""
+    data = np.linspace(1000.0, 1001.0, 10001)
+    noisy = func(data, sigma=0.0, seed=1)
+    assert noisy.dtype == np.float64
+    np.testing.assert_array_equal(noisy, data)
+
+
+def test_float64_noise_statistics():
+    data = np.full(1 << 16, 1e6 + 1e-3)
+    noisy = Noise.gaussian(data, sigma=1e-6, seed=1)
+    assert abs(float(np.mean(noisy - data))) < 1e-7
+    assert abs(float(np.std(noisy - data)) - 1e-6) < 1e-7
+
+
+def test_int64_clip_limits_are_in_range():
+    low, high = Noise.clip_limits(np.int64, np.dtype(np.float64))
+    assert int(high) <= np.iinfo(np.int64).max and int(low) >= np.iinfo(np.int64).min
+
+
+def test_seed_is_reproducible():
+    data = np.arange(1000, dtype=np.int32).reshape(10, 100)
+    np.testing.assert_array_equal(Noise.gaussian(data, sigma=5.0, seed=3), Noise.gaussian(data, sigma=5.0, seed=3))
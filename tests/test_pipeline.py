@@ -0,0 +1,67 @@
+import numpy as np
+
+from Manager import DataManager
+
+
+def test_lazy_and_eager_use_separate_keys(fresh_cache, volume):
+    """融合计算的结果不会作为逐个调用的结果命中(两者可能相差几个灰度级)，反之亦然"""
+    source = DataManager(volume)
+    eager = source.gaussian_blur(2).maximum_filter(3)
+    lazy = source.lazy().gaussian_blur(2).maximum_filter(3).compute()
+    assert fresh_cache.hits == 0
+    assert lazy.fingerprint() != eager.fingerprint()
+    assert np.abs(lazy.numpy_data.astype(int) - eager.numpy_data.astype(int)).max() <= 2
+
+    again = source.lazy().gaussian_blur(2).maximum_filter(3).compute()
+    assert fresh_cache.hits == 1
+    np.testing.assert_array_equal(again.numpy_data, lazy.numpy_data)
+    eager_again = source.gaussian_blur(2).maximum_filter(3)
+    np.testing.assert_array_equal(eager_again.numpy_data, eager.numpy_data)
+
+
+def test_lazy_matches_eager_for_exact_stages(fresh_cache, volume):
+    source = DataManager(volume)
+    eager = source.median_blur().maximum_filter(3)
+    lazy = source.lazy().median_blur().maximum_filter(3).compute()
+    np.testing.assert_array_equal(lazy.numpy_data, eager.numpy_data)
+
+
+def test_unseeded_noise_is_not_cached(fresh_cache, volume):
+    source = DataManager(volume)
+    first = source.lazy().Gaussian_noice(50.0).compute()
+    second = source.lazy().Gaussian_noice(50.0).compute()
+    assert fresh_cache.hits == 0
+    assert not np.array_equal(first.numpy_data, second.numpy_data)
+
+
+def test_seeded_noise_is_cached(fresh_cache, volume):
+    """给出seed(关键字或按位置)的噪声结果可以缓存"""
+    source = DataManager(volume)
+    first = source.lazy().Gaussian_noice(50.0, seed=4).compute()
+    second = source.lazy().Gaussian_noice(50.0, seed=4).compute()
+    assert fresh_cache.hits == 1
+    np.testing.assert_array_equal(first.numpy_data, second.numpy_data)
+    source.lazy().Salt_noice(0.2, 7).compute()
+    source.lazy().Salt_noice(0.2, 7).compute()
+    assert fresh_cache.hits == 2
+
+
+def test_lazy_gray_float64_precision(fresh_cache, volume):
+    """float64策略下整数数据的gray与逐个调用相同(在float64中计算)"""
+    source = DataManager(volume.astype(np.uint16), precision='float64')
+    eager = source.gray(1)
+    lazy = source.lazy().gray(1).compute()
+    assert lazy.numpy_data.dtype == eager.numpy_data.dtype == np.float64
+    np.testing.assert_allclose(lazy.numpy_data, eager.numpy_data, rtol=1e-12, atol=0)
+
+
+def test_lazy_inverse_fft_uses_source_spectrum(fresh_cache, volume):
+    """惰性流水线中fft之后的inverse_fft使用fft对应的频谱，与逐个调用相同"""
+    source = DataManager(volume)
+    eager = source.shift_fft().inverse_fft()
+    lazy = source.lazy().shift_fft().inverse_fft().compute()
+    np.testing.assert_array_equal(lazy.numpy_data, eager.numpy_data)
+
+    shown = source.lazy().fft().compute()
+    assert shown.source_spectrum is not None
+    np.testing.assert_array_equal(shown.inverse_fft().numpy_data, eager.numpy_data)